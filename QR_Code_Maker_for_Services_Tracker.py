@@ -7,13 +7,20 @@ Created on Sat May 31 10:17:07 2025
 
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
-import qrcode
 import base64
 import hashlib
-from cryptography.fernet import Fernet
 import json
+import csv
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
+from html import escape
+
+from Services_Tracing import span
 
 def get_fernet_key_from_pin(pin, salt=None):
     """Derive a Fernet key from PIN using PBKDF2 for better security."""
@@ -37,9 +44,418 @@ def get_fernet_key_from_pin(pin, salt=None):
 
 def encrypt_data(data, pin):
     """Encrypt data using PIN-derived key."""
-    key = get_fernet_key_from_pin(pin)
-    f = Fernet(key)
-    return f.encrypt(data.encode('utf-8')).decode('utf-8')
+    return encrypt_with_key(data, get_fernet_key_from_pin(pin))
+
+def encrypt_with_key(data, key):
+    """Encrypt data with an already derived key (derivation is the slow part)."""
+    from cryptography.fernet import Fernet
+    return Fernet(key).encrypt(data.encode('utf-8')).decode('utf-8')
+
+# ------------------ QR Building ---------------------
+def build_payload(student, service="", default_duration=30, goal_id="", qr_type="service", created=None):
+    """QR JSON payload (schema v1) for one student card."""
+    payload = {
+        "v": 1,  # Schema version
+        "type": qr_type,
+        "student": student,
+        "service": service,
+        "default_duration": int(default_duration or 30),
+        "created": created or datetime.now().isoformat()
+    }
+    if goal_id:
+        payload["goal_id"] = goal_id
+    return payload
+
+def encode_payload(payload, key=None):
+    """Compact JSON text for a payload, encrypted when a key is given."""
+    text = json.dumps(payload, separators=(',', ':'))
+    return encrypt_with_key(text, key) if key else text
+
+@lru_cache(maxsize=None)
+def label_font(size=20):
+    """Font for card labels, loaded once per size."""
+    from PIL import ImageFont
+    # Use system font, fallback if arial not found
+    try:
+        return ImageFont.truetype("arial.ttf", size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:  # Pillow < 10.1 has a single fixed-size default
+            return ImageFont.load_default()
+
+LABEL_HEIGHT = 40  # Label strip above the QR on full-size cards, in pixels
+LABEL_FONT_SIZE = 20
+
+def label_image(text, width, height=LABEL_HEIGHT, size=LABEL_FONT_SIZE, mode="RGB"):
+    """White strip with text centred horizontally (left-aligned if too wide)."""
+    from PIL import Image
+    label_img = Image.new(mode, (width, height), "white")
+    try:
+        from PIL import ImageDraw
+        draw = ImageDraw.Draw(label_img)
+        font = label_font(size)
+        tw = draw.textlength(text, font=font)
+        tx = (width - tw)//2 if tw < width else 0
+        draw.text((tx, (height - size)//2), text, fill="black", font=font)
+    except Exception:
+        pass  # Draw nothing if font fails
+    return label_img
+
+def make_qr(data, box_size=10):
+    """qrcode.QRCode for data at the card error-correction level."""
+    import qrcode
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=box_size)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+def render_qr(data, label="", qr=None):
+    """QR code image for data, with the label printed above it when given."""
+    from PIL import Image
+    qr_img = (qr or make_qr(data)).make_image(fill_color="black", back_color="white").convert("RGB")
+
+    # Add label above QR code (if present)
+    if label:
+        img_w, img_h = qr_img.size
+        label_img = label_image(label, img_w)
+        combined = Image.new("RGB", (img_w, img_h+LABEL_HEIGHT), "white")
+        combined.paste(label_img, (0,0))
+        combined.paste(qr_img, (0,LABEL_HEIGHT))
+        qr_img = combined
+    return qr_img
+
+def qr_svg(matrix, label="", module=10, label_height=LABEL_HEIGHT):
+    """SVG document for a QR module matrix (border included), label above it as text.
+
+    Dark modules are one path of horizontal runs, so the file stays small and
+    prints sharp at any size.
+    """
+    size = len(matrix) * module
+    top = label_height if label else 0
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if row[x]:
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                runs.append(f"M{start * module} {top + y * module}h{(x - start) * module}v{module}h-{(x - start) * module}z")
+            else:
+                x += 1
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size + top}" '
+        f'viewBox="0 0 {size} {size + top}" shape-rendering="crispEdges">',
+        f'<rect width="{size}" height="{size + top}" fill="white"/>',
+    ]
+    if label:
+        parts.append(f'<text x="{size / 2:g}" y="{top * 0.75:g}" font-family="Arial, sans-serif" '
+                     f'font-size="{top / 2:g}" text-anchor="middle">{escape(label, quote=False)}</text>')
+    parts.append(f'<path fill="black" d="{"".join(runs)}"/>')
+    parts.append("</svg>")
+    return "\n".join(parts) + "\n"
+
+class QRCard:
+    """One encoded card. The QR matrix is computed once; the PNG image and SVG are built on first use."""
+
+    def __init__(self, data, label=""):
+        self.data = data
+        self.label = label
+        self.qr = make_qr(data)
+        self._image = None
+        self._svg = None
+
+    def image(self):
+        """Full-size RGB image with the label strip, as written to PNG files."""
+        if self._image is None:
+            self._image = render_qr(self.data, self.label, self.qr)
+        return self._image
+
+    def svg(self):
+        if self._svg is None:
+            self._svg = qr_svg(self.qr.get_matrix(), self.label)
+        return self._svg
+
+    def preview(self, size=300):
+        """The card laid out as image() but size pixels wide, drawn straight from the module matrix.
+
+        The label strip is scaled with the QR, so the preview has the printed card's proportions.
+        """
+        from PIL import Image
+        matrix = self.qr.get_matrix()
+        n = len(matrix)
+        modules = Image.frombytes("L", (n, n), bytes(0 if dark else 255 for row in matrix for dark in row))
+        modules = modules.resize((size, size), Image.NEAREST)
+        if not self.label:
+            return modules
+        scale = size / (n * self.qr.box_size)
+        strip = round(LABEL_HEIGHT * scale)
+        card = Image.new("L", (size, size + strip), "white")
+        card.paste(label_image(self.label, size, strip, max(1, round(LABEL_FONT_SIZE * scale)), mode="L"), (0, 0))
+        card.paste(modules, (0, strip))
+        return card
+
+    def save(self, path):
+        """Write the card as SVG or (by default) PNG, going by the file extension."""
+        if path.lower().endswith(".svg"):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.svg())
+        else:
+            self.image().save(path)
+
+CARD_CACHE_SIZE = 64
+
+class CardCache:
+    """Recently built cards keyed by a hash of their content.
+
+    The key covers the payload (except its "created" time), the label, the
+    encryption key and the rendering options, so regenerating an unchanged
+    card returns the card already built, ciphertext and all.
+    """
+
+    def __init__(self, max_entries=CARD_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cards = OrderedDict()
+
+    @staticmethod
+    def content_key(payload, label="", key=None, **options):
+        content = {k: v for k, v in payload.items() if k != "created"}
+        blob = json.dumps([content, label, options], sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(blob)
+        if key:
+            digest.update(hashlib.sha256(key).digest())
+        return digest.hexdigest()
+
+    def get(self, payload, label="", key=None, **options):
+        """Cached card for this content, encoding and building it on a miss."""
+        cache_key = self.content_key(payload, label, key, **options)
+        card = self._cards.get(cache_key)
+        if card is not None:
+            self.hits += 1
+            self._cards.move_to_end(cache_key)
+            return card
+        self.misses += 1
+        card = QRCard(encode_payload(payload, key), label)
+        self._cards[cache_key] = card
+        while len(self._cards) > self.max_entries:
+            self._cards.popitem(last=False)
+        return card
+
+@lru_cache(maxsize=4)
+def pin_key(pin):
+    """PIN-derived key, kept for the few PINs used this session (derivation takes ~0.1s)."""
+    return get_fernet_key_from_pin(pin)
+
+# ------------------ Batch Mode ---------------------
+# Roster CSV columns: student (required), service, default_duration (or duration),
+# goal_id, type and label. Unknown columns are ignored.
+BATCH_CHUNK_CARDS = 32   # Cards sent to a worker at a time
+BATCH_CHUNKS_PER_WORKER = 4  # Chunks queued per worker; bounds memory however long the roster is
+
+def read_roster(path):
+    """Yield roster rows as dicts with lower-case keys, skipping rows without a student.
+
+    Each row also carries its line number in the file under "_line", for error messages.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            row = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+            if row.get("student"):
+                row["_line"] = reader.line_num
+                yield row
+
+def card_filename(index, row, ext="png"):
+    """File name for the index-th card: number, student, service and goal, filesystem-safe."""
+    parts = [f"{index:05d}", row.get("student", ""), row.get("service", ""), row.get("goal_id", "")]
+    name = "_".join(p for p in parts if p)
+    return re.sub(r"[^A-Za-z0-9._-]+", "-", name) + "." + ext
+
+def roster_cards(rows, out_dir, key=None, qr_type="service", created=None, ext="png", errors=None):
+    """Yield (path, data, label) for each roster row, payloads built like generate_qr.
+
+    A row that cannot be encoded (e.g. a duration that is not a number) is
+    skipped and ("line N", reason) appended to errors; without an errors list
+    it raises ValueError naming the line instead.
+    """
+    created = created or datetime.now().isoformat()
+    for index, row in enumerate(rows, 1):
+        try:
+            payload = build_payload(row["student"], row.get("service", ""),
+                                    row.get("default_duration") or row.get("duration") or 30,
+                                    row.get("goal_id", ""), row.get("type") or qr_type, created)
+        except (TypeError, ValueError) as e:
+            where = f"line {row.get('_line', index)}"
+            if errors is None:
+                raise ValueError(f"Roster {where}: {e}") from None
+            errors.append((where, str(e)))
+            continue
+        yield os.path.join(out_dir, card_filename(index, row, ext)), encode_payload(payload, key), row.get("label", "")
+
+def render_cards(cards):
+    """Render and save a chunk of (path, data, label) cards; runs in a worker process."""
+    for path, data, label in cards:
+        QRCard(data, label).save(path)
+    return len(cards)
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def generate_batch(roster_path, out_dir, pin=None, qr_type="service", workers=None, progress=None, ext="png"):
+    """Write one QR card per roster row into out_dir, as PNG or (ext="svg") SVG.
+
+    The PIN key is derived once for the whole batch. Rows are read, encoded
+    and rendered in a stream across a process pool, with only a few chunks in
+    flight, so rosters of any length run in constant memory. progress(done)
+    is called as chunks finish. Rows that cannot be encoded are skipped.
+    Returns {"cards", "seconds", "cards_per_s", "skipped"}, skipped being
+    roster_cards' (line, reason) list.
+    """
+    with span("qr.batch") as batch_span:
+        result = _generate_batch(roster_path, out_dir, pin, qr_type, workers, progress, ext)
+        batch_span.set(cards=result["cards"])
+    return result
+
+def _generate_batch(roster_path, out_dir, pin, qr_type, workers, progress, ext):
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+    key = get_fernet_key_from_pin(pin) if pin else None
+    skipped = []
+    cards = roster_cards(read_roster(roster_path), out_dir, key, qr_type, ext=ext, errors=skipped)
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        limit = workers * BATCH_CHUNKS_PER_WORKER
+        pending = set()
+        for chunk in _chunks(cards, BATCH_CHUNK_CARDS):
+            if len(pending) >= limit:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done += future.result()
+                if progress:
+                    progress(done)
+            pending.add(pool.submit(render_cards, chunk))
+        for future in wait(pending).done:
+            done += future.result()
+    if progress:
+        progress(done)
+    seconds = time.perf_counter() - start
+    return {"cards": done, "seconds": seconds, "cards_per_s": done / seconds if seconds else 0.0, "skipped": skipped}
+
+def skipped_text(skipped, limit=10):
+    """Lines listing skipped roster rows for a summary message ("" when none)."""
+    if not skipped:
+        return ""
+    lines = [f"{where}: {reason}" for where, reason in skipped[:limit]]
+    if len(skipped) > limit:
+        lines.append(f"... and {len(skipped) - limit} more")
+    return f"\n\nSkipped {len(skipped)} roster rows:\n" + "\n".join(lines)
+
+# ------------------ Label Sheets ---------------------
+PAGE_SIZES = {"Letter": (8.5, 11.0), "A4": (8.27, 11.69)}  # Inches
+SHEET_LABEL_FRACTION = 0.15  # Share of a cell's height used for the label text
+
+def sheet_cards(source, pin=None, qr_type="service", errors=None):
+    """Cards for compose_sheets: (data, label) per roster row, or PNG paths from a folder of cards.
+
+    Roster rows that cannot be encoded are handled as in roster_cards.
+    """
+    if os.path.isdir(source):
+        return (os.path.join(source, name) for name in sorted(os.listdir(source))
+                if name.lower().endswith(".png"))
+    key = get_fernet_key_from_pin(pin) if pin else None
+    return ((data, label) for _, data, label in roster_cards(read_roster(source), "", key, qr_type, errors=errors))
+
+def sheet_cell(card, width, height):
+    """One card drawn at cell size: a QR at whole-pixel modules under its label, or a scaled PNG."""
+    from PIL import Image
+    if isinstance(card, str):
+        with Image.open(card) as img:
+            img = img.convert("L")
+            img.thumbnail((width, height), Image.LANCZOS)
+            return img
+    data, label = card
+    label_h = int(height * SHEET_LABEL_FRACTION) if label else 0
+    qr = make_qr(data, box_size=1)
+    modules = qr.modules_count + 2 * qr.border
+    qr.box_size = max(1, min(width, height - label_h) // modules)
+    qr_img = qr.make_image(fill_color="black", back_color="white").get_image().convert("L")
+    if not label:
+        return qr_img
+    cell = Image.new("L", (max(width, qr_img.width), label_h + qr_img.height), "white")
+    cell.paste(label_image(label, cell.width, label_h, int(label_h * 0.6), mode="L"), (0, 0))
+    cell.paste(qr_img, ((cell.width - qr_img.width) // 2, label_h))
+    return cell
+
+def compose_sheets(cards, out_path, cols=3, rows=4, margin=0.5, gap=0.25, dpi=300,
+                   page_size=PAGE_SIZES["Letter"], progress=None):
+    """Lay cards out cols x rows per page and write each page as soon as it is full.
+
+    out_path ending in .pdf gets one multi-page PDF (pages appended one at a
+    time); anything else is a folder of page_001.png, page_002.png, ... Only
+    the page being filled is held in memory, so the number of cards is
+    unbounded. Margins and gaps are in inches. progress(pages) is called
+    after each page. Returns {"cards", "pages", "seconds"}.
+    """
+    with span("qr.sheets") as sheets_span:
+        result = _compose_sheets(cards, out_path, cols, rows, margin, gap, dpi, page_size, progress)
+        sheets_span.set(cards=result["cards"], pages=result["pages"])
+    return result
+
+def _compose_sheets(cards, out_path, cols, rows, margin, gap, dpi, page_size, progress):
+    from PIL import Image
+    start = time.perf_counter()
+    page_w, page_h = (round(v * dpi) for v in page_size)
+    left = top = round(margin * dpi)
+    gap_px = round(gap * dpi)
+    cell_w = (page_w - 2 * left - (cols - 1) * gap_px) // cols
+    cell_h = (page_h - 2 * top - (rows - 1) * gap_px) // rows
+    if cell_w <= 0 or cell_h <= 0:
+        raise ValueError("Margins and gaps leave no room for the grid")
+    pdf = out_path.lower().endswith(".pdf")
+    if not pdf:
+        os.makedirs(out_path, exist_ok=True)
+
+    pages = count = 0
+    page = None
+    for card in cards:
+        slot = count % (cols * rows)
+        if slot == 0:
+            page = Image.new("L", (page_w, page_h), "white")
+        cell = sheet_cell(card, cell_w, cell_h)
+        x = left + (slot % cols) * (cell_w + gap_px) + (cell_w - cell.width) // 2
+        y = top + (slot // cols) * (cell_h + gap_px) + (cell_h - cell.height) // 2
+        page.paste(cell, (x, y))
+        count += 1
+        if count % (cols * rows) == 0:
+            pages = _save_sheet(page, out_path, pages, pdf, dpi, progress)
+            page = None
+    if page is not None:
+        pages = _save_sheet(page, out_path, pages, pdf, dpi, progress)
+    return {"cards": count, "pages": pages, "seconds": time.perf_counter() - start}
+
+def _save_sheet(page, out_path, pages, pdf, dpi, progress):
+    from PIL import Image
+    # Pure black and white: lossless CCITT in PDFs and small PNGs, crisp QR edges
+    page = page.convert("1", dither=Image.Dither.NONE)
+    if pdf:
+        page.save(out_path, "PDF", resolution=dpi, append=pages > 0)
+    else:
+        page.save(os.path.join(out_path, f"page_{pages + 1:03d}.png"), dpi=(dpi, dpi))
+    if progress:
+        progress(pages + 1)
+    return pages + 1
 
 class QRCodeGeneratorApp(tk.Tk):
     def __init__(self):
@@ -148,9 +564,17 @@ class QRCodeGeneratorApp(tk.Tk):
         self.gen_btn.pack(pady=(10,8))
 
         self.save_btn = tk.Button(self.content, text="Save QR Code", command=self.save_qr, font=("Arial", 14), width=22, state=tk.DISABLED, bg="#6699FF")
-        self.save_btn.pack(pady=(5,20))
+        self.save_btn.pack(pady=(5,8))
+
+        self.batch_btn = tk.Button(self.content, text="Batch from Roster CSV...", command=self.batch_generate, font=("Arial", 14), width=22, bg="#FFCC66")
+        self.batch_btn.pack(pady=(5,2))
+        self.sheet_btn = tk.Button(self.content, text="Compose Label Sheets...", command=lambda: SheetDialog(self), font=("Arial", 14), width=22, bg="#CC99FF")
+        self.sheet_btn.pack(pady=(5,2))
+        self.batch_status = tk.Label(self.content, text="", font=("Arial", 11))
+        self.batch_status.pack(pady=(2,20))
 
-        self.generated_image = None  # PIL image object
+        self.generated_card = None  # QRCard for the code on screen
+        self.card_cache = CardCache()
 
         # Mousewheel scrolling (Windows/Mac/Linux)
         canvas.bind_all("<MouseWheel>", lambda e: canvas.yview_scroll(int(-1*(e.delta/120)), "units"))
@@ -191,89 +615,230 @@ class QRCodeGeneratorApp(tk.Tk):
                 messagebox.showerror("Missing Student", "Please enter a student name.")
                 return
             
-            json_data = {
-                "v": 1,  # Schema version
-                "type": self.templates.get(self.template_var.get(), {}).get("type", "service"),
-                "student": student,
-                "service": self.service_entry.get().strip(),
-                "default_duration": int(self.duration_entry.get() or 30),
-                "created": datetime.now().isoformat()
-            }
-            
-            # Add optional fields
-            goal_id = self.goal_entry.get().strip()
-            if goal_id:
-                json_data["goal_id"] = goal_id
+            json_data = build_payload(
+                student,
+                self.service_entry.get().strip(),
+                self.duration_entry.get() or 30,
+                self.goal_entry.get().strip(),
+                self.templates.get(self.template_var.get(), {}).get("type", "service"),
+            )
         
-        # Convert to JSON string
-        text = json.dumps(json_data, separators=(',', ':'))
-
-        # Encrypt if PIN is provided
-        data_to_encode = text
-        if pin:
-            try:
-                data_to_encode = encrypt_data(text, pin)
-            except Exception as e:
-                messagebox.showerror("Encryption Error", f"Error encrypting text: {e}")
-                return
-
-        # Generate QR code
-        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M)
-        qr.add_data(data_to_encode)
-        qr.make(fit=True)
-        qr_img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-
-        # Add label above QR code (if present)
-        if label:
-            img_w, img_h = qr_img.size
-            label_img = Image.new("RGB", (img_w, 40), "white")
-            try:
-                from PIL import ImageDraw, ImageFont
-                draw = ImageDraw.Draw(label_img)
-                # Use system font, fallback if arial not found
-                try:
-                    font = ImageFont.truetype("arial.ttf", 20)
-                except:
-                    font = ImageFont.load_default()
-                tw = draw.textlength(label, font=font)
-                tx = (img_w - tw)//2 if tw < img_w else 0
-                draw.text((tx, 10), label, fill="black", font=font)
-            except Exception:
-                pass  # Draw nothing if font fails
-
-            combined = Image.new("RGB", (img_w, img_h+40), "white")
-            combined.paste(label_img, (0,0))
-            combined.paste(qr_img, (0,40))
-            qr_img = combined
-
-        self.generated_image = qr_img
+        # Encode (encrypted if PIN is provided), reusing the card if nothing changed
+        try:
+            with span("qr.encode", encrypted=bool(pin)):
+                card = self.card_cache.get(json_data, label, pin_key(pin) if pin else None)
+        except Exception as e:
+            messagebox.showerror("Encryption Error", f"Error encrypting text: {e}")
+            return
+        self.generated_card = card
 
         # Show QR code in the canvas
-        img = qr_img.resize((300, 300), Image.LANCZOS)
-        self.tk_qr_img = ImageTk.PhotoImage(img)
+        with span("qr.preview"):
+            from PIL import ImageTk
+            self.tk_qr_img = ImageTk.PhotoImage(card.preview(300))
         self.qr_canvas.delete("all")
-        self.qr_canvas.create_image(150, 150, image=self.tk_qr_img)
-        if label:
-            self.qr_canvas.create_text(150, 20, text=label, fill="black", font=("Arial", 14, "bold"))
+        self.qr_canvas.config(height=self.tk_qr_img.height())
+        self.qr_canvas.create_image(0, 0, image=self.tk_qr_img, anchor="nw")
         self.save_btn.config(state=tk.NORMAL)
 
     def save_qr(self):
-        if not self.generated_image:
+        if not self.generated_card:
             return
         filepath = filedialog.asksaveasfilename(defaultextension=".png",
-                                                filetypes=[("PNG Image", "*.png")],
+                                                filetypes=[("PNG Image", "*.png"), ("SVG Vector (for printing)", "*.svg")],
                                                 title="Save QR Code")
         if filepath:
-            self.generated_image.save(filepath)
+            with span("qr.save"):
+                self.generated_card.save(filepath)
             messagebox.showinfo("Saved", f"QR code saved as:\n{filepath}")
 
-if __name__ == "__main__":
-    try:
-        import qrcode
-        from PIL import Image, ImageTk
-    except ImportError:
-        import sys
-        sys.exit("Please install 'qrcode' and 'Pillow' packages (pip install qrcode[pil] pillow cryptography)")
+    def batch_generate(self):
+        """Render a card per roster row in the background, using the PIN and template above."""
+        roster = filedialog.askopenfilename(title="Roster CSV", filetypes=[("CSV files", "*.csv")])
+        if not roster:
+            return
+        out_dir = filedialog.askdirectory(title="Folder for QR Cards", mustexist=False)
+        if not out_dir:
+            return
+        pin = self.pin_entry.get().strip() or None
+        qr_type = self.templates.get(self.template_var.get(), {}).get("type", "service")
+        self.batch_btn.config(state=tk.DISABLED)
+        self.batch_status.config(text="Starting batch...")
+
+        def progress(done):
+            self.after(0, lambda: self.batch_status.config(text=f"{done} cards written"))
+
+        def run():
+            try:
+                result = generate_batch(roster, out_dir, pin, qr_type, progress=progress)
+            except Exception as e:
+                # Bound now: e is unset once the except block ends, before Tk runs the callback
+                self.after(0, lambda error=e: self.batch_finished(error=error))
+            else:
+                self.after(0, lambda: self.batch_finished(result, out_dir))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def batch_finished(self, result=None, out_dir=None, error=None):
+        self.batch_btn.config(state=tk.NORMAL)
+        if error:
+            self.batch_status.config(text="Batch failed")
+            messagebox.showerror("Batch Error", f"Could not generate cards: {error}")
+            return
+        summary = f"{result['cards']} cards in {result['seconds']:.1f}s ({result['cards_per_s']:.1f} cards/s)"
+        self.batch_status.config(text=summary)
+        messagebox.showinfo("Batch Complete", f"{summary}\nSaved to:\n{out_dir}{skipped_text(result['skipped'])}")
+
+class SheetDialog(tk.Toplevel):
+    """Lay out roster cards (or a folder of saved PNG cards) on printable pages."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.title("Compose Label Sheets")
+        self.resizable(False, False)
+        self.transient(app)
+
+        self.vars = {}
+        fields = [("Roster CSV or card folder:", "source", ""), ("Columns:", "cols", "3"), ("Rows:", "rows", "4"),
+                  ("Margin (in):", "margin", "0.5"), ("Gap (in):", "gap", "0.25"), ("DPI:", "dpi", "300")]
+        for row, (text, name, default) in enumerate(fields):
+            tk.Label(self, text=text, font=("Arial", 12)).grid(row=row, column=0, sticky="e", padx=4, pady=2)
+            self.vars[name] = tk.StringVar(value=default)
+            tk.Entry(self, textvariable=self.vars[name], font=("Arial", 12), width=22).grid(row=row, column=1, padx=4, pady=2)
+        browse = tk.Frame(self)
+        browse.grid(row=0, column=2, padx=4)
+        tk.Button(browse, text="CSV...", command=self.pick_roster).pack(side="left")
+        tk.Button(browse, text="Folder...", command=self.pick_folder).pack(side="left")
+
+        row = len(fields)
+        tk.Label(self, text="Page size:", font=("Arial", 12)).grid(row=row, column=0, sticky="e", padx=4, pady=2)
+        self.page_var = tk.StringVar(value="Letter")
+        ttk.Combobox(self, textvariable=self.page_var, values=list(PAGE_SIZES), state="readonly", width=20).grid(row=row, column=1, padx=4, pady=2)
+        tk.Label(self, text="Output:", font=("Arial", 12)).grid(row=row + 1, column=0, sticky="e", padx=4, pady=2)
+        self.format_var = tk.StringVar(value="PDF")
+        ttk.Combobox(self, textvariable=self.format_var, values=["PDF", "PNG pages"], state="readonly", width=20).grid(row=row + 1, column=1, padx=4, pady=2)
+
+        self.compose_btn = tk.Button(self, text="Compose", command=self.compose, font=("Arial", 12), width=16, bg="#33CC99")
+        self.compose_btn.grid(row=row + 2, column=0, columnspan=3, pady=(10, 2))
+        self.status = tk.Label(self, text="Roster cards use the PIN and template from the main window.", font=("Arial", 10))
+        self.status.grid(row=row + 3, column=0, columnspan=3, pady=(2, 10))
+
+    def pick_roster(self):
+        path = filedialog.askopenfilename(title="Roster CSV", filetypes=[("CSV files", "*.csv")], parent=self)
+        if path:
+            self.vars["source"].set(path)
+
+    def pick_folder(self):
+        path = filedialog.askdirectory(title="Folder of QR Cards", parent=self)
+        if path:
+            self.vars["source"].set(path)
+
+    def compose(self):
+        source = self.vars["source"].get().strip()
+        if not source or not os.path.exists(source):
+            messagebox.showerror("No Source", "Choose a roster CSV or a folder of QR cards.", parent=self)
+            return
+        try:
+            layout = dict(cols=int(self.vars["cols"].get()), rows=int(self.vars["rows"].get()),
+                          margin=float(self.vars["margin"].get()), gap=float(self.vars["gap"].get()),
+                          dpi=int(self.vars["dpi"].get()), page_size=PAGE_SIZES[self.page_var.get()])
+        except ValueError:
+            messagebox.showerror("Invalid Layout", "Columns, rows and DPI must be whole numbers; margins are inches.", parent=self)
+            return
+        if self.format_var.get() == "PDF":
+            out_path = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF", "*.pdf")],
+                                                    title="Save Label Sheets", parent=self)
+        else:
+            out_path = filedialog.askdirectory(title="Folder for Sheet Pages", mustexist=False, parent=self)
+        if not out_path:
+            return
+        pin = self.app.pin_entry.get().strip() or None
+        qr_type = self.app.templates.get(self.app.template_var.get(), {}).get("type", "service")
+        self.compose_btn.config(state=tk.DISABLED)
+
+        def progress(pages):
+            self.after(0, lambda: self.status.config(text=f"{pages} pages written"))
+
+        def run():
+            skipped = []
+            try:
+                result = compose_sheets(sheet_cards(source, pin, qr_type, skipped), out_path, progress=progress, **layout)
+            except Exception as e:
+                self.after(0, lambda error=e: self.finished(error=error))
+            else:
+                result["skipped"] = skipped
+                self.after(0, lambda: self.finished(result, out_path))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def finished(self, result=None, out_path=None, error=None):
+        self.compose_btn.config(state=tk.NORMAL)
+        if error:
+            self.status.config(text="Composing failed")
+            messagebox.showerror("Sheet Error", f"Could not compose sheets: {error}", parent=self)
+            return
+        summary = f"{result['cards']} cards on {result['pages']} pages in {result['seconds']:.1f}s"
+        self.status.config(text=summary)
+        messagebox.showinfo("Sheets Complete", f"{summary}\nSaved to:\n{out_path}{skipped_text(result['skipped'])}",
+                            parent=self)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="QR Code Generator for Service Tracker")
+    parser.add_argument("--batch", metavar="ROSTER_CSV",
+                        help="Write a QR card per roster row (student, service, default_duration, goal_id, type, label) and exit")
+    parser.add_argument("--sheets", metavar="SOURCE",
+                        help="Lay out cards from a roster CSV or a folder of card PNGs on printable pages and exit")
+    parser.add_argument("--out", help="Output folder for --batch (default qr_cards); for --sheets a .pdf file "
+                                      "or a folder of PNG pages (default qr_sheets.pdf)")
+    parser.add_argument("--encrypt", action="store_true", help="Prompt for a PIN and encrypt the payloads")
+    parser.add_argument("--type", default="service", help="Payload type for rows without a type column")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--svg", action="store_true", help="Write --batch cards as SVG instead of PNG")
+    parser.add_argument("--grid", default="3x4", help="Sheet columns x rows (default 3x4)")
+    parser.add_argument("--margin", type=float, default=0.5, help="Sheet margin in inches (default 0.5)")
+    parser.add_argument("--gap", type=float, default=0.25, help="Gap between cards in inches (default 0.25)")
+    parser.add_argument("--dpi", type=int, default=300, help="Sheet resolution (default 300)")
+    parser.add_argument("--page", choices=list(PAGE_SIZES), default="Letter", help="Sheet page size")
+    args = parser.parse_args(argv)
+
+    pin = None
+    if args.encrypt and (args.batch or args.sheets):
+        import getpass
+        pin = getpass.getpass("PIN: ")
+
+    if args.sheets:
+        cols, rows = (int(n) for n in args.grid.lower().split("x"))
+        out = args.out or "qr_sheets.pdf"
+        skipped = []
+        result = compose_sheets(sheet_cards(args.sheets, pin, args.type, skipped), out, cols, rows, args.margin,
+                                args.gap, args.dpi, PAGE_SIZES[args.page],
+                                progress=lambda pages: print(f"\r{pages} pages", end="", flush=True))
+        print(f"\r{result['cards']} cards on {result['pages']} pages written to {out} in {result['seconds']:.1f}s"
+              + skipped_text(skipped))
+        return 0
+
+    if args.batch:
+        args.out = args.out or "qr_cards"
+        result = generate_batch(args.batch, args.out, pin, args.type, args.workers, ext="svg" if args.svg else "png",
+                                progress=lambda done: print(f"\r{done} cards", end="", flush=True))
+        print(f"\r{result['cards']} cards written to {args.out} in {result['seconds']:.1f}s "
+              f"({result['cards_per_s']:.1f} cards/s)" + skipped_text(result["skipped"]))
+        return 0
 
     app = QRCodeGeneratorApp()
     app.mainloop()
+    return 0
+
+if __name__ == "__main__":
+    # Batch workers re-run this file; in a frozen (PyInstaller) build they must stop here, not open the GUI
+    import multiprocessing
+    multiprocessing.freeze_support()
+    import sys
+    from importlib.util import find_spec
+    # Check without importing: Pillow and qrcode load on the first QR drawn, not at startup
+    if not (find_spec("qrcode") and find_spec("PIL")):
+        sys.exit("Please install 'qrcode' and 'Pillow' packages (pip install qrcode[pil] pillow cryptography)")
+
+    sys.exit(main())
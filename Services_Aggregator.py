@@ -7,19 +7,35 @@ Created on Mon Jun  2 13:24:49 2025
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import imaplib
-import email
 import os
 import sqlite3
 import csv
 import base64
 import hashlib
-from cryptography.fernet import Fernet, InvalidToken
+import time
+import json
+import shutil
+import calendar
+from datetime import datetime
+from contextlib import contextmanager
+from functools import lru_cache, partial
+
+from Services_Migrations import (
+    BATCH_SIZE, AddColumns, Backfill, BatchedCall, Call, CreateIndex, Migration, SQL, migrate
+)
+from Services_Reports import SEALED_SUFFIX, ReportError, is_sealed_report, open_sealed_report
+from Services_Tracing import span
 
 DB_FILE = "aggregated_services.db"
 ATTACH_DIR = "attachments"
+SNAPSHOT_DIR = "snapshot"
+SECONDS_PER_DAY = 86400
+
+# Local wall-clock epoch of a "YYYY-MM-DD HH:MM:SS" text value (strftime reads it as UTC)
+EPOCH_SQL = "CAST(strftime('%s', {}) AS INTEGER)"
 
 # Encryption helpers (compatible with Services_Tracker.py)
+@lru_cache(maxsize=8)  # PBKDF2 is deliberately slow; legacy reports call this per cell
 def get_fernet_key_from_pin(pin, salt=None):
     """Derive a Fernet key from PIN using PBKDF2 for better security."""
     if salt is None:
@@ -42,6 +58,7 @@ def get_fernet_key_from_pin(pin, salt=None):
 
 def decrypt_data(encrypted_text, pin):
     """Decrypt data using PIN-derived key."""
+    from cryptography.fernet import Fernet
     key = get_fernet_key_from_pin(pin)
     f = Fernet(key)
     try:
@@ -59,6 +76,625 @@ def decrypt_data(encrypted_text, pin):
         except:
             return None
 
+# ------------------ Database Schema ---------------------
+def init_schema(conn):
+    """Bring the aggregator tables, rollups and triggers up to the latest schema version."""
+    migrate(conn, AGGREGATOR_MIGRATIONS)
+
+# Tables whose changes readers (the dashboard) want to notice cheaply
+VERSIONED_TABLES = ("services", "import_runs")
+# Counts only UPDATEs of services: readers that just append new rows reload when it moves
+UPDATE_COUNTER = "services_updates"
+
+def create_version_counters(conn):
+    """Keep a per-table change counter in table_versions, bumped by triggers."""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table in VERSIONED_TABLES:
+        c.execute("INSERT OR IGNORE INTO table_versions (name) VALUES (?)", (table,))
+        for action in ("INSERT", "UPDATE", "DELETE"):
+            c.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{action.lower()}
+                AFTER {action} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+    c.execute("INSERT OR IGNORE INTO table_versions (name) VALUES (?)", (UPDATE_COUNTER,))
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{UPDATE_COUNTER}
+        AFTER UPDATE ON services
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = '{UPDATE_COUNTER}';
+        END
+    ''')
+    conn.commit()
+
+# ------------------ Summary Rollups ---------------------
+# Rollup tables hold running totals so summaries are lookups over groups
+# instead of full scans of services. Sums and non-null counts are kept
+# separately so averages can be derived (score_sum / score_n).
+ROLLUP_TABLES = {
+    "student_summary": ["student"],
+    "student_service_daily": ["student", "service", "day_key"],
+    "goal_summary": ["goal_id", "student"],
+}
+
+# Column type and the expression that turns a services row (aliased NEW in
+# triggers) into each rollup key
+ROLLUP_KEY_EXPRS = {
+    "student": ("TEXT", "COALESCE({r}.student, '')"),
+    "service": ("TEXT", "COALESCE({r}.service, '')"),
+    "day_key": ("INTEGER", "COALESCE({r}.day_key, 0)"),
+    "goal_id": ("TEXT", "{r}.goal_id"),
+}
+
+# Goal rollups only cover rows that actually carry a goal
+ROLLUP_FILTERS = {
+    "goal_summary": "{r}.goal_id IS NOT NULL AND {r}.goal_id <> ''",
+}
+
+ROLLUP_MEASURES = "sessions, duration_sum, duration_n, score_sum, score_n"
+# services columns the rollups are computed from; updating any other column leaves them alone
+ROLLUP_SOURCE_COLUMNS = "student, service, day_key, goal_id, duration, score"
+
+def _rollup_key_exprs(table, r):
+    return [ROLLUP_KEY_EXPRS[k][1].format(r=r) for k in ROLLUP_TABLES[table]]
+
+def create_rollups(conn):
+    """Create rollup tables and the triggers that keep them in step with services."""
+    c = conn.cursor()
+    # Daily rollups were first keyed on a text date; rebuild them on day_key
+    c.execute("SELECT 1 FROM pragma_table_info('student_service_daily') WHERE name='day'")
+    if c.fetchone():
+        c.execute("DROP TRIGGER IF EXISTS trg_services_rollup_insert")
+        c.execute("DROP TRIGGER IF EXISTS trg_services_rollup_delete")
+        c.execute("DROP TRIGGER IF EXISTS trg_services_rollup_update")
+        c.execute("DROP TABLE student_service_daily")
+    for table, keys in ROLLUP_TABLES.items():
+        key_cols = ", ".join(f"{k} {ROLLUP_KEY_EXPRS[k][0]} NOT NULL" for k in keys)
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key_cols},
+                sessions INTEGER NOT NULL DEFAULT 0,
+                duration_sum REAL NOT NULL DEFAULT 0,
+                duration_n INTEGER NOT NULL DEFAULT 0,
+                score_sum REAL NOT NULL DEFAULT 0,
+                score_n INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY ({", ".join(keys)})
+            )
+        ''')
+
+    insert_body = []
+    delete_body = []
+    for table, keys in ROLLUP_TABLES.items():
+        key_list = ", ".join(keys)
+        new_keys = ", ".join(_rollup_key_exprs(table, "NEW"))
+        old_match = " AND ".join(f"{k} = {e}" for k, e in zip(keys, _rollup_key_exprs(table, "OLD")))
+        new_filter = ROLLUP_FILTERS.get(table, "1").format(r="NEW")
+        old_filter = ROLLUP_FILTERS.get(table, "1").format(r="OLD")
+        insert_body.append(f'''
+                INSERT INTO {table} ({key_list}, {ROLLUP_MEASURES})
+                SELECT {new_keys}, 1,
+                       COALESCE(NEW.duration, 0), NEW.duration IS NOT NULL,
+                       COALESCE(NEW.score, 0), NEW.score IS NOT NULL
+                WHERE {new_filter}
+                ON CONFLICT ({key_list}) DO UPDATE SET
+                    sessions = sessions + 1,
+                    duration_sum = duration_sum + excluded.duration_sum,
+                    duration_n = duration_n + excluded.duration_n,
+                    score_sum = score_sum + excluded.score_sum,
+                    score_n = score_n + excluded.score_n;''')
+        delete_body.append(f'''
+                UPDATE {table} SET
+                    sessions = sessions - 1,
+                    duration_sum = duration_sum - COALESCE(OLD.duration, 0),
+                    duration_n = duration_n - (OLD.duration IS NOT NULL),
+                    score_sum = score_sum - COALESCE(OLD.score, 0),
+                    score_n = score_n - (OLD.score IS NOT NULL)
+                WHERE {old_filter} AND {old_match};
+                DELETE FROM {table} WHERE {old_match} AND sessions <= 0;''')
+
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_services_rollup_insert
+        AFTER INSERT ON services
+        BEGIN{"".join(insert_body)}
+        END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_services_rollup_delete
+        AFTER DELETE ON services
+        BEGIN{"".join(delete_body)}
+        END
+    ''')
+    # An update moves the row between groups: take the old row out, put the new one in
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_services_rollup_update
+        AFTER UPDATE OF {ROLLUP_SOURCE_COLUMNS} ON services
+        BEGIN{"".join(delete_body)}{"".join(insert_body)}
+        END
+    ''')
+    conn.commit()
+
+def _rollup_select_sql(table, where="1"):
+    """GROUP BY query that recomputes a rollup table from services (rows matching where).
+
+    Groups on the key expressions, not the column names they are aliased to:
+    a bare student would still split NULL from '' although both key as ''.
+    """
+    keys = ROLLUP_TABLES[table]
+    key_exprs = _rollup_key_exprs(table, "s")
+    select_keys = ", ".join(f"{e} AS {k}" for k, e in zip(keys, key_exprs))
+    return f'''
+        SELECT {select_keys}, COUNT(*) AS sessions,
+               TOTAL(s.duration) AS duration_sum, COUNT(s.duration) AS duration_n,
+               TOTAL(s.score) AS score_sum, COUNT(s.score) AS score_n
+        FROM services s
+        WHERE {ROLLUP_FILTERS.get(table, "1").format(r="s")} AND ({where})
+        GROUP BY {", ".join(key_exprs)}
+    '''
+
+def check_rollups(conn):
+    """Compare rollup tables against services; return {table: mismatched groups}."""
+    mismatches = {}
+    for table, keys in ROLLUP_TABLES.items():
+        # Round sums so float addition order does not count as drift
+        stored = f'''
+            SELECT {", ".join(keys)}, sessions, ROUND(duration_sum, 6), duration_n,
+                   ROUND(score_sum, 6), score_n
+            FROM {table}
+        '''
+        fresh = f'''
+            SELECT {", ".join(keys)}, sessions, ROUND(duration_sum, 6), duration_n,
+                   ROUND(score_sum, 6), score_n
+            FROM ({_rollup_select_sql(table)})
+        '''
+        cur = conn.execute(f'''
+            SELECT (SELECT COUNT(*) FROM ({stored} EXCEPT {fresh}))
+                 + (SELECT COUNT(*) FROM ({fresh} EXCEPT {stored}))
+        ''')
+        mismatches[table] = cur.fetchone()[0]
+    return mismatches
+
+def _student_ranges(conn, batch_size):
+    """(low, high] student ranges of about batch_size services rows each, open at both ends (None)."""
+    bounds, rows = [], 0
+    for student, count in conn.execute(
+            "SELECT student, COUNT(*) FROM services WHERE student IS NOT NULL GROUP BY student ORDER BY student"):
+        rows += count
+        if rows >= batch_size:
+            bounds.append(student)
+            rows = 0
+    return list(zip([None] + bounds, bounds + [None]))
+
+def rebuild_rollups(conn, batch_size=BATCH_SIZE, pause=0.0, verify=True):
+    """Recompute every rollup table from services; with verify, return check_rollups().
+
+    Works through students in ranges of about batch_size rows, each range
+    replaced in its own transaction, so importers are only held up for one
+    range. The triggers keep ranges already done in step meanwhile, and a
+    range not done yet is recomputed whole, so rows written during the
+    rebuild are counted either way. NULL students key as '' and so fall in
+    the first range. Verifying reads all of services in one go, which keeps
+    writers out for as long as a one-transaction rebuild would.
+    """
+    conn.commit()
+    for low, high in _student_ranges(conn, batch_size):
+        rows, keys, params = ["1"], ["1"], []
+        if low is not None:
+            rows.append("s.student > ?")
+            keys.append("student > ?")
+            params.append(low)
+        if high is not None:
+            rows.append("(s.student <= ? OR s.student IS NULL)" if low is None else "s.student <= ?")
+            keys.append("student <= ?")
+            params.append(high)
+        with conn:
+            for table, columns in ROLLUP_TABLES.items():
+                conn.execute(f"DELETE FROM {table} WHERE {' AND '.join(keys)}", params)
+                conn.execute(f'''
+                    INSERT INTO {table} ({", ".join(columns)}, {ROLLUP_MEASURES})
+                    {_rollup_select_sql(table, " AND ".join(rows))}
+                ''', params)
+        if pause:
+            time.sleep(pause)
+    return check_rollups(conn) if verify else None
+
+# ------------------ Schema Migrations ---------------------
+def _services_rows(conn):
+    return conn.execute("SELECT COUNT(*) FROM services").fetchone()[0]
+
+# PRAGMA user_version records the last migration applied; add new ones at the end
+AGGREGATOR_MIGRATIONS = [
+    Migration(1, "Base tables", [
+        SQL("create services, import_log, import_runs", '''
+            CREATE TABLE IF NOT EXISTS services (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                ts_epoch INTEGER,
+                day_key INTEGER,
+                student TEXT,
+                service TEXT,
+                duration REAL,
+                event TEXT,
+                score REAL,
+                goal_id TEXT,
+                device_id TEXT,
+                source_email TEXT,
+                source_file TEXT,
+                schema_version INTEGER DEFAULT 1,
+                imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(timestamp, student, service, device_id)
+            )
+            ''', '''
+            CREATE TABLE IF NOT EXISTS import_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_uid TEXT,
+                filename TEXT,
+                imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                record_count INTEGER,
+                duplicates_skipped INTEGER,
+                status TEXT,
+                run_id INTEGER REFERENCES import_runs(id)
+            )
+            ''', '''
+            CREATE TABLE IF NOT EXISTS import_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                status TEXT,
+                error TEXT,
+                emails_found INTEGER DEFAULT 0,
+                files_imported INTEGER DEFAULT 0,
+                records_imported INTEGER DEFAULT 0,
+                duplicates_skipped INTEGER DEFAULT 0,
+                bytes_downloaded INTEGER DEFAULT 0,
+                connect_s REAL DEFAULT 0,
+                search_s REAL DEFAULT 0,
+                download_s REAL DEFAULT 0,
+                parse_s REAL DEFAULT 0,
+                decrypt_s REAL DEFAULT 0,
+                insert_s REAL DEFAULT 0,
+                total_s REAL DEFAULT 0,
+                rows_per_s REAL,
+                bytes_per_s REAL
+            )
+            '''),
+    ]),
+    Migration(2, "Import run link", [
+        AddColumns("import_log", {"run_id": "INTEGER REFERENCES import_runs(id)"}),
+        CreateIndex("idx_import_log_run", "import_log", "run_id"),
+    ]),
+    # Integer ts_epoch/day_key columns, backfilled from the text timestamp
+    Migration(3, "Integer time columns", [
+        AddColumns("services", {"ts_epoch": "INTEGER", "day_key": "INTEGER"}),
+        Backfill("services", {"ts_epoch": EPOCH_SQL.format("timestamp"),
+                              "day_key": f"{EPOCH_SQL.format('timestamp')} / {SECONDS_PER_DAY}"},
+                 "ts_epoch IS NULL AND timestamp IS NOT NULL"),
+        CreateIndex("idx_services_ts_epoch", "services", "ts_epoch"),
+        CreateIndex("idx_services_day_key", "services", "day_key"),
+        CreateIndex("idx_services_student_ts", "services", "student, ts_epoch"),
+        CreateIndex("idx_services_service_ts", "services", "service, ts_epoch"),
+    ]),
+    Migration(4, "Summary rollups", [
+        # Filled by migration 7's rebuild, so a database upgrading from before 4 is rebuilt once
+        Call("rollup tables and triggers", create_rollups),
+    ]),
+    Migration(5, "Change counters", [
+        Call("table_versions and triggers", create_version_counters),
+    ]),
+    # Sealed reports that could not be opened (wrong PIN, damaged)
+    Migration(6, "Failed report count", [
+        AddColumns("import_runs", {"files_failed": "INTEGER DEFAULT 0"}),
+    ]),
+    # Rollups drifted on every UPDATE of services before this trigger existed
+    Migration(7, "Rollup update trigger", [
+        Call("rollup update trigger", create_rollups),
+        BatchedCall("rebuild rollups", partial(rebuild_rollups, verify=False), rows=_services_rows),
+    ]),
+    # The dashboard's incremental refresh only sees new rows; edited ones need their own counter
+    Migration(8, "Update counter", [
+        Call("services update counter", create_version_counters),
+    ]),
+]
+
+# ------------------ Import Pipeline ---------------------
+class ImportRun:
+    """Per-stage timings and counters for one import run, stored in import_runs."""
+    STAGES = ("connect", "search", "download", "parse", "decrypt", "insert")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.timings = dict.fromkeys(self.STAGES, 0.0)
+        self.emails_found = 0
+        self.files_imported = 0
+        self.files_failed = 0
+        self.records_imported = 0
+        self.duplicates_skipped = 0
+        self.bytes_downloaded = 0
+        self.status = "running"
+        self._started = time.perf_counter()
+        with conn:
+            cur = conn.execute("INSERT INTO import_runs (status) VALUES ('running')")
+        self.id = cur.lastrowid
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            with span(f"import.{name}"):
+                yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def finish(self, status="success", error=None):
+        """Record the final counters; rows/s is over the whole run, bytes/s over downloading."""
+        self.status = status
+        total = time.perf_counter() - self._started
+        rows = self.records_imported + self.duplicates_skipped
+        download_s = self.timings["download"]
+        with self.conn:
+            self.conn.execute('''
+                UPDATE import_runs SET
+                    finished_at = CURRENT_TIMESTAMP, status = ?, error = ?,
+                    emails_found = ?, files_imported = ?, files_failed = ?, records_imported = ?,
+                    duplicates_skipped = ?, bytes_downloaded = ?,
+                    connect_s = ?, search_s = ?, download_s = ?, parse_s = ?,
+                    decrypt_s = ?, insert_s = ?, total_s = ?, rows_per_s = ?, bytes_per_s = ?
+                WHERE id = ?
+            ''', (status, error, self.emails_found, self.files_imported, self.files_failed, self.records_imported,
+                  self.duplicates_skipped, self.bytes_downloaded,
+                  *(self.timings[s] for s in self.STAGES), total,
+                  rows / total if total else None,
+                  self.bytes_downloaded / download_s if download_s else None,
+                  self.id))
+
+def _to_float(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def service_record(row, source_email=None, source_file=None):
+    """Map a report CSV row to insert parameters, or None if the row is too short."""
+    # row: [ID, Timestamp, Student, Service, Duration, Event, Score, Goal_ID, Device_ID, Reported]
+    if len(row) < 7:
+        return None
+    goal_id = row[7] if len(row) > 7 else None
+    device_id = row[8] if len(row) > 8 else None
+    return (row[1], row[2], row[3], _to_float(row[4]), row[5], _to_float(row[6]),
+            goal_id, device_id, source_email, source_file)
+
+def insert_services(conn, records):
+    """Bulk insert service records in one transaction; return how many were new."""
+    with conn:
+        cur = conn.executemany(f'''
+            INSERT OR IGNORE INTO services (timestamp, ts_epoch, day_key, student, service, duration, event, score,
+                                            goal_id, device_id, source_email, source_file, schema_version)
+            VALUES (?1, {EPOCH_SQL.format("?1")}, {EPOCH_SQL.format("?1")} / {SECONDS_PER_DAY},
+                    ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, 1)
+        ''', records)
+    # rowcount only counts rows the INSERT itself added, not trigger writes
+    return cur.rowcount
+
+def import_csv_file(conn, filepath, pin=None, source_email=None, source_file=None, run=None, email_uid=None):
+    """Import one report CSV, plain or sealed; return (records_imported, duplicates_skipped)."""
+    own_run = run is None
+    if own_run:
+        run = ImportRun(conn)
+    if is_sealed_report(filepath):
+        # Sealed reports are decrypted and decompressed as they are parsed, in one pass
+        try:
+            if not pin:
+                raise ReportError("Report is encrypted; enter the PIN to import it")
+            with run.stage("decrypt"), open_sealed_report(filepath, pin) as report:
+                reader = csv.reader(report)
+                header = next(reader, None)
+                rows = list(reader)
+        except ReportError as e:
+            log_import(conn, email_uid, source_file, 0, 0, f"error: {e}", run.id)
+            run.files_failed += 1
+            if own_run:
+                run.finish("error", str(e))
+            return 0, 0
+    else:
+        with run.stage("parse"):
+            with open(filepath, newline="") as csvfile:
+                reader = csv.reader(csvfile)
+                header = next(reader, None)
+                rows = list(reader)
+
+        # Older reports may carry individually encrypted fields
+        if pin:
+            with run.stage("decrypt"):
+                rows = [[try_decrypt(cell, pin) if cell else "" for cell in row] for row in rows]
+
+    with run.stage("insert"):
+        records = [r for r in (service_record(row, source_email, source_file) for row in rows) if r]
+        records_imported = insert_services(conn, records)
+        duplicates_skipped = len(records) - records_imported
+        log_import(conn, email_uid, source_file, records_imported, duplicates_skipped, "success", run.id)
+
+    run.files_imported += 1
+    run.records_imported += records_imported
+    run.duplicates_skipped += duplicates_skipped
+    if own_run:
+        run.finish()
+    return records_imported, duplicates_skipped
+
+def log_import(conn, email_uid, filename, record_count, duplicates_skipped, status, run_id=None):
+    with conn:
+        conn.execute('''
+            INSERT INTO import_log (email_uid, filename, record_count, duplicates_skipped, status, run_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (email_uid, filename, record_count, duplicates_skipped, status, run_id))
+
+def try_decrypt(value, pin):
+    # Try to decrypt, else return as is
+    decrypted = decrypt_data(value, pin)
+    return decrypted if decrypted is not None else value
+
+def fetch_and_import(conn, imap_server, user, password, subject, pin=None,
+                     progress=None, imap_factory=None):
+    """Download report attachments matching subject and import them; return the finished ImportRun.
+
+    imap_factory(host) opens the connection (default imaplib.IMAP4_SSL).
+    """
+    import email
+    import imaplib
+    imap_factory = imap_factory or imaplib.IMAP4_SSL
+    run = ImportRun(conn)
+    try:
+        with run.stage("connect"):
+            mail = imap_factory(imap_server)
+            mail.login(user, password)
+            mail.select("inbox")
+        with run.stage("search"):
+            # Search for emails with specified subject
+            search_criteria = f'(SUBJECT "{subject}")'
+            status, messages = mail.search(None, search_criteria)
+            email_ids = messages[0].split()
+        run.emails_found = len(email_ids)
+        if progress:
+            progress(f"Found {len(email_ids)} emails. Downloading attachments...")
+        for email_id in email_ids:
+            with run.stage("download"):
+                _, msg_data = mail.fetch(email_id, "(RFC822)")
+            for response_part in msg_data:
+                if not isinstance(response_part, tuple):
+                    continue
+                run.bytes_downloaded += len(response_part[1])
+                with run.stage("parse"):
+                    msg = email.message_from_bytes(response_part[1])
+                    attachments = []
+                    for part in msg.walk():
+                        if part.get_content_maintype() == "multipart":
+                            continue
+                        if part.get("Content-Disposition") is None:
+                            continue
+                        filename = part.get_filename()
+                        if filename and filename.endswith((".csv", SEALED_SUFFIX)):
+                            attachments.append((filename, part.get_payload(decode=True)))
+                for filename, payload in attachments:
+                    filepath = os.path.join(ATTACH_DIR, filename)
+                    with run.stage("download"):
+                        with open(filepath, "wb") as f:
+                            f.write(payload)
+                    import_csv_file(conn, filepath, pin, user, filename, run,
+                                    email_uid=email_id.decode() if isinstance(email_id, bytes) else email_id)
+        mail.logout()
+    except Exception as e:
+        run.finish("error", str(e))
+        raise
+    run.finish()
+    return run
+
+def recent_import_runs(conn, limit=50):
+    """Newest import runs first, as (columns, rows)."""
+    cur = conn.execute('''
+        SELECT id, started_at, status, emails_found, files_imported, files_failed, records_imported,
+               duplicates_skipped, bytes_downloaded, connect_s, search_s, download_s,
+               parse_s, decrypt_s, insert_s, total_s, rows_per_s, bytes_per_s
+        FROM import_runs ORDER BY id DESC LIMIT ?
+    ''', (limit,))
+    return [d[0] for d in cur.description], cur.fetchall()
+
+# ------------------ Parquet Snapshot ---------------------
+SNAPSHOT_MANIFEST = "_manifest.json"
+# Column name -> Arrow type name; fixed so every partition shares one schema
+SNAPSHOT_COLUMNS = {
+    "id": "int64", "timestamp": "string", "ts_epoch": "int64", "day_key": "int32",
+    "student": "string", "service": "string", "duration": "float64", "event": "string",
+    "score": "float64", "goal_id": "string", "device_id": "string", "source_email": "string",
+    "schema_version": "int32", "imported_at": "string",
+}
+# Low-cardinality text columns stored as Parquet dictionaries
+SNAPSHOT_DICTIONARY_COLUMNS = ["student", "service", "device_id"]
+
+def _month_bounds(month):
+    """First and one-past-last ts_epoch of a 'YYYY-MM' month."""
+    year, mon = (int(x) for x in month.split("-"))
+    start = calendar.timegm((year, mon, 1, 0, 0, 0))
+    end = calendar.timegm((year + mon // 12, mon % 12 + 1, 1, 0, 0, 0))
+    return start, end
+
+def _month_fingerprints(conn):
+    """Content fingerprint per month; ids are left out because every fetch re-imports rows."""
+    cur = conn.execute('''
+        SELECT strftime('%Y-%m', ts_epoch, 'unixepoch') AS month,
+               COUNT(*), TOTAL(ts_epoch), TOTAL(duration), TOTAL(score),
+               TOTAL(LENGTH(student) + LENGTH(service) + LENGTH(COALESCE(goal_id, ''))
+                     + LENGTH(COALESCE(device_id, '')) + LENGTH(COALESCE(event, '')))
+        FROM services
+        WHERE ts_epoch IS NOT NULL
+        GROUP BY month
+    ''')
+    return {row[0]: list(row[1:]) for row in cur.fetchall()}
+
+def export_parquet_snapshot(conn, out_dir=SNAPSHOT_DIR):
+    """Write services as Parquet partitioned by month, rewriting only months that changed.
+
+    Returns {"written": [...], "unchanged": [...], "removed": [...]} month lists.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet snapshots need pyarrow (pip install pyarrow)")
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, SNAPSHOT_MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f).get("months", {})
+
+    current = _month_fingerprints(conn)
+    result = {"written": [], "unchanged": [], "removed": []}
+    for month, fingerprint in sorted(current.items()):
+        partition = os.path.join(out_dir, f"month={month}")
+        part_file = os.path.join(partition, "part-0.parquet")
+        if previous.get(month) == fingerprint and os.path.exists(part_file):
+            result["unchanged"].append(month)
+            continue
+        start, end = _month_bounds(month)
+        cur = conn.execute(f'''
+            SELECT {", ".join(SNAPSHOT_COLUMNS)} FROM services
+            WHERE ts_epoch >= ? AND ts_epoch < ?
+            ORDER BY ts_epoch, id
+        ''', (start, end))
+        columns = list(zip(*cur.fetchall())) or [()] * len(SNAPSHOT_COLUMNS)
+        arrays = []
+        for name, values in zip(SNAPSHOT_COLUMNS, columns):
+            array = pa.array(values, type=pa.type_for_alias(SNAPSHOT_COLUMNS[name]))
+            if name in SNAPSHOT_DICTIONARY_COLUMNS:
+                array = array.dictionary_encode()
+            arrays.append(array)
+        table = pa.Table.from_arrays(arrays, names=list(SNAPSHOT_COLUMNS))
+        os.makedirs(partition, exist_ok=True)
+        # Write beside the old file and swap, so readers never see half a partition
+        tmp_file = part_file + ".tmp"
+        pq.write_table(table, tmp_file, compression="zstd")
+        os.replace(tmp_file, part_file)
+        result["written"].append(month)
+
+    for month in sorted(set(previous) - set(current)):
+        shutil.rmtree(os.path.join(out_dir, f"month={month}"), ignore_errors=True)
+        result["removed"].append(month)
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"written_at": datetime.now().isoformat(timespec="seconds"),
+                   "months": current}, f, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return result
+
 class ServiceAggregatorApp(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -112,7 +748,10 @@ class ServiceAggregatorApp(tk.Tk):
         btn_frame = tk.Frame(self)
         btn_frame.pack(fill="x", padx=10, pady=5)
         tk.Button(btn_frame, text="Export to CSV", command=self.export_csv).pack(side="left")
+        tk.Button(btn_frame, text="Export Snapshot", command=self.export_snapshot).pack(side="left", padx=10)
         tk.Button(btn_frame, text="Show Summary", command=self.show_summary).pack(side="left", padx=10)
+        tk.Button(btn_frame, text="Rebuild Summaries", command=self.rebuild_summaries).pack(side="left", padx=10)
+        tk.Button(btn_frame, text="Import History", command=self.show_run_history).pack(side="left", padx=10)
         tk.Button(btn_frame, text="Clear Table", command=self.clear_table).pack(side="left", padx=10)
         tk.Button(btn_frame, text="Exit", command=self.destroy).pack(side="right")
         self.status = tk.Label(self, text="Ready", anchor="w")
@@ -122,39 +761,7 @@ class ServiceAggregatorApp(tk.Tk):
         if not os.path.exists(ATTACH_DIR):
             os.makedirs(ATTACH_DIR)
         self.conn = sqlite3.connect(DB_FILE)
-        c = self.conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS services (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                student TEXT,
-                service TEXT,
-                duration REAL,
-                event TEXT,
-                score REAL,
-                goal_id TEXT,
-                device_id TEXT,
-                source_email TEXT,
-                source_file TEXT,
-                schema_version INTEGER DEFAULT 1,
-                imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(timestamp, student, service, device_id)
-            )
-        ''')
-        
-        # Create import log table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS import_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email_uid TEXT,
-                filename TEXT,
-                imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                record_count INTEGER,
-                duplicates_skipped INTEGER,
-                status TEXT
-            )
-        ''')
-        self.conn.commit()
+        init_schema(self.conn)
 
     def fetch_and_aggregate(self):
         self.status.config(text="Connecting to mail server...")
@@ -162,124 +769,34 @@ class ServiceAggregatorApp(tk.Tk):
         # Clear table and data
         self.clear_table()
         try:
-            mail = imaplib.IMAP4_SSL(self.imap_server.get())
-            mail.login(self.email_user.get(), self.email_pass.get())
-            mail.select("inbox")
-            # Search for emails with specified subject
-            search_criteria = f'(SUBJECT "{self.subject.get()}")'
-            status, messages = mail.search(None, search_criteria)
-            email_ids = messages[0].split()
-            self.status.config(text=f"Found {len(email_ids)} emails. Downloading attachments...")
-            self.update_idletasks()
-            for email_id in email_ids:
-                _, msg_data = mail.fetch(email_id, "(RFC822)")
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        for part in msg.walk():
-                            if part.get_content_maintype() == "multipart":
-                                continue
-                            if part.get("Content-Disposition") is None:
-                                continue
-                            filename = part.get_filename()
-                            if filename and filename.endswith(".csv"):
-                                filepath = os.path.join(ATTACH_DIR, filename)
-                                with open(filepath, "wb") as f:
-                                    f.write(part.get_payload(decode=True))
-                                self.import_csv(filepath, self.email_user.get(), filename)
-            mail.logout()
+            run = fetch_and_import(self.conn, self.imap_server.get(), self.email_user.get(),
+                                   self.email_pass.get(), self.subject.get(), self.pin.get(),
+                                   progress=self.show_progress)
             self.load_data_to_table()
             
-            # Get import summary
-            cur = self.conn.cursor()
-            cur.execute('''
-                SELECT SUM(record_count), SUM(duplicates_skipped) 
-                FROM import_log 
-                WHERE datetime(imported_at) > datetime('now', '-1 minute')
-            ''')
-            result = cur.fetchone()
-            total_imported = result[0] or 0
-            total_skipped = result[1] or 0
-            
-            self.status.config(text=f"Imported {total_imported} records from {len(email_ids)} emails ({total_skipped} duplicates skipped)")
+            self.status.config(text=f"Imported {run.records_imported} records from {run.emails_found} emails "
+                                    f"({run.duplicates_skipped} duplicates skipped)")
+            failed = (f"\nReports that could not be opened: {run.files_failed} (check the PIN)"
+                      if run.files_failed else "")
             messagebox.showinfo("Import Complete", 
-                              f"Fetched data from {len(email_ids)} emails\n\n"
-                              f"Records imported: {total_imported}\n"
-                              f"Duplicates skipped: {total_skipped}")
+                              f"Fetched data from {run.emails_found} emails\n\n"
+                              f"Records imported: {run.records_imported}\n"
+                              f"Duplicates skipped: {run.duplicates_skipped}{failed}")
         except Exception as e:
             self.status.config(text="Error fetching emails")
             messagebox.showerror("Error", f"Could not fetch emails: {e}")
 
+    def show_progress(self, text):
+        self.status.config(text=text)
+        self.update_idletasks()
+
     def import_csv(self, filepath, source_email=None, source_file=None):
-        records_imported = 0
-        duplicates_skipped = 0
-        
-        with open(filepath, newline="") as csvfile:
-            reader = csv.reader(csvfile)
-            header = next(reader)
-            for row in reader:
-                # Decrypt each field if pin is provided and value is not empty
-                if self.pin.get():
-                    # Only attempt decryption on fields that are not empty
-                    row = [self.try_decrypt(cell) if cell else "" for cell in row]
-                
-                if self.save_service(row, source_email, source_file):
-                    records_imported += 1
-                else:
-                    duplicates_skipped += 1
-        
-        # Log the import
-        with self.conn:
-            self.conn.execute('''
-                INSERT INTO import_log (filename, record_count, duplicates_skipped, status)
-                VALUES (?, ?, ?, ?)
-            ''', (source_file, records_imported, duplicates_skipped, 'success'))
-        
-        return records_imported, duplicates_skipped
-
-    def try_decrypt(self, value):
-        # Try to decrypt, else return as is
-        decrypted = decrypt_data(value, self.pin.get())
-        return decrypted if decrypted is not None else value
-
-    def save_service(self, row, source_email=None, source_file=None):
-        # row: [ID, Timestamp, Student, Service, Duration, Event, Score, Goal_ID, Device_ID, Reported]
-        # Store all relevant fields from new schema
-        if len(row) >= 7:
-            # Convert duration and score to float
-            duration_val = None
-            if row[4]:
-                try:
-                    duration_val = float(row[4])
-                except (ValueError, TypeError):
-                    duration_val = None
-            
-            score_val = None
-            if row[6]:
-                try:
-                    score_val = float(row[6])
-                except (ValueError, TypeError):
-                    score_val = None
-            
-            goal_id = row[7] if len(row) > 7 else None
-            device_id = row[8] if len(row) > 8 else None
-            
-            try:
-                with self.conn:
-                    self.conn.execute('''
-                        INSERT OR IGNORE INTO services (timestamp, student, service, duration, event, score, 
-                                            goal_id, device_id, source_email, source_file, schema_version)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-                    ''', (row[1], row[2], row[3], duration_val, row[5], score_val, 
-                         goal_id, device_id, source_email, source_file))
-                return True  # Successfully inserted
-            except sqlite3.IntegrityError:
-                return False  # Duplicate, skipped
+        return import_csv_file(self.conn, filepath, self.pin.get(), source_email, source_file)
 
     def load_data_to_table(self):
         self.tree.delete(*self.tree.get_children())
         cur = self.conn.cursor()
-        cur.execute("SELECT timestamp, student, service, duration, event, score FROM services")
+        cur.execute("SELECT timestamp, student, service, duration, event, score FROM services ORDER BY ts_epoch, id")
         self.data = cur.fetchall()
         for row in self.data:
             self.tree.insert("", "end", values=row)
@@ -298,14 +815,60 @@ class ServiceAggregatorApp(tk.Tk):
                 writer.writerow(row)
         messagebox.showinfo("Exported", f"Data exported to {path}")
 
+    def export_snapshot(self):
+        path = filedialog.askdirectory(title="Snapshot Folder", initialdir=os.path.abspath(SNAPSHOT_DIR),
+                                       mustexist=False)
+        if not path:
+            return
+        self.status.config(text="Writing Parquet snapshot...")
+        self.update_idletasks()
+        try:
+            result = export_parquet_snapshot(self.conn, path)
+        except Exception as e:
+            self.status.config(text="Snapshot failed")
+            messagebox.showerror("Snapshot Error", f"Could not write snapshot: {e}")
+            return
+        self.status.config(text=f"Snapshot: {len(result['written'])} months written, "
+                                f"{len(result['unchanged'])} unchanged, {len(result['removed'])} removed")
+        messagebox.showinfo("Snapshot Written", f"Parquet snapshot updated in {path}")
+
     def show_summary(self):
         cur = self.conn.cursor()
-        cur.execute("SELECT student, COUNT(*), SUM(CAST(duration AS FLOAT)) FROM services GROUP BY student")
+        cur.execute("SELECT student, sessions, duration_sum FROM student_summary ORDER BY student")
         summary = cur.fetchall()
         text = "Student | # Services | Total Duration\n"
         text += "\n".join(f"{s} | {c} | {d or 0}" for s, c, d in summary)
         messagebox.showinfo("Summary", text)
 
+    def show_run_history(self):
+        columns, rows = recent_import_runs(self.conn)
+        win = tk.Toplevel(self)
+        win.title("Import Run History")
+        win.geometry("1100x400")
+        tree = ttk.Treeview(win, columns=columns, show="headings")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=70, anchor="e")
+        tree.column("started_at", width=140, anchor="w")
+        for row in rows:
+            tree.insert("", "end", values=[f"{v:.2f}" if isinstance(v, float) else v for v in row])
+        scrollbar_x = ttk.Scrollbar(win, orient="horizontal", command=tree.xview)
+        tree.configure(xscrollcommand=scrollbar_x.set)
+        scrollbar_x.pack(side="bottom", fill="x")
+        tree.pack(expand=True, fill="both", padx=10, pady=10)
+
+    def rebuild_summaries(self):
+        self.status.config(text="Rebuilding summaries...")
+        self.update_idletasks()
+        mismatches = rebuild_rollups(self.conn)
+        if any(mismatches.values()):
+            details = "\n".join(f"{t}: {n} groups differ" for t, n in mismatches.items() if n)
+            self.status.config(text="Summary rebuild found mismatches")
+            messagebox.showerror("Summary Check Failed", f"Summaries do not match the service records:\n{details}")
+        else:
+            self.status.config(text="Summaries rebuilt and verified")
+            messagebox.showinfo("Summaries Rebuilt", "Summaries rebuilt and verified against the service records.")
+
     def clear_table(self):
         self.tree.delete(*self.tree.get_children())
         # Clear DB for a new aggregation session
@@ -313,6 +876,39 @@ class ServiceAggregatorApp(tk.Tk):
             self.conn.execute("DELETE FROM services")
         self.data = []
 
-if __name__ == "__main__":
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Service Log Aggregator")
+    parser.add_argument("--db", default=DB_FILE, help="Aggregated database file")
+    parser.add_argument("--rebuild-summaries", action="store_true",
+                        help="Recompute summary tables from scratch, verify them and exit")
+    parser.add_argument("--snapshot", nargs="?", const=SNAPSHOT_DIR, metavar="DIR",
+                        help=f"Update the month-partitioned Parquet snapshot (default {SNAPSHOT_DIR}) and exit")
+    args = parser.parse_args(argv)
+
+    if args.snapshot:
+        conn = sqlite3.connect(args.db)
+        init_schema(conn)
+        result = export_parquet_snapshot(conn, args.snapshot)
+        conn.close()
+        for key in ("written", "unchanged", "removed"):
+            print(f"{key}: {', '.join(result[key]) or '-'}")
+        return 0
+
+    if args.rebuild_summaries:
+        conn = sqlite3.connect(args.db)
+        init_schema(conn)
+        before = check_rollups(conn)
+        after = rebuild_rollups(conn)
+        conn.close()
+        for table in ROLLUP_TABLES:
+            print(f"{table}: {before[table]} groups drifted before rebuild, {after[table]} after")
+        return 1 if any(after.values()) else 0
+
     app = ServiceAggregatorApp()
     app.mainloop()
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,1003 @@
+# -*- coding: utf-8 -*-
+"""
+SPED Services Analytics - data layer
+Loads aggregated service records into pandas for the dashboard.
+Kept free of Streamlit so it can be reused by scripts and benchmarks.
+"""
+
+import gzip
+import io
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DB_FILE = "aggregated_services.db"
+SNAPSHOT_DIR = Path("snapshot")  # Written by the Services Aggregator's "Export Snapshot"
+SECONDS_PER_DAY = 86400
+SERVICE_COLUMNS = [
+    "id", "ts_epoch", "day_key", "student", "service", "duration", "event", "score",
+    "goal_id", "device_id", "source_email", "schema_version", "imported_at",
+]
+
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+DETAIL_COLUMNS = ["id", "ts_epoch", "student", "service", "duration", "event", "score", "goal_id", "device_id"]
+# Low-cardinality text is dictionary-encoded; measures need no more than float32
+CATEGORY_COLUMNS = ["student", "service", "event", "goal_id", "device_id", "source_email", "imported_at"]
+# Keys where a blank is as good as missing. The aggregator's rollups key NULL
+# and '' alike, so every path counts and groups both as missing.
+BLANK_KEY_COLUMNS = ["student", "service", "goal_id"]
+FLOAT32_COLUMNS = ["duration", "score"]
+
+def local_day_key(dt):
+    """Days since 1970-01-01 on the local wall clock, matching the day_key column"""
+    return dt.toordinal() - EPOCH_ORDINAL
+
+def _day_categorical(day_codes, per_day):
+    """Categorical column from one value per distinct day (code -1 = missing day)"""
+    values = pd.Categorical(per_day)
+    if not len(values):  # Every day missing: nothing to index
+        return pd.Categorical.from_codes(np.full(len(day_codes), -1), values.categories)
+    codes = np.where(day_codes >= 0, values.codes[day_codes], -1)
+    return pd.Categorical.from_codes(codes, values.categories)
+
+def iso_week_labels(day_dates):
+    """ISO year-week labels such as 2025-W07 (the ISO year, which can differ at New Year)"""
+    iso = day_dates.isocalendar()
+    return (iso['year'].astype(str) + "-W" + iso['week'].astype(str).str.zfill(2)).to_numpy()
+
+def add_time_features(df):
+    """Derive every time feature the dashboard uses, once per loaded chunk of rows.
+
+    Adds timestamp, date, hour, dow (Monday=0), week (ISO year-week), month
+    (YYYY-MM) and weekday name next to the stored ts_epoch and day_key. Views
+    read these columns instead of deriving their own, and never write to the frame.
+    """
+    # Integer epochs convert to datetimes without any string parsing
+    df['timestamp'] = pd.to_datetime(df['ts_epoch'], unit='s')
+    df['hour'] = (df['ts_epoch'] % SECONDS_PER_DAY // 3600).astype('Int8')
+    df['dow'] = ((df['day_key'] + 3) % 7).astype('Int8')  # 1970-01-01 was a Thursday
+    # Calendar fields are worked out once per distinct day, not once per row
+    day_codes, days = pd.factorize(df['day_key'])
+    day_dates = pd.to_datetime(days, unit='D')
+    # Code -1 is a NULL day_key (an unparseable timestamp): NaT, not the last day
+    df['date'] = day_dates.take(day_codes, allow_fill=True, fill_value=pd.NaT)
+    df['week'] = _day_categorical(day_codes, iso_week_labels(day_dates))
+    df['month'] = _day_categorical(day_codes, day_dates.strftime('%Y-%m'))
+    df['weekday'] = _day_categorical(day_codes, day_dates.day_name())
+    return df
+
+def compact_frame(df):
+    """Dictionary-encode repeated strings and narrow numeric columns, in place"""
+    for col in CATEGORY_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype('category')
+            if col in BLANK_KEY_COLUMNS and '' in df[col].cat.categories:
+                df[col] = df[col].cat.remove_categories([''])
+    for col in FLOAT32_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype('float32')
+    if 'day_key' in df and df['day_key'].notna().all():
+        df['day_key'] = df['day_key'].astype('int32')
+    return df
+
+def append_frames(frame, new_rows):
+    """Concatenate two compact frames, merging categories so columns stay categorical"""
+    columns = {}
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            merged = frame[col].cat.categories.union(new_rows[col].cat.categories)
+            parts = [frame[col].cat.set_categories(merged), new_rows[col].cat.set_categories(merged)]
+            columns[col] = pd.concat(parts, ignore_index=True)
+        else:
+            columns[col] = pd.concat([frame[col], new_rows[col]], ignore_index=True)
+    return pd.DataFrame(columns)
+
+def frame_memory(df):
+    """Total in-memory size of a frame and the average per row, in bytes"""
+    total = int(df.memory_usage(index=True, deep=True).sum())
+    return {"bytes": total, "bytes_per_row": total / len(df) if len(df) else 0.0}
+
+def read_services(conn, after_id=0):
+    """Read service rows with id greater than after_id, oldest id first"""
+    query = f"""
+    SELECT {", ".join(SERVICE_COLUMNS)}
+    FROM services
+    WHERE id > ?
+    ORDER BY id
+    """
+    return compact_frame(add_time_features(pd.read_sql_query(query, conn, params=(after_id,))))
+
+def services_updates(conn):
+    """The aggregator's count of UPDATEs on services (None if the database predates it)"""
+    try:
+        row = conn.execute("SELECT version FROM table_versions WHERE name = 'services_updates'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def count_services(conn):
+    """Row count of services, from the aggregator's rollups when they exist"""
+    try:
+        return int(conn.execute("SELECT TOTAL(sessions) FROM student_summary").fetchone()[0])
+    except sqlite3.OperationalError:
+        return conn.execute("SELECT COUNT(*) FROM services").fetchone()[0]
+
+def service_filter_sql(students=(), services=(), day_range=None, min_score=0):
+    """Parameterised WHERE clause for the Detailed Data filters"""
+    clauses, params = [], []
+    if students:
+        clauses.append(f"student IN ({', '.join('?' * len(students))})")
+        params.extend(students)
+    if services:
+        clauses.append(f"service IN ({', '.join('?' * len(services))})")
+        params.extend(services)
+    if day_range:
+        clauses.append("day_key BETWEEN ? AND ?")
+        params.extend(local_day_key(d) for d in day_range)
+    if min_score > 0:
+        clauses.append("score >= ?")
+        params.append(min_score)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+def count_matching(conn, where="", params=()):
+    """Number of services rows matching a service_filter_sql() clause"""
+    if not where:
+        return count_services(conn)
+    return conn.execute(f"SELECT COUNT(*) FROM services{where}", list(params)).fetchone()[0]
+
+def _and(where, clause):
+    return where + (" AND " if where else " WHERE ") + clause
+
+def read_matching(conn, where="", params=(), limit=None, after=None, columns=DETAIL_COLUMNS):
+    """Matching rows newest first, optionally one page of them.
+
+    Pages are keyset-paginated: after is the (ts_epoch, id) of the last row on
+    the previous page, so every page costs the same however deep it is. Rows
+    without a ts_epoch (unparseable timestamps) come last, newest id first;
+    their cursor is (None, id).
+    """
+    params = list(params)
+    if after is not None and after[0] is None:
+        df = _read_page(conn, _and(where, "ts_epoch IS NULL AND id < ?"), params + [after[1]], limit, columns)
+    elif after is not None:
+        # A row-value comparison is never true for NULL ts_epoch, so undated rows are read separately
+        df = _read_page(conn, _and(where, "(ts_epoch, id) < (?, ?)"), params + list(after), limit, columns)
+        if limit is None or len(df) < limit:
+            rest = _read_page(conn, _and(where, "ts_epoch IS NULL"), params,
+                              None if limit is None else limit - len(df), columns)
+            if not rest.empty:
+                df = pd.concat([df, rest], ignore_index=True) if not df.empty else rest
+    else:
+        df = _read_page(conn, where, params, limit, columns)
+    df['timestamp'] = pd.to_datetime(df['ts_epoch'], unit='s')
+    return df
+
+def _read_page(conn, where, params, limit, columns):
+    # SQLite sorts NULL lowest, so DESC puts undated rows after every dated one
+    query = f"SELECT {', '.join(columns)} FROM services{where} ORDER BY ts_epoch DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params = params + [limit]
+    return pd.read_sql_query(query, conn, params=params)
+
+def iter_matching(conn, where="", params=(), chunk_rows=50_000, columns=DETAIL_COLUMNS):
+    """All matching rows newest first, as frames of at most chunk_rows"""
+    after = None
+    while True:
+        chunk = read_matching(conn, where, params, limit=chunk_rows, after=after, columns=columns)
+        if chunk.empty:
+            return
+        yield chunk
+        if len(chunk) < chunk_rows:
+            return
+        after = page_cursor(chunk)
+
+# Download formats: label -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+def export_formats():
+    """Download formats usable here (Parquet needs the optional pyarrow)"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return [fmt for fmt in EXPORT_FORMATS if fmt != "Parquet"]
+    return list(EXPORT_FORMATS)
+
+def write_export(frames, fmt="CSV"):
+    """One file in an EXPORT_FORMATS format, written frame by frame; returns bytes.
+
+    Only one chunk of rows is held as a DataFrame at a time. CSV takes its
+    header from the first frame; Parquet writes each frame as a row group.
+    """
+    buffer = io.BytesIO()
+    if fmt == "Parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        for frame in frames:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(buffer, table.schema)
+            writer.write_table(table.cast(writer.schema))
+        if writer is not None:
+            writer.close()
+        return buffer.getvalue()
+    target = gzip.GzipFile(fileobj=buffer, mode="wb") if fmt == "CSV (gzip)" else buffer
+    with io.TextIOWrapper(target, encoding="utf-8", newline="") as text:
+        for i, frame in enumerate(frames):
+            frame.to_csv(text, header=i == 0, index=False)
+        text.flush()
+        if target is not buffer:
+            target.close()
+        return buffer.getvalue()
+
+def pivot_export_frame(pivot):
+    """A pivot table as a flat frame (row keys as columns, column keys joined) for export"""
+    flat = pivot.copy()
+    flat.columns = [" / ".join(str(part) for part in col if part != "") if isinstance(col, tuple) else str(col)
+                    for col in flat.columns]
+    return flat.reset_index()
+
+def page_after(df, limit, after=None):
+    """read_matching()'s keyset page for a frame already sorted newest first (undated rows last)"""
+    if after is not None:
+        ts, row_id = after
+        undated = df['ts_epoch'].isna()
+        if ts is None:
+            df = df[undated & (df['id'] < row_id)]
+        else:
+            df = df[(df['ts_epoch'] < ts) | ((df['ts_epoch'] == ts) & (df['id'] < row_id)) | undated]
+    return df.head(limit)
+
+def page_cursor(page):
+    """Keyset cursor that continues after the last row of page"""
+    ts = page['ts_epoch'].iloc[-1]
+    return None if pd.isna(ts) else int(ts), int(page['id'].iloc[-1])
+
+def filter_frame(df, students=(), services=(), day_range=None, min_score=0):
+    """In-memory equivalent of service_filter_sql() for frames not backed by SQLite"""
+    mask = pd.Series(True, index=df.index)
+    if students:
+        mask &= df['student'].isin(students)
+    if services:
+        mask &= df['service'].isin(services)
+    if day_range:
+        low, high = (local_day_key(d) for d in day_range)
+        mask &= df['day_key'].between(low, high)
+    if min_score > 0:
+        mask &= df['score'] >= min_score
+    return df[mask].sort_values(['ts_epoch', 'id'], ascending=False)
+
+def filter_options(conn):
+    """Student and service choices plus the date span, without scanning services"""
+    students = [r[0] for r in conn.execute("SELECT student FROM student_summary ORDER BY student")]
+    services = [r[0] for r in conn.execute(
+        "SELECT DISTINCT service FROM student_service_daily ORDER BY service")]
+    # MIN/MAX on an indexed column are single index lookups
+    first_day = conn.execute("SELECT MIN(day_key) FROM services").fetchone()[0]
+    last_day = conn.execute("SELECT MAX(day_key) FROM services").fetchone()[0]
+    return {
+        "students": students,
+        "services": services,
+        "first_date": date.fromordinal(EPOCH_ORDINAL + first_day) if first_day is not None else None,
+        "last_date": date.fromordinal(EPOCH_ORDINAL + last_day) if last_day is not None else None,
+    }
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """Load every partition of a Parquet snapshot, oldest id first"""
+    df = pd.read_parquet(snapshot_dir, columns=SERVICE_COLUMNS)
+    df = df.sort_values('id', ignore_index=True)
+    # Dictionary-encoded columns already arrive as categoricals
+    return compact_frame(add_time_features(df))
+
+class ChangeDetector:
+    """Cheap per-table change detection for a read-only connection.
+
+    PRAGMA data_version only moves when another connection commits, so polling it
+    costs next to nothing while the database is idle. When it moves, the
+    aggregator's table_versions counters say which tables actually changed.
+    """
+
+    def __init__(self):
+        self.data_version = None
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Force the next poll to re-read the table counters"""
+        self.data_version = None
+
+    def poll(self, conn):
+        """Return the current {table: version} map"""
+        with self._lock:
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self.data_version:
+                try:
+                    versions = dict(conn.execute("SELECT name, version FROM table_versions"))
+                except sqlite3.OperationalError:
+                    # Database predates the counters: any commit counts as a change to everything
+                    versions = {"services": data_version, "import_runs": data_version}
+                self.data_version = data_version
+                self.versions = versions
+            return dict(self.versions)
+
+class ServiceFrameCache:
+    """Process-wide services DataFrame that refreshes by fetching only new rows.
+
+    The aggregator never reuses ids, so rows with id above the last one seen are
+    exactly the new ones. The frame is reloaded in full instead when the table's
+    row count no longer matches (rows were deleted, e.g. "Clear Table" before a
+    re-import), when rows were edited in place (the aggregator's services_updates
+    counter moved; databases from before that counter miss such edits), and when
+    the frame is still empty, whose columns have no dtypes to append onto.
+    Refreshes happen only when the services version passed to get() changes.
+    Callers must treat the returned frame as read-only.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.version = None
+        self.last_id = 0
+        self.updates = None
+        self.full_loads = 0
+        self.incremental_loads = 0
+        self._lock = threading.Lock()
+
+    def get(self, conn, version):
+        with self._lock:
+            if self.frame is None or version != self.version:
+                self._refresh(conn)
+                self.version = version
+            return self.frame
+
+    def _refresh(self, conn):
+        updates = services_updates(conn)
+        if self.frame is None or self.frame.empty or updates != self.updates:
+            self._full_load(conn)
+            self.updates = updates
+            return
+        new_rows = read_services(conn, self.last_id)
+        if count_services(conn) != len(self.frame) + len(new_rows):
+            self._full_load(conn)
+            return
+        if not new_rows.empty:
+            self.frame = append_frames(self.frame, new_rows)
+            self.last_id = int(new_rows['id'].iloc[-1])
+            self.incremental_loads += 1
+
+    def _full_load(self, conn):
+        self.frame = read_services(conn)
+        self.last_id = int(self.frame['id'].iloc[-1]) if not self.frame.empty else 0
+        self.full_loads += 1
+
+# ------------------ Shared Data Store ---------------------
+def enable_copy_on_write():
+    """Turn on pandas Copy-on-Write, which keeps writes to DataStore views off the shared frame.
+
+    A process-wide option, so it is the dashboard's to set, not this module's
+    on import. Always on from pandas 3.
+    """
+    if int(pd.__version__.split(".")[0]) < 3:
+        pd.set_option("mode.copy_on_write", True)
+
+DEFAULT_CACHE_MB = 256
+
+def cache_budget_bytes():
+    """Derived-result budget from DASHBOARD_CACHE_MB (megabytes), default 256"""
+    try:
+        return int(float(os.environ.get("DASHBOARD_CACHE_MB", DEFAULT_CACHE_MB)) * 2**20)
+    except ValueError:
+        return DEFAULT_CACHE_MB * 2**20
+
+def estimate_bytes(value):
+    """Approximate memory held by a cached value"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_bytes(item) for item in value.values())
+    return sys.getsizeof(value)
+
+class DataStore:
+    """Process-wide home of the dashboard's data, shared by every session.
+
+    Holds one base frame per source (the SQLite services table, refreshed
+    incrementally, or the Parquet snapshot) and hands sessions zero-copy
+    views of it (safe to modify only with enable_copy_on_write() on).
+    Anything derived from a base frame goes through get_or_compute(), an
+    LRU cache bounded by a byte budget. Derived keys start with the
+    (source, version) they were computed from; results for an older
+    version are dropped as soon as that source reloads.
+    """
+
+    def __init__(self, budget_bytes=None):
+        self.budget_bytes = cache_budget_bytes() if budget_bytes is None else budget_bytes
+        self.services = ServiceFrameCache()
+        self.snapshot = None
+        self.snapshot_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversize = 0
+        self._results = {}  # key -> (value, bytes, created, hits); insertion order = LRU order
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    # ---- base frames ----
+    def frame(self, source, version, conn=None, snapshot_dir=SNAPSHOT_DIR):
+        """The shared base frame for source at version. Treat it as read-only"""
+        if source == "snapshot":
+            with self._lock:
+                if self.snapshot is None or version != self.snapshot_version:
+                    self.snapshot = load_snapshot(snapshot_dir)
+                    self.snapshot_version = version
+                    self._drop_stale(("snapshot", version))
+                return self.snapshot
+        frame = self.services.get(conn, version)
+        self._drop_stale(("services", version))
+        return frame
+
+    def view(self, source, version, columns=None, conn=None, snapshot_dir=SNAPSHOT_DIR):
+        """A per-session view of the base frame (optionally a column subset) sharing its memory"""
+        base = self.frame(source, version, conn, snapshot_dir)
+        return base[list(columns)] if columns is not None else base.copy(deep=False)
+
+    def frame_bytes(self):
+        """Memory held by the base frames, by source"""
+        frames = {"services": self.services.frame, "snapshot": self.snapshot}
+        return {name: estimate_bytes(frame) for name, frame in frames.items() if frame is not None}
+
+    # ---- derived results ----
+    def get_or_compute(self, key, compute):
+        """Cached value for key, computing (and caching) it with compute() on a miss"""
+        with self._lock:
+            if key in self._results:
+                value, size, created, hits = self._results.pop(key)
+                self._results[key] = (value, size, created, hits + 1)  # most recently used goes last
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = compute()
+        size = estimate_bytes(value)
+        with self._lock:
+            if size > self.budget_bytes:
+                self.oversize += 1  # Never cached; it would evict everything else
+                return value
+            if key in self._results:
+                self._bytes -= self._results.pop(key)[1]
+            self._results[key] = (value, size, time.time(), 0)
+            self._bytes += size
+            while self._bytes > self.budget_bytes:
+                self._evict(next(iter(self._results)))
+                self.evictions += 1
+        return value
+
+    def _evict(self, key):
+        self._bytes -= self._results.pop(key)[1]
+
+    def _drop_stale(self, current):
+        """Forget results derived from an older version of current's source"""
+        with self._lock:
+            for key in [k for k in self._results if k[0][0] == current[0] and k[0] != current]:
+                self._evict(key)
+
+    def clear(self):
+        """Drop every derived result (base frames stay loaded)"""
+        with self._lock:
+            self._results.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Counters and sizes for the admin page"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "budget_bytes": self.budget_bytes,
+                "used_bytes": self._bytes,
+                "entries": len(self._results),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "oversize": self.oversize,
+                "full_loads": self.services.full_loads,
+                "incremental_loads": self.services.incremental_loads,
+            }
+
+    def entries(self):
+        """Cached results, least recently used first: key, bytes, age in seconds, hits"""
+        now = time.time()
+        with self._lock:
+            return [
+                {"key": key, "bytes": size, "age_s": now - created, "hits": hits}
+                for key, (_, size, created, hits) in self._results.items()
+            ]
+
+# ------------------ Pivot Engine ---------------------
+PIVOT_AGGS = ("mean", "sum", "count", "min", "max")
+MARGINS_NAME = "Total"
+
+# Pivot dimensions SQLite can group by; {ts} is the local epoch-seconds expression
+# and {day} the day_key. Blank keys come out NULL, so they are left out like NULLs.
+# Weekday names and ISO weeks are filled in afterwards (SQLite here lacks %V).
+SQL_DIMENSIONS = {
+    "student": "NULLIF(student, '')",
+    "service": "NULLIF(service, '')",
+    "goal_id": "NULLIF(goal_id, '')",
+    "device_id": "device_id",
+    "event": "event",
+    "month": "strftime('%Y-%m', {ts}, 'unixepoch')",
+    "weekday": "CAST(strftime('%w', {ts}, 'unixepoch') AS INTEGER)",
+    "week": "{day}",
+}
+WEEKDAY_NAMES = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+# Dimensions available from the student_service_daily rollup (dates derive from day_key)
+ROLLUP_DIMENSIONS = {"student", "service", "week", "month", "weekday"}
+# The rollup keys a NULL day_key as day 0 (see ROLLUP_KEY_EXPRS in the aggregator)
+ROLLUP_DAY = "NULLIF(day_key, 0)"
+
+def _partials_from_sql(conn, keys, value, rollup=False):
+    """Partial aggregates grouped in SQLite, from services or the daily rollup"""
+    day = ROLLUP_DAY if rollup else "day_key"
+    ts = f"{day} * {SECONDS_PER_DAY}" if rollup else "ts_epoch"
+    exprs = {k: SQL_DIMENSIONS[k].format(ts=ts, day=day) for k in keys}
+    if rollup:
+        # Running totals cannot keep extremes, so min/max never take this path
+        sums, counts = ("sessions", "sessions") if value == "count" else (f"{value}_sum", f"{value}_n")
+        measures = f"""TOTAL(sessions) AS n, TOTAL({sums}) AS v_sum, TOTAL({counts}) AS v_count,
+           NULL AS v_min, NULL AS v_max"""
+        table = "student_service_daily"
+    else:
+        column = "id" if value == "count" else value
+        measures = f"""COUNT(*) AS n, TOTAL({column}) AS v_sum, COUNT({column}) AS v_count,
+           MIN({column}) AS v_min, MAX({column}) AS v_max"""
+        table = "services"
+    query = f"""
+    SELECT {", ".join(f"{e} AS {k}" for k, e in exprs.items())}, {measures}
+    FROM {table}
+    WHERE {" AND ".join(f"{e} IS NOT NULL" for e in exprs.values())}
+    GROUP BY {", ".join(keys)}
+    """
+    parts = pd.read_sql_query(query, conn)
+    parts = parts.astype({'n': 'int64', 'v_count': 'int64', 'v_min': 'float64', 'v_max': 'float64'})
+    if "weekday" in keys:
+        parts['weekday'] = parts['weekday'].map(WEEKDAY_NAMES.__getitem__)
+    if "week" in keys:
+        # Grouped by day so far; days are few, so map each distinct one to its ISO week
+        days = parts['week'].unique()
+        weeks = pd.Series(iso_week_labels(pd.to_datetime(days, unit='D')), index=days)
+        parts['week'] = parts['week'].map(weeks)
+    if "weekday" in keys or "week" in keys:
+        return _combine(parts.set_index(keys), keys)
+    return parts.set_index(keys).sort_index()
+
+def _finalize(parts, value, agg):
+    """Turn partial aggregates into the requested statistic"""
+    if value == "count":
+        return parts['n']
+    if agg == "sum":
+        return parts['v_sum']
+    if agg == "count":
+        return parts['v_count']
+    if agg == "mean":
+        return parts['v_sum'] / parts['v_count'].where(parts['v_count'] > 0)
+    return parts['v_min' if agg == "min" else 'v_max']
+
+def _combine(parts, keys):
+    """Merge partial aggregates up to coarser keys (None = grand total)"""
+    spec = {'n': 'sum', 'v_sum': 'sum', 'v_count': 'sum', 'v_min': 'min', 'v_max': 'max'}
+    if not keys:
+        return parts.agg(spec).to_frame().T.astype(parts.dtypes.to_dict())
+    return parts.groupby(level=keys, observed=True, sort=True).agg(spec)
+
+def _margin_key(levels):
+    return MARGINS_NAME if levels == 1 else (MARGINS_NAME,) + ("",) * (levels - 1)
+
+def assemble_pivot(parts, rows, cols, value, agg):
+    """Build a pivot table with totals from partial aggregates, without rescanning data"""
+    label = "id" if value == "count" else value
+    row_totals = _finalize(_combine(parts, rows), value, agg)
+    grand_total = _finalize(_combine(parts, None), value, agg).iloc[0]
+    if not cols:
+        table = row_totals.to_frame(label).dropna(how='all')
+        total_row = pd.DataFrame({label: [grand_total]}, index=[_margin_key(len(rows))])
+        table = pd.concat([table, total_row])
+        if len(rows) > 1:
+            table.index = pd.MultiIndex.from_tuples(table.index, names=rows)
+        else:
+            table.index.name = rows[0]
+        return table.fillna(0)
+
+    # Like pd.pivot_table(dropna=True), leave out rows and columns with no values at all
+    table = _finalize(parts, value, agg).unstack(cols).dropna(how='all').dropna(axis=1, how='all')
+    table = table.sort_index(axis=1)
+    col_totals = _finalize(_combine(parts, cols), value, agg)
+    table[_margin_key(len(cols))] = row_totals
+    total_row = col_totals.to_frame().T
+    total_row[_margin_key(len(cols))] = grand_total
+    total_row.index = [_margin_key(len(rows))]
+    table = pd.concat([table, total_row.reindex(columns=table.columns)])
+    if len(rows) > 1:
+        table.index = pd.MultiIndex.from_tuples(table.index, names=rows)
+    else:
+        table.index.name = rows[0]
+    return table.fillna(0)
+
+class PivotEngine:
+    """Memoised pivot tables computed from partial aggregates.
+
+    Results are keyed by (rows, cols, values, agg, data version), so reruns
+    that only change presentation are lookups. Grouping runs in pandas over a
+    loaded frame, or in SQLite (the student_service_daily rollup or a GROUP BY
+    on services) when there is none. Margins are combined from the per-cell
+    partials instead of a second pass over the data.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._results = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def plan(rows, cols, value, agg, conn=None, frame=None, backend=None):
+        """Where a pivot would be computed: 'pandas', 'rollup', 'sql' or the backend's name.
+
+        An explicit query backend always wins. Otherwise a frame that is already
+        in memory groups fastest; SQLite is used when only a connection is
+        available, so the frame never has to be loaded. Every path leaves out
+        rows whose key is NULL or blank (see BLANK_KEY_COLUMNS).
+        """
+        if backend is not None:
+            return backend.name
+        keys = set(rows) | set(cols)
+        if frame is not None and keys <= set(frame.columns):
+            return "pandas"
+        if conn is not None:
+            if keys <= ROLLUP_DIMENSIONS and (value == "count" or agg in ("sum", "mean", "count")):
+                return "rollup"
+            if keys <= set(SQL_DIMENSIONS):
+                return "sql"
+        raise ValueError("These dimensions need the loaded data frame")
+
+    def pivot(self, rows, cols, value, agg, version, conn=None, frame=None, backend=None):
+        """Pivot table for value aggregated by agg over rows x cols, with totals.
+
+        value is a column name or "count" for the number of sessions. Pass conn
+        to allow SQLite/rollup execution, frame to group in pandas, or both;
+        pass a query backend (e.g. DuckDBBackend) to group there instead.
+        """
+        rows, cols = list(rows), list(cols)
+        if not rows:
+            raise ValueError("Select at least one row dimension")
+        if set(rows) & set(cols):
+            raise ValueError("A field cannot be both a row and a column")
+        if agg not in PIVOT_AGGS:
+            raise ValueError(f"Unknown aggregation: {agg}")
+        key = (tuple(rows), tuple(cols), value, agg, version, getattr(backend, "name", None))
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                self._results[key] = self._results.pop(key)  # most recently used goes last
+                return self._results[key]
+            self.misses += 1
+
+        method = self.plan(rows, cols, value, agg, conn, frame, backend)
+        keys = rows + cols
+        if method in ("rollup", "sql"):
+            parts = _partials_from_sql(conn, keys, value, rollup=method == "rollup")
+        elif method == "pandas":
+            parts = backend_partials(PandasBackend(frame), keys, value)
+        else:
+            parts = backend_partials(backend, keys, value)
+        result = assemble_pivot(parts, rows, cols, value, agg)
+
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_entries:
+                self._results.pop(next(iter(self._results)))
+        return result
+
+# ------------------ Chart Downsampling ---------------------
+MAX_CHART_POINTS = 1000  # Per series; beyond this the browser only sees overplotting
+HISTOGRAM_BINS = 20
+LOWESS_ANCHORS = 200  # Exact fits per trendline; the curve is interpolated in between
+
+def _numeric(values):
+    """Chart x/y values as float64 (datetimes become epoch units)"""
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        values = values.astype('int64')
+    return values.astype('float64')
+
+def lttb(x, y, threshold=MAX_CHART_POINTS):
+    """Indices of the points Largest-Triangle-Three-Buckets keeps (x sorted ascending)"""
+    x, y = _numeric(x), _numeric(y)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # First and last points are always kept; the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+def downsample(df, x, y, by=None, max_points=MAX_CHART_POINTS):
+    """Rows of df kept by LTTB, at most max_points per series (one series per value of by)"""
+    groups = [df] if by is None else [group for _, group in df.groupby(by, observed=True)]
+    parts = []
+    for group in groups:
+        group = group.sort_values(x)
+        parts.append(group.iloc[lttb(group[x], group[y], max_points)])
+    return pd.concat(parts, ignore_index=True) if parts else df.iloc[:0]
+
+def histogram_bins(values, bins=HISTOGRAM_BINS):
+    """Pre-binned histogram of the non-missing values: bin start, end, centre and count"""
+    values = pd.Series(values).dropna().to_numpy(dtype='float64')
+    if len(values) == 0:
+        return pd.DataFrame(columns=["start", "end", "center", "count"])
+    counts, edges = np.histogram(values, bins=bins)
+    return pd.DataFrame({
+        "start": edges[:-1],
+        "end": edges[1:],
+        "center": (edges[:-1] + edges[1:]) / 2,
+        "count": counts,
+    })
+
+def _lowess_at(x, y, robust, xi, k):
+    """Locally weighted linear fit at xi over its k nearest points"""
+    left = np.searchsorted(x, xi) - k
+    left = min(max(left, 0), len(x) - k)
+    # Slide the window until it holds the k points closest to xi
+    while left > 0 and xi - x[left - 1] < x[left + k - 1] - xi:
+        left -= 1
+    while left + k < len(x) and x[left + k] - xi < xi - x[left]:
+        left += 1
+    xs, ys, rs = x[left:left + k], y[left:left + k], robust[left:left + k]
+    distance = np.abs(xs - xi)
+    radius = distance.max()
+    w = rs * (1 - (distance / radius) ** 3) ** 3 if radius > 0 else rs.copy()
+    total = w.sum()
+    if total <= 0:
+        return ys.mean()
+    mean_x, mean_y = (w * xs).sum() / total, (w * ys).sum() / total
+    spread = (w * (xs - mean_x) ** 2).sum()
+    slope = (w * (xs - mean_x) * (ys - mean_y)).sum() / spread if spread > 0 else 0.0
+    return mean_y + slope * (xi - mean_x)
+
+def lowess(x, y, frac=2 / 3, iterations=3, anchors=LOWESS_ANCHORS):
+    """Robust LOWESS smoothing of y against x (plotly's trendline="lowess" defaults).
+
+    With more points than anchors, fits exactly at that many evenly spaced
+    positions and interpolates between them (statsmodels' delta), so the cost
+    and the returned curve are bounded. Returns (x, fitted) sorted by x.
+    """
+    order = np.argsort(_numeric(x), kind='stable')
+    x, y = _numeric(x)[order], _numeric(y)[order]
+    n = len(x)
+    if n < 3:
+        return x, y
+    k = max(2, min(n, int(frac * n + 1e-10)))
+    if n <= anchors:
+        anchors = np.arange(n)
+    else:
+        anchors = np.unique(np.searchsorted(x, np.linspace(x[0], x[-1], anchors)))
+    robust = np.ones(n)
+    for step in range(iterations + 1):
+        fitted = np.array([_lowess_at(x, y, robust, x[i], k) for i in anchors])
+        if step == iterations:
+            break
+        residuals = y - np.interp(x, x[anchors], fitted)
+        scale = np.median(np.abs(residuals))
+        if scale == 0:
+            break
+        u = np.clip(residuals / (6 * scale), -1, 1)
+        robust = (1 - u ** 2) ** 2
+    return x[anchors], fitted
+
+# ------------------ Query Backends ---------------------
+# Aggregations are written once as (keys, measures, filters) and run on either
+# engine. A measure is (name, func, column) with func one of AGG_FUNCS; a filter
+# is (column, op, value) with op one of ">=", "<=", "==", "notnull".
+AGG_FUNCS = ("size", "sum", "count", "mean", "min", "max", "nunique")
+DUCKDB_DATE = "(DATE '1970-01-01' + CAST(day_key AS INTEGER))"
+DUCKDB_DIMENSIONS = {
+    **{col: f"NULLIF({col}, '')" for col in BLANK_KEY_COLUMNS},
+    "date": DUCKDB_DATE,
+    "hour": f"CAST(ts_epoch % {SECONDS_PER_DAY} // 3600 AS INTEGER)",
+    "dow": "CAST((day_key + 3) % 7 AS INTEGER)",
+    "week": f"strftime({DUCKDB_DATE}, '%G-W%V')",
+    "month": f"strftime({DUCKDB_DATE}, '%Y-%m')",
+    "weekday": f"dayname({DUCKDB_DATE})",
+}
+DUCKDB_MEASURES = {
+    "size": "COUNT(*)",
+    "sum": "COALESCE(SUM({}), 0)",
+    "count": "COUNT({})",
+    "mean": "AVG({})",
+    "min": "MIN({})",
+    "max": "MAX({})",
+    "nunique": "COUNT(DISTINCT {})",
+}
+
+def duckdb_available():
+    try:
+        import duckdb  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+class PandasBackend:
+    """Aggregations over an in-memory services frame (the dashboard's default engine)"""
+    name = "pandas"
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def aggregate(self, keys, measures, filters=()):
+        """One row per group of keys (sorted, null keys dropped) with the named measures"""
+        df = self.frame
+        mask = pd.Series(True, index=df.index)
+        for column, op, value in filters:
+            if op == "notnull":
+                mask &= df[column].notna()
+            elif op == ">=":
+                mask &= df[column] >= value
+            elif op == "<=":
+                mask &= df[column] <= value
+            else:
+                mask &= df[column] == value
+        columns = list(dict.fromkeys(list(keys) + [c for _, f, c in measures if f != "size"]))
+        data = df.loc[mask, columns or ['id']]
+        # float32 storage, float64 arithmetic
+        data = data.astype({c: 'float64' for c in columns if data[c].dtype == 'float32'})
+        spec = {name: (column or data.columns[0], func) for name, func, column in measures}
+        if not keys:
+            return pd.DataFrame({name: [data[column].agg(func)] for name, (column, func) in spec.items()})
+        return data.groupby(list(keys), observed=True, sort=True).agg(**spec).reset_index()
+
+class DuckDBBackend:
+    """The same aggregations run by DuckDB, straight off the SQLite file or the Parquet snapshot.
+
+    Nothing is loaded into pandas; DuckDB scans the source in parallel on every
+    query, so it always sees the latest imports. Needs the optional duckdb
+    package, and for the database source its sqlite extension, which DuckDB
+    downloads the first time; RuntimeError when either is missing.
+    """
+    name = "duckdb"
+
+    def __init__(self, source="sqlite", db_file=DB_FILE, snapshot_dir=SNAPSHOT_DIR):
+        try:
+            import duckdb
+        except ImportError:
+            raise RuntimeError("The DuckDB engine needs duckdb (pip install duckdb)")
+        self.source = source
+        self._con = duckdb.connect()
+        if source == "snapshot":
+            pattern = str(Path(snapshot_dir) / "*" / "*.parquet").replace("'", "''")
+            scan = f"read_parquet('{pattern}', hive_partitioning = false)"
+        else:
+            try:
+                self._con.execute("LOAD sqlite")  # Already installed: no download
+            except duckdb.Error:
+                try:
+                    self._con.execute("INSTALL sqlite")
+                    self._con.execute("LOAD sqlite")
+                except duckdb.Error as e:
+                    raise RuntimeError("DuckDB's sqlite extension is not installed and could not be downloaded "
+                                       f"(install it once while online, see requirements.txt): {e}") from None
+            scan = f"sqlite_scan('{str(db_file).replace(chr(39), chr(39) * 2)}', 'services')"
+        self._con.execute(f"CREATE VIEW services AS SELECT * FROM {scan}")
+
+    def aggregate(self, keys, measures, filters=()):
+        """One row per group of keys (sorted, null keys dropped) with the named measures"""
+        exprs = {key: DUCKDB_DIMENSIONS.get(key, key) for key in keys}
+        selects = [f"{expr} AS {key}" for key, expr in exprs.items()]
+        selects += [f"{DUCKDB_MEASURES[func].format(DUCKDB_DIMENSIONS.get(column, column))} AS {name}"
+                    for name, func, column in measures]
+        clauses, params = [f"{expr} IS NOT NULL" for expr in exprs.values()], []
+        for column, op, value in filters:
+            column = DUCKDB_DIMENSIONS.get(column, column)
+            if op == "notnull":
+                clauses.append(f"{column} IS NOT NULL")
+            else:
+                clauses.append(f"{column} {'=' if op == '==' else op} ?")
+                params.append(value)
+        query = f"SELECT {', '.join(selects)} FROM services"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        if keys:
+            query += f" GROUP BY {', '.join(keys)} ORDER BY {', '.join(keys)}"
+        # A cursor per call, so sessions on different threads can query at once
+        return self._con.cursor().execute(query, params).df()
+
+def backend_partials(backend, keys, value):
+    """Pivot partial aggregates (see assemble_pivot) computed by a query backend"""
+    column = "id" if value == "count" else value
+    parts = backend.aggregate(keys, [
+        ("n", "size", None), ("v_sum", "sum", column), ("v_count", "count", column),
+        ("v_min", "min", column), ("v_max", "max", column),
+    ])
+    return parts.astype({'n': 'int64', 'v_count': 'int64', 'v_sum': 'float64',
+                         'v_min': 'float64', 'v_max': 'float64'}).set_index(keys)
+
+def overview_metrics(backend, since_day):
+    """Headline numbers for the overview; the 'recent' ones count days from since_day on"""
+    totals = backend.aggregate([], [
+        ("students", "nunique", "student"), ("sessions", "size", None),
+        ("duration_sum", "sum", "duration"), ("duration_mean", "mean", "duration"),
+        ("score_mean", "mean", "score"), ("goal_sessions", "count", "goal_id"),
+    ]).iloc[0]
+    recent = backend.aggregate([], [("active_students", "nunique", "student"), ("sessions_this_week", "size", None)],
+                               filters=[("day_key", ">=", since_day)]).iloc[0]
+    stats = {**totals.to_dict(), **recent.to_dict()}
+    for name in ("students", "sessions", "goal_sessions", "active_students", "sessions_this_week"):
+        stats[name] = int(stats[name])
+    return stats
+
+def read_rollups(conn):
+    """The aggregator's summary tables as frames: students, daily and goals"""
+    return {
+        "students": pd.read_sql_query("SELECT * FROM student_summary", conn),
+        "daily": pd.read_sql_query("SELECT * FROM student_service_daily", conn),
+        "goals": pd.read_sql_query("SELECT * FROM goal_summary", conn),
+    }
+
+def rollup_overview_metrics(rollups, since_day):
+    """overview_metrics() from read_rollups() tables instead of a scan of services"""
+    students = rollups["students"]
+    daily = rollups["daily"]
+    recent = daily[daily['day_key'] >= since_day]
+    duration_n = students['duration_n'].sum()
+    score_n = students['score_n'].sum()
+    # Sessions with no student are keyed '': counted as sessions, not as a student
+    return {
+        "students": int((students['student'] != '').sum()),
+        "active_students": int(recent.loc[recent['student'] != '', 'student'].nunique()),
+        "sessions": int(students['sessions'].sum()),
+        "sessions_this_week": int(recent['sessions'].sum()),
+        "duration_sum": students['duration_sum'].sum(),
+        "duration_mean": students['duration_sum'].sum() / duration_n if duration_n else float('nan'),
+        "score_mean": students['score_sum'].sum() / score_n if score_n else float('nan'),
+        "goal_sessions": int(rollups["goals"]['sessions'].sum()),
+    }
+
+def goal_summary(backend):
+    """Average score, total duration and sessions per goal"""
+    return backend.aggregate(["goal_id"], [
+        ("avg_score", "mean", "score"), ("total_duration", "sum", "duration"), ("sessions", "count", "id"),
+    ])
+
+def activity_heatmap(backend):
+    """Session counts by day of week (Monday=0) and hour of day"""
+    return backend.aggregate(["dow", "hour"], [("count", "size", None)])
@@ -14,6 +14,14 @@ from datetime import datetime, timedelta
 import numpy as np
 from pathlib import Path
 
+from Services_Analytics import (
+    DB_FILE, SNAPSHOT_DIR, ChangeDetector, DataStore, DuckDBBackend, PandasBackend, PivotEngine,
+    activity_heatmap, count_matching, DETAIL_COLUMNS, EXPORT_FORMATS, downsample, duckdb_available,
+    enable_copy_on_write, export_formats, filter_frame, filter_options, frame_memory, goal_summary, histogram_bins,
+    iter_matching, local_day_key, lowess, overview_metrics, page_after, page_cursor,
+    pivot_export_frame, read_matching, read_rollups, rollup_overview_metrics, service_filter_sql, write_export
+)
+
 # Page configuration
 st.set_page_config(
     page_title="SPED Services Analytics",
@@ -26,79 +34,167 @@ st.set_page_config(
 @st.cache_resource
 def get_connection():
     """Create a cached database connection"""
-    return sqlite3.connect("aggregated_services.db", check_same_thread=False)
+    return sqlite3.connect(DB_FILE, check_same_thread=False)
 
-@st.cache_data(ttl=60)  # Cache for 1 minute
-def load_data():
-    """Load services data from database"""
-    conn = get_connection()
-    query = """
-    SELECT 
-        id,
-        timestamp,
-        student,
-        service,
-        duration,
-        event,
-        score,
-        goal_id,
-        device_id,
-        source_email,
-        schema_version,
-        imported_at
-    FROM services
-    ORDER BY timestamp DESC
+POLL_SECONDS = 5  # How often an open page checks for new imports
+
+@st.cache_resource
+def get_data_store():
+    """Base frames and derived results shared by all sessions (budget: DASHBOARD_CACHE_MB)"""
+    return DataStore()
+
+@st.cache_resource
+def get_change_detector():
+    """Per-table change counters shared by all sessions"""
+    return ChangeDetector()
+
+@st.cache_resource
+def get_pivot_engine():
+    """Pivot engine without its own memo; results are kept in the data store"""
+    return PivotEngine(max_entries=0)
+
+@st.cache_resource
+def get_duckdb_backend(source="sqlite"):
+    """DuckDB engine scanning the database (or snapshot) directly, shared by all sessions.
+
+    Returns the reason instead when it cannot start, e.g. offline without the
+    sqlite extension, so the failed attempt is not repeated on every rerun.
     """
-    df = pd.read_sql_query(query, conn)
-    
-    # Convert timestamp to datetime
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df['date'] = df['timestamp'].dt.date
-    df['week'] = df['timestamp'].dt.isocalendar().week
-    df['month'] = df['timestamp'].dt.strftime('%Y-%m')
-    df['weekday'] = df['timestamp'].dt.day_name()
-    
-    return df
+    try:
+        return DuckDBBackend(source)
+    except RuntimeError as e:
+        return str(e)
+
+def duckdb_backend(source="sqlite"):
+    """The shared DuckDB engine, or None after showing why it is unavailable"""
+    backend = get_duckdb_backend(source)
+    if isinstance(backend, str):
+        st.warning(f"DuckDB is unavailable, so pandas is used instead. {backend}")
+        return None
+    return backend
+
+def query_backend(df, source="sqlite", engine="pandas"):
+    """Backend that runs the shared aggregations: the loaded frame, or DuckDB over the source"""
+    backend = duckdb_backend(source) if engine == "duckdb" else None
+    return backend or PandasBackend(df)
+
+def snapshot_available():
+    """True when a Parquet snapshot of the aggregated database exists"""
+    return (SNAPSHOT_DIR / "_manifest.json").exists()
+
+def data_versions():
+    """Current change counters for the tables (and snapshot) the dashboard reads.
+
+    main() polls once per run and hands the result to everything it draws:
+    polling again mid-run could file results from the old frame under a newer
+    version, and every session would be served them until the next change.
+    """
+    versions = get_change_detector().poll(get_connection())
+    if snapshot_available():
+        versions["snapshot"] = (SNAPSHOT_DIR / "_manifest.json").stat().st_mtime_ns
+    return versions
+
+def frame_version(versions, source="sqlite"):
+    """Cache key for results derived from the frame load_data(versions, source) returns"""
+    key = "snapshot" if source == "snapshot" else "services"
+    return (key, versions.get(key))
+
+def load_data(versions, source="sqlite"):
+    """This session's view of the shared services frame, from the database or its Parquet snapshot"""
+    if source == "snapshot":
+        return get_data_store().view("snapshot", versions.get("snapshot"))
+    return get_data_store().view("sqlite", versions.get("services"), conn=get_connection())
+
+def cached(version, name, *args, compute):
+    """A result derived from the frame at version, shared across sessions via the data store"""
+    return get_data_store().get_or_compute((version, name) + args, compute)
+
+@st.cache_data(max_entries=2)
+def _load_rollups(services_version):
+    try:
+        return read_rollups(get_connection())
+    except Exception:
+        return None
+
+def load_rollups(versions):
+    """Load the aggregator's summary tables (None if the database predates them)"""
+    return _load_rollups(versions.get("services"))
+
+@st.cache_data(max_entries=2)
+def _load_import_runs(import_runs_version, limit):
+    conn = get_connection()
+    try:
+        return pd.read_sql_query(
+            "SELECT * FROM import_runs ORDER BY id DESC LIMIT ?", conn, params=(limit,)
+        )
+    except Exception:
+        return None
+
+def load_import_runs(versions, limit=200):
+    """Load recent aggregator import runs (None if the database predates run tracking)"""
+    return _load_import_runs(versions.get("import_runs"), limit)
 
-def create_overview_metrics(df):
+@st.fragment(run_every=POLL_SECONDS)
+def watch_for_changes():
+    """Rerun the page when the data has changed since this session last drew it"""
+    if data_versions() != st.session_state.get("shown_versions"):
+        st.rerun(scope="app")
+
+def overview_stats(backend, rollups=None, version=None):
+    """Headline numbers for the overview, from the summary tables when available"""
+    week_ago = local_day_key(datetime.now() - timedelta(days=7))
+    if rollups is None:
+        return cached(version, "overview", backend.name, week_ago,
+                      compute=lambda: overview_metrics(backend, week_ago))
+    return rollup_overview_metrics(rollups, week_ago)
+
+def create_overview_metrics(backend, rollups=None, version=None):
     """Create overview metric cards"""
+    stats = overview_stats(backend, rollups, version)
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        total_students = df['student'].nunique()
         st.metric(
             "Total Students",
-            total_students,
-            delta=f"Active this week: {df[df['timestamp'] > datetime.now() - timedelta(days=7)]['student'].nunique()}"
+            stats["students"],
+            delta=f"Active this week: {stats['active_students']}"
         )
     
     with col2:
-        total_sessions = len(df)
-        sessions_this_week = len(df[df['timestamp'] > datetime.now() - timedelta(days=7)])
         st.metric(
             "Total Sessions",
-            total_sessions,
-            delta=f"+{sessions_this_week} this week"
+            stats["sessions"],
+            delta=f"+{stats['sessions_this_week']} this week"
         )
     
     with col3:
-        total_hours = df['duration'].sum() / 60 if not df.empty else 0
+        total_hours = stats["duration_sum"] / 60 if stats["sessions"] else 0
         st.metric(
             "Total Hours",
             f"{total_hours:.1f}",
-            delta=f"Avg: {df['duration'].mean():.0f} min" if not df.empty else "0 min"
+            delta=f"Avg: {stats['duration_mean']:.0f} min" if stats["sessions"] else "0 min"
         )
     
     with col4:
-        avg_score = df['score'].mean() if not df.empty else 0
+        avg_score = stats["score_mean"] if stats["sessions"] else 0
         score_trend = "📈" if avg_score > 75 else "📊" if avg_score > 50 else "📉"
         st.metric(
             f"Average Score {score_trend}",
             f"{avg_score:.1f}%" if avg_score > 0 else "N/A",
-            delta=f"Goals tracked: {df['goal_id'].notna().sum()}"
+            delta=f"Goals tracked: {stats['goal_sessions']}"
         )
 
-def create_pivot_table(df):
+PIVOT_STYLE_MAX_CELLS = 20000  # Colour gradients render slowly beyond this
+
+
+def rollup_answers(rows, cols, values, agg_func, conn):
+    """Whether the student_service_daily rollup can answer this pivot"""
+    try:
+        return PivotEngine.plan(rows, cols, values, agg_func, conn=conn) == "rollup"
+    except ValueError:
+        return False
+
+def create_pivot_table(df, versions, source="sqlite", engine_name="pandas"):
     """Create interactive pivot table"""
     st.subheader("📊 Interactive Pivot Table")
     
@@ -144,43 +240,26 @@ def create_pivot_table(df):
     
     if rows:
         try:
-            # Handle the special "count" value
-            if values == "count":
-                pivot_values = "id"  # Use any column for counting
-                pivot_agg = "count"
-            else:
-                pivot_values = values
-                pivot_agg = agg_func
-            
-            # Create pivot table
-            if cols:
-                pivot = pd.pivot_table(
-                    df,
-                    values=pivot_values,
-                    index=rows,
-                    columns=cols,
-                    aggfunc=pivot_agg,
-                    fill_value=0,
-                    margins=True,
-                    margins_name="Total"
-                )
-            else:
-                pivot = pd.pivot_table(
-                    df,
-                    values=pivot_values,
-                    index=rows,
-                    aggfunc=pivot_agg,
-                    fill_value=0,
-                    margins=True,
-                    margins_name="Total"
-                )
+            engine = get_pivot_engine()
+            conn = get_connection() if source == "sqlite" else None
+            version = frame_version(versions, source)
+            backend = duckdb_backend(source) if engine_name == "duckdb" else None
+            method = backend.name if backend else "pandas"
+            if backend is None and conn is not None and rollup_answers(rows, cols, values, agg_func, conn):
+                method = "rollup"  # the summary table answers it without the loaded frame
+            frame = None if method == "rollup" else df
+            spec = (tuple(rows), tuple(cols), values, agg_func, method)
+            pivot = cached(version, "pivot", spec, compute=lambda: engine.pivot(
+                rows, cols, values, agg_func, version, conn=conn, frame=frame, backend=backend))
             
             # Format the pivot table
             if values in ["duration", "score"]:
                 pivot = pivot.round(1)
             
-            # Display with conditional formatting
-            if values == "score":
+            # Display with conditional formatting (skipped on very large tables)
+            if pivot.size > PIVOT_STYLE_MAX_CELLS:
+                styled_pivot = pivot
+            elif values == "score":
                 styled_pivot = pivot.style.background_gradient(cmap="RdYlGn", vmin=0, vmax=100)
             elif values == "duration":
                 styled_pivot = pivot.style.background_gradient(cmap="Blues")
@@ -189,13 +268,15 @@ def create_pivot_table(df):
             
             st.dataframe(styled_pivot, use_container_width=True)
             
-            # Download button
-            csv = pivot.to_csv()
-            st.download_button(
-                label="📥 Download Pivot Table as CSV",
-                data=csv,
-                file_name=f"pivot_table_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv"
+            # Download button (built on the download thread, so the store is bound here)
+            store = get_data_store()
+            export_button(
+                "📥 Download Pivot Table",
+                lambda fmt: store.get_or_compute(
+                    (version, "pivot_export", spec, fmt),
+                    lambda: write_export([pivot_export_frame(pivot)], fmt)),
+                "pivot_table",
+                key="pivot"
             )
             
         except Exception as e:
@@ -203,8 +284,28 @@ def create_pivot_table(df):
     else:
         st.info("Please select at least one row dimension to create a pivot table")
 
-def create_visualizations(df):
+def _service_frequency(df):
+    """Sessions per day and service, downsampled to a bounded number of points per line"""
+    by_day = df.groupby(['date', 'service'], observed=True).size().reset_index(name='count')
+    return downsample(by_day, 'date', 'count', by='service')
+
+def _score_trend(df, student):
+    """Daily mean scores (downsampled) and their LOWESS trendline for one student or all"""
+    scored = df[df['score'].notna()]
+    if student != "All Students":
+        scored = scored[scored['student'] == student]
+    daily = scored.groupby('date')['score'].mean().reset_index()
+    if daily.empty:
+        return daily, daily
+    trend_x, trend_y = lowess(daily['date'], daily['score'])
+    dates = trend_x.astype('int64').astype(daily['date'].to_numpy().dtype)
+    trend = pd.DataFrame({'date': dates, 'score': trend_y})
+    return downsample(daily, 'date', 'score'), trend
+
+def create_visualizations(df, versions, source="sqlite", engine="pandas"):
     """Create data visualizations"""
+    version = frame_version(versions, source)
+    backend = query_backend(df, source, engine)
     st.subheader("📈 Data Visualizations")
     
     tab1, tab2, tab3, tab4 = st.tabs(["Service Trends", "Student Progress", "Goal Tracking", "Time Analysis"])
@@ -214,7 +315,7 @@ def create_visualizations(df):
         col1, col2 = st.columns(2)
         
         with col1:
-            services_by_day = df.groupby(['date', 'service']).size().reset_index(name='count')
+            services_by_day = cached(version, "service_frequency", compute=lambda: _service_frequency(df))
             fig = px.line(
                 services_by_day,
                 x='date',
@@ -226,7 +327,7 @@ def create_visualizations(df):
             st.plotly_chart(fig, use_container_width=True)
         
         with col2:
-            service_duration = df.groupby('service')['duration'].sum().reset_index()
+            service_duration = df.groupby('service', observed=True)['duration'].sum().reset_index()
             fig = px.pie(
                 service_duration,
                 values='duration',
@@ -251,39 +352,41 @@ def create_visualizations(df):
         
         with col1:
             # Score trend over time
-            if not student_df[student_df['score'].notna()].empty:
-                score_trend = student_df[student_df['score'].notna()].groupby('date')['score'].mean().reset_index()
+            score_trend, trendline = cached(version, "score_trend", selected_student,
+                                            compute=lambda: _score_trend(df, selected_student))
+            if not score_trend.empty:
                 fig = px.scatter(
                     score_trend,
                     x='date',
                     y='score',
-                    title=f"Score Trend - {selected_student}",
-                    trendline="lowess"
+                    title=f"Score Trend - {selected_student}"
                 )
+                fig.add_trace(go.Scatter(x=trendline['date'], y=trendline['score'], mode='lines',
+                                         name='LOWESS trend', showlegend=False))
                 fig.add_hline(y=80, line_dash="dash", line_color="green", annotation_text="Target")
                 st.plotly_chart(fig, use_container_width=True)
             else:
                 st.info("No score data available for this selection")
         
         with col2:
-            # Session duration distribution
-            fig = px.histogram(
-                student_df,
-                x='duration',
-                nbins=20,
+            # Session duration distribution (binned here, so only the bars are sent)
+            bins = histogram_bins(student_df['duration'])
+            fig = px.bar(
+                bins,
+                x='center',
+                y='count',
                 title=f"Session Duration Distribution - {selected_student}",
-                labels={'duration': 'Duration (minutes)', 'count': 'Frequency'}
+                labels={'center': 'Duration (minutes)', 'count': 'Frequency'}
             )
+            fig.update_traces(width=(bins['end'] - bins['start']).tolist())
+            fig.update_layout(bargap=0)
             st.plotly_chart(fig, use_container_width=True)
     
     with tab3:
         # Goal achievement tracking
-        if not df[df['goal_id'].notna()].empty:
-            goal_data = df[df['goal_id'].notna()].groupby('goal_id').agg({
-                'score': 'mean',
-                'duration': 'sum',
-                'id': 'count'
-            }).reset_index()
+        goal_data = cached(version, "goal_summary", backend.name, compute=lambda: goal_summary(backend))
+        if not goal_data.empty:
+            goal_data = goal_data.copy()
             goal_data.columns = ['Goal ID', 'Avg Score', 'Total Duration', 'Sessions']
             
             fig = px.bar(
@@ -315,11 +418,8 @@ def create_visualizations(df):
         
         with col1:
             # Heatmap of services by day and hour
-            df['hour'] = pd.to_datetime(df['timestamp']).dt.hour
-            df['day_of_week'] = pd.to_datetime(df['timestamp']).dt.dayofweek
-            
-            heatmap_data = df.groupby(['day_of_week', 'hour']).size().reset_index(name='count')
-            heatmap_pivot = heatmap_data.pivot(index='hour', columns='day_of_week', values='count').fillna(0)
+            heatmap_data = cached(version, "activity_heatmap", backend.name, compute=lambda: activity_heatmap(backend))
+            heatmap_pivot = heatmap_data.pivot(index='hour', columns='dow', values='count').fillna(0)
             
             days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
             heatmap_pivot.columns = [days[i] if i < len(days) else str(i) for i in heatmap_pivot.columns]
@@ -335,7 +435,7 @@ def create_visualizations(df):
         
         with col2:
             # Weekly summary
-            weekly_summary = df.groupby('week').agg({
+            weekly_summary = df.groupby('week', observed=True).agg({
                 'student': 'nunique',
                 'duration': 'sum',
                 'score': 'mean'
@@ -348,16 +448,119 @@ def create_visualizations(df):
             
             fig.update_layout(
                 title="Weekly Summary",
-                xaxis_title="Week Number",
+                xaxis_title="Week",
                 yaxis=dict(title="Number of Students", side="left"),
                 yaxis2=dict(title="Average Score (%)", overlaying="y", side="right"),
                 hovermode='x unified'
             )
             st.plotly_chart(fig, use_container_width=True)
 
-def create_detailed_view(df):
+def _read_export_chunks(where, params):
+    """Matching rows in chunks over a private connection (downloads run on their own thread)"""
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        yield from iter_matching(conn, where, params, chunk_rows=EXPORT_CHUNK_ROWS)
+    finally:
+        conn.close()
+
+def export_button(label, build, file_stem, key):
+    """Format picker and a download button that only builds the file when clicked.
+
+    build(fmt) returns the file's bytes. Streamlit calls it on its own thread
+    when the button is pressed, so ordinary reruns never serialise anything.
+    """
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        fmt = st.selectbox("Download format", export_formats(), key=f"{key}_format",
+                           label_visibility="collapsed")
+    extension, mime = EXPORT_FORMATS[fmt]
+    with col2:
+        st.download_button(
+            label=label,
+            data=lambda: build(fmt),
+            file_name=f"{file_stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+            mime=mime,
+            key=f"{key}_download",
+            on_click="ignore"
+        )
+
+PAGE_SIZES = [25, 50, 100, 250, 500]
+EXPORT_CHUNK_ROWS = 50_000
+
+def _first_page(key):
+    st.session_state[f"{key}_cursors"] = [None]
+
+def _next_page(key, cursor):
+    st.session_state[f"{key}_cursors"].append(cursor)
+
+def _previous_page(key):
+    st.session_state[f"{key}_cursors"].pop()
+
+def paginated_table(fetch_page, matched, total, key, reset_on=()):
+    """Keyset-paginated table that only fetches and formats the visible page.
+
+    fetch_page(limit, after) returns up to limit rows newest first, starting
+    after the (ts_epoch, id) cursor. The visited cursors live in session state
+    and reset when reset_on (the filters) or the page size changes.
+    """
+    page_size = st.selectbox("Rows per page", PAGE_SIZES, index=PAGE_SIZES.index(100), key=f"{key}_page_size")
+    if st.session_state.get(f"{key}_reset_on") != (reset_on, page_size):
+        st.session_state[f"{key}_reset_on"] = (reset_on, page_size)
+        _first_page(key)
+    cursors = st.session_state[f"{key}_cursors"]
+    page_df = fetch_page(page_size, cursors[-1])
+    offset = (len(cursors) - 1) * page_size
+    pages = max(1, -(-matched // page_size))
+    
+    st.write(f"Showing {offset + 1 if len(page_df) else 0}-{offset + len(page_df)} of {matched} matching "
+             f"({total} records in total) · page {len(cursors)} of {pages}")
+    
+    # Formatting is left to the grid, so only the page's raw values are sent
+    display_df = page_df[['timestamp', 'student', 'service', 'duration', 'event', 'score', 'goal_id', 'device_id']]
+    st.dataframe(
+        display_df,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            'timestamp': st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm"),
+            'duration': st.column_config.NumberColumn(format="%.0f min"),
+            'score': st.column_config.NumberColumn(format="%.1f%%"),
+        }
+    )
+    
+    col1, col2, col3 = st.columns([1, 1, 6])
+    with col1:
+        st.button("◀ Previous", key=f"{key}_previous", disabled=len(cursors) == 1,
+                  on_click=_previous_page, args=(key,))
+    with col2:
+        has_next = offset + len(page_df) < matched and len(page_df) == page_size
+        st.button("Next ▶", key=f"{key}_next", disabled=not has_next,
+                  on_click=_next_page, args=(key, page_cursor(page_df) if has_next else None))
+    with col3:
+        st.button("⏮ First page", key=f"{key}_first", disabled=len(cursors) == 1,
+                  on_click=_first_page, args=(key,))
+
+@st.cache_data(max_entries=4)
+def _load_filter_options(services_version):
+    return filter_options(get_connection())
+
+@st.cache_data(max_entries=32)
+def _count_matching(where, params, services_version):
+    return count_matching(get_connection(), where, params)
+
+def create_detailed_view(df, versions, source="sqlite"):
     """Create detailed data view with filters"""
     st.subheader("🔍 Detailed Data View")
+    services_version = versions.get("services")
+    if source == "snapshot":
+        options = {
+            "students": sorted(df['student'].dropna().unique()),
+            "services": sorted(df['service'].dropna().unique()),
+            "first_date": df['date'].min().date(),
+            "last_date": df['date'].max().date(),
+        }
+    else:
+        options = _load_filter_options(services_version)
     
     # Filters
     col1, col2, col3, col4 = st.columns(4)
@@ -365,23 +568,23 @@ def create_detailed_view(df):
     with col1:
         students = st.multiselect(
             "Filter by Student:",
-            df['student'].unique(),
+            options["students"],
             default=None
         )
     
     with col2:
         services = st.multiselect(
             "Filter by Service:",
-            df['service'].unique(),
+            options["services"],
             default=None
         )
     
     with col3:
         date_range = st.date_input(
             "Date Range:",
-            value=(df['date'].min(), df['date'].max()),
-            min_value=df['date'].min(),
-            max_value=df['date'].max()
+            value=(options["first_date"], options["last_date"]),
+            min_value=options["first_date"],
+            max_value=options["last_date"]
         )
     
     with col4:
@@ -392,57 +595,161 @@ def create_detailed_view(df):
             value=0
         )
     
-    # Apply filters
-    filtered_df = df.copy()
+    day_range = date_range if len(date_range) == 2 else None
     
-    if students:
-        filtered_df = filtered_df[filtered_df['student'].isin(students)]
-    
-    if services:
-        filtered_df = filtered_df[filtered_df['service'].isin(services)]
-    
-    if len(date_range) == 2:
-        filtered_df = filtered_df[
-            (filtered_df['date'] >= date_range[0]) &
-            (filtered_df['date'] <= date_range[1])
-        ]
-    
-    if min_score > 0:
-        filtered_df = filtered_df[filtered_df['score'] >= min_score]
+    # Filters run in SQLite against its indexes; only the shown page is fetched
+    version = frame_version(versions, source)
+    filters = (source, tuple(students), tuple(services), tuple(day_range or ()), min_score)
+    if source == "snapshot":
+        filtered_df = cached(version, "filtered", filters,
+                             compute=lambda: filter_frame(df, students, services, day_range, min_score))
+        total, matched = len(df), len(filtered_df)
+        fetch_page = lambda limit, after: page_after(filtered_df, limit, after)
+    else:
+        conn = get_connection()
+        where, params = service_filter_sql(students, services, day_range, min_score)
+        total = _count_matching("", (), services_version)
+        matched = _count_matching(where, tuple(params), services_version)
+        fetch_page = lambda limit, after: read_matching(conn, where, params, limit=limit, after=after)
+    paginated_table(fetch_page, matched, total, key="detail", reset_on=filters)
+    
+    # Export filtered data, read in chunks separately from the page on screen
+    if matched:
+        if source == "snapshot":
+            chunks = lambda: (filtered_df.iloc[start:start + EXPORT_CHUNK_ROWS][DETAIL_COLUMNS + ['timestamp']]
+                              for start in range(0, matched, EXPORT_CHUNK_ROWS))
+        else:
+            chunks = lambda: _read_export_chunks(where, params)
+        store = get_data_store()
+        export_button(
+            "📥 Download Filtered Data",
+            lambda fmt: store.get_or_compute((version, "filtered_export", filters, fmt),
+                                             lambda: write_export(chunks(), fmt)),
+            "filtered_data",
+            key="detail"
+        )
+
+def create_import_history(versions):
+    """Show aggregator import runs and their ingestion performance"""
+    st.subheader("📥 Import History")
+    runs = load_import_runs(versions)
+    if runs is None or runs.empty:
+        st.info("No import runs recorded yet. Runs appear here after the next Fetch & Aggregate.")
+        return
+
+    finished = runs[runs['status'] != 'running'].sort_values('id')
+    col1, col2 = st.columns(2)
     
-    # Display filtered data
-    st.write(f"Showing {len(filtered_df)} of {len(df)} records")
+    with col1:
+        fig = px.line(
+            finished,
+            x='id',
+            y='rows_per_s',
+            markers=True,
+            title="Import Throughput (rows/s)",
+            labels={'id': 'Run', 'rows_per_s': 'Rows per second'}
+        )
+        st.plotly_chart(fig, use_container_width=True)
     
-    # Format display
-    display_df = filtered_df[['timestamp', 'student', 'service', 'duration', 'event', 'score', 'goal_id', 'device_id']].copy()
-    display_df['timestamp'] = display_df['timestamp'].dt.strftime('%Y-%m-%d %H:%M')
+    with col2:
+        stage_cols = ['connect_s', 'search_s', 'download_s', 'parse_s', 'decrypt_s', 'insert_s']
+        stages = finished.melt(id_vars='id', value_vars=stage_cols, var_name='stage', value_name='seconds')
+        stages['stage'] = stages['stage'].str.replace('_s', '', regex=False)
+        fig = px.bar(
+            stages,
+            x='id',
+            y='seconds',
+            color='stage',
+            title="Time per Stage",
+            labels={'id': 'Run', 'seconds': 'Seconds'}
+        )
+        st.plotly_chart(fig, use_container_width=True)
     
     st.dataframe(
-        display_df.style.format({
-            'duration': '{:.0f} min',
-            'score': '{:.1f}%'
+        runs.style.format({
+            'bytes_per_s': lambda v: f"{v / 1024:.1f} KB/s" if pd.notna(v) else '-',
+            'rows_per_s': '{:.0f}',
+            **{c: '{:.2f}' for c in ['connect_s', 'search_s', 'download_s', 'parse_s', 'decrypt_s', 'insert_s', 'total_s']}
         }, na_rep='-'),
         use_container_width=True
     )
+
+def create_cache_admin():
+    """Shared data store statistics: memory, hit rate, evictions and cached entries"""
+    st.subheader("🗄️ Cache Statistics")
+    store = get_data_store()
+    stats = store.stats()
+    frames = store.frame_bytes()
     
-    # Export filtered data
-    if not filtered_df.empty:
-        csv = filtered_df.to_csv(index=False)
-        st.download_button(
-            label="📥 Download Filtered Data as CSV",
-            data=csv,
-            file_name=f"filtered_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Cache Used", f"{stats['used_bytes'] / 2**20:.1f} MB",
+                  delta=f"of {stats['budget_bytes'] / 2**20:.0f} MB budget", delta_color="off")
+    with col2:
+        st.metric("Hit Rate", f"{stats['hit_rate']:.0%}",
+                  delta=f"{stats['hits']} hits / {stats['misses']} misses", delta_color="off")
+    with col3:
+        st.metric("Evictions", stats['evictions'],
+                  delta=f"{stats['oversize']} too large to cache", delta_color="off")
+    with col4:
+        st.metric("Base Frames", f"{sum(frames.values()) / 2**20:.1f} MB",
+                  delta=f"{stats['full_loads']} full / {stats['incremental_loads']} incremental loads",
+                  delta_color="off")
+    st.caption("The budget is set with the DASHBOARD_CACHE_MB environment variable. "
+               "Base frames are shared by every session and not counted against it.")
+    
+    entries = pd.DataFrame(store.entries())
+    if entries.empty:
+        st.info("No derived results cached yet")
+    else:
+        entries['key'] = entries['key'].map(str)
+        entries['KB'] = entries.pop('bytes') / 1024
+        st.dataframe(
+            entries.iloc[::-1],
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                'key': "Cached result (most recently used first)",
+                'KB': st.column_config.NumberColumn(format="%.1f"),
+                'age_s': st.column_config.NumberColumn("Age (s)", format="%.0f"),
+            }
         )
+    if st.button("🧹 Clear Cached Results"):
+        store.clear()
+        st.rerun()
 
 def main():
     """Main dashboard application"""
+    # Sessions share DataStore frames through views; see enable_copy_on_write
+    enable_copy_on_write()
     st.title("📊 SPED Services Analytics Dashboard")
     st.markdown("---")
     
     # Load data
     try:
-        df = load_data()
+        # The one poll this run: everything below is drawn and cached against these versions
+        versions = data_versions()
+        st.session_state["shown_versions"] = versions
+        source = "sqlite"
+        if snapshot_available():
+            with st.sidebar:
+                source = st.radio(
+                    "Data Source:",
+                    ["sqlite", "snapshot"],
+                    format_func=lambda x: {"sqlite": "Live database", "snapshot": "Parquet snapshot"}[x],
+                    horizontal=True
+                )
+        engine = "pandas"
+        if duckdb_available():
+            with st.sidebar:
+                engine = st.radio(
+                    "Query Engine:",
+                    ["pandas", "duckdb"],
+                    format_func=lambda x: {"pandas": "pandas (in memory)", "duckdb": "DuckDB"}[x],
+                    horizontal=True,
+                    help="DuckDB aggregates straight from the source instead of the loaded frame"
+                )
+        df = load_data(versions, source)
         
         if df.empty:
             st.warning("No data found in database. Please run the Services Aggregator to import data first.")
@@ -453,30 +760,35 @@ def main():
         with st.sidebar:
             st.header("Dashboard Controls")
             
-            # Refresh button
+            # New imports are picked up automatically; the button forces a check now
             if st.button("🔄 Refresh Data"):
-                st.cache_data.clear()
+                get_change_detector().invalidate()
                 st.rerun()
+            watch_for_changes()
             
             st.markdown("---")
             
             # Data summary
             st.subheader("Data Summary")
             st.metric("Total Records", len(df))
-            st.metric("Date Range", f"{df['date'].min()} to {df['date'].max()}")
+            st.metric("Date Range", f"{df['date'].min():%Y-%m-%d} to {df['date'].max():%Y-%m-%d}")
             st.metric("Data Sources", df['device_id'].nunique())
+            memory = frame_memory(df)
+            st.caption(f"In memory: {memory['bytes'] / 2**20:.1f} MB ({memory['bytes_per_row']:.0f} bytes/row)")
             
             st.markdown("---")
             
             # View selection
             view_mode = st.radio(
                 "Select View:",
-                ["Overview", "Pivot Tables", "Visualizations", "Detailed Data"]
+                ["Overview", "Pivot Tables", "Visualizations", "Detailed Data", "Import History", "Cache Statistics"]
             )
         
         # Main content based on view selection
         if view_mode == "Overview":
-            create_overview_metrics(df)
+            # The live database's summary tables answer the overview unless DuckDB or the snapshot was chosen
+            rollups = load_rollups(versions) if engine == "pandas" and source == "sqlite" else None
+            create_overview_metrics(query_backend(df, source, engine), rollups, frame_version(versions, source))
             st.markdown("---")
             
             # Quick insights
@@ -484,22 +796,36 @@ def main():
             
             with col1:
                 st.subheader("📌 Top Students by Sessions")
-                top_students = df['student'].value_counts().head(10)
+                if rollups is not None:
+                    named = rollups["students"][rollups["students"]['student'] != '']
+                    top_students = named.set_index('student')['sessions'].nlargest(10)
+                else:
+                    top_students = df['student'].value_counts().head(10)
                 st.bar_chart(top_students)
             
             with col2:
                 st.subheader("📌 Service Distribution")
-                service_counts = df['service'].value_counts()
+                if rollups is not None:
+                    named = rollups["daily"][rollups["daily"]['service'] != '']
+                    service_counts = named.groupby('service')['sessions'].sum().sort_values(ascending=False)
+                else:
+                    service_counts = df['service'].value_counts()
                 st.bar_chart(service_counts)
         
         elif view_mode == "Pivot Tables":
-            create_pivot_table(df)
+            create_pivot_table(df, versions, source, engine)
         
         elif view_mode == "Visualizations":
-            create_visualizations(df)
+            create_visualizations(df, versions, source, engine)
         
         elif view_mode == "Detailed Data":
-            create_detailed_view(df)
+            create_detailed_view(df, versions, source)
+        
+        elif view_mode == "Import History":
+            create_import_history(versions)
+        
+        elif view_mode == "Cache Statistics":
+            create_cache_admin()
         
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
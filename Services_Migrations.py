@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+SPED Services Migrations - versioned schema upgrades for the tracker and aggregator databases.
+
+Each database stores the number of the last migration applied in PRAGMA
+user_version. A migration is an ordered list of idempotent steps; migrate()
+runs those newer than the stored version and bumps user_version after each
+one, so a database already in the field picks up new columns and indexes the
+next time an app opens it. Backfills walk the table in rowid batches and
+commit between batches, so other writers are only ever held up for one batch.
+
+    python Services_Migrations.py aggregated_services.db [--app aggregator] [--dry-run] [--batch-size 20000]
+
+--dry-run changes nothing: it lists the pending steps with the rows each would
+touch and a time estimate from a sample run inside a rolled-back transaction.
+"""
+
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+from Services_Tracing import span
+
+BATCH_SIZE = 20_000     # Rows updated per backfill transaction
+SAMPLE_ROWS = 5_000     # Rows timed (then rolled back) for dry-run estimates
+
+# ------------------ Steps ---------------------
+@contextmanager
+def _rolled_back(conn, name="migration_sample"):
+    """Run a block inside a savepoint that is always undone."""
+    conn.execute(f"SAVEPOINT {name}")
+    try:
+        yield
+    finally:
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+
+class Step:
+    """One idempotent schema change. Subclasses say what they touch and how to apply it.
+
+    Structural steps (new tables and columns) are cheap and are also applied
+    during a dry run, inside a rolled-back savepoint, so later steps can be sized.
+    """
+    structural = False
+
+    def describe(self):
+        return type(self).__name__
+
+    def pending(self, conn):
+        """Rows the step would still touch (0 when already applied)."""
+        return 0
+
+    def estimate(self, conn, rows):
+        """Seconds the step is expected to take for rows pending rows (None if unknown)."""
+        return 0.0
+
+    def apply(self, conn, batch_size=BATCH_SIZE, pause=0.0):
+        """Make the change (migrate() commits it); return the rows touched."""
+        raise NotImplementedError
+
+class SQL(Step):
+    """Statements that are already idempotent (CREATE ... IF NOT EXISTS)."""
+    structural = True
+
+    def __init__(self, description, *statements):
+        self.description = description
+        self.statements = statements
+
+    def describe(self):
+        return self.description
+
+    def apply(self, conn, batch_size=BATCH_SIZE, pause=0.0):
+        for statement in self.statements:
+            conn.execute(statement)
+        return 0
+
+class Call(Step):
+    """Run fn(conn) for changes that are easier to express in Python; rows(conn) sizes the work."""
+
+    def __init__(self, description, fn, rows=None):
+        self.description = description
+        self.fn = fn
+        self.rows = rows
+
+    def describe(self):
+        return self.description
+
+    def pending(self, conn):
+        return self.rows(conn) if self.rows else 0
+
+    def estimate(self, conn, rows):
+        # fn may commit, so it cannot be sampled inside a rolled-back savepoint
+        return None if rows else 0.0
+
+    def apply(self, conn, batch_size=BATCH_SIZE, pause=0.0):
+        rows = self.pending(conn)
+        self.fn(conn)
+        return rows
+
+class BatchedCall(Call):
+    """Call for work that commits in batches itself: fn(conn, batch_size=, pause=) gets the run's settings."""
+
+    def apply(self, conn, batch_size=BATCH_SIZE, pause=0.0):
+        rows = self.pending(conn)
+        self.fn(conn, batch_size=batch_size, pause=pause)
+        return rows
+
+class AddColumns(Step):
+    """ALTER TABLE ADD COLUMN for each {name: declaration} the table lacks (constant time in SQLite)."""
+    structural = True
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+
+    def describe(self):
+        return f"add {self.table}.{', '.join(self.columns)}"
+
+    def missing(self, conn):
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({self.table})")}
+        return [name for name in self.columns if name not in existing]
+
+    def apply(self, conn, batch_size=BATCH_SIZE, pause=0.0):
+        for name in self.missing(conn):
+            conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {name} {self.columns[name]}")
+        return 0
+
+class CreateIndex(Step):
+    """CREATE INDEX IF NOT EXISTS, optionally partial. SQLite builds it in one write transaction."""
+
+    def __init__(self, name, table, columns, where=None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.where = where
+
+    def describe(self):
+        return f"index {self.name}"
+
+    def _sql(self, name, table):
+        where = f" WHERE {self.where}" if self.where else ""
+        return f"CREATE INDEX IF NOT EXISTS {name} ON {table}({self.columns}){where}"
+
+    def pending(self, conn):
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (self.name,)).fetchone():
+            return 0
+        return conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def estimate(self, conn, rows):
+        if not rows:
+            return 0.0
+        # Build the same index over a temp copy of a sample, then throw both away
+        with _rolled_back(conn):
+            conn.execute(f"CREATE TEMP TABLE _migration_sample AS SELECT * FROM {self.table} LIMIT {SAMPLE_ROWS}")
+            sampled = conn.execute("SELECT COUNT(*) FROM _migration_sample").fetchone()[0]
+            start = time.perf_counter()
+            conn.execute(self._sql("temp._migration_sample_idx", "_migration_sample"))
+            seconds = time.perf_counter() - start
+        return seconds * rows / max(sampled, 1)
+
+    def apply(self, conn, batch_size=BATCH_SIZE, pause=0.0):
+        rows = self.pending(conn)
+        conn.execute(self._sql(self.name, self.table))
+        return rows
+
+class Backfill(Step):
+    """UPDATE table SET {column: expression} WHERE where, in rowid batches with a commit after each.
+
+    Rows added after the backfill starts are left alone. where must select only
+    rows still needing the update, so an interrupted backfill (or rows written
+    meanwhile by older code) is picked up on the next run.
+    """
+
+    def __init__(self, table, assignments, where):
+        self.table = table
+        self.assignments = assignments
+        self.where = where
+
+    def describe(self):
+        return f"backfill {self.table}.{', '.join(self.assignments)}"
+
+    def _update_sql(self):
+        sets = ", ".join(f"{column} = {expr}" for column, expr in self.assignments.items())
+        return f"UPDATE {self.table} SET {sets} WHERE rowid > ? AND rowid <= ? AND ({self.where})"
+
+    def pending(self, conn):
+        return conn.execute(f"SELECT COUNT(*) FROM {self.table} WHERE {self.where}").fetchone()[0]
+
+    def estimate(self, conn, rows):
+        if not rows:
+            return 0.0
+        with _rolled_back(conn):
+            bounds = conn.execute(f'''
+                SELECT MIN(rowid), MAX(rowid) FROM (
+                    SELECT rowid FROM {self.table} WHERE {self.where} ORDER BY rowid LIMIT {SAMPLE_ROWS})
+            ''').fetchone()
+            start = time.perf_counter()
+            sampled = conn.execute(self._update_sql(), (bounds[0] - 1, bounds[1])).rowcount
+            seconds = time.perf_counter() - start
+        return seconds * rows / max(sampled, 1)
+
+    def apply(self, conn, batch_size=BATCH_SIZE, pause=0.0):
+        conn.commit()
+        update = self._update_sql()
+        # Stop at the rows present now: with a busy writer appending, chasing the end never finishes
+        end = conn.execute(f"SELECT MAX(rowid) FROM {self.table}").fetchone()[0]
+        touched, last = 0, -1
+        while end is not None and last < end:
+            high = conn.execute(f'''
+                SELECT MAX(rowid) FROM (SELECT rowid FROM {self.table} WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?)
+            ''', (last, end, batch_size)).fetchone()[0]
+            if high is None:
+                break
+            touched += conn.execute(update, (last, high)).rowcount
+            conn.commit()
+            last = high
+            if pause:
+                time.sleep(pause)
+        return touched
+
+class Migration:
+    """Schema version number, a short description and the steps that reach it."""
+
+    def __init__(self, version, description, steps):
+        self.version = version
+        self.description = description
+        self.steps = steps
+
+# ------------------ Runner ---------------------
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def pending_migrations(conn, migrations):
+    """Migrations newer than the database's user_version, in version order."""
+    versions = [m.version for m in migrations]
+    if versions != sorted(set(versions)):
+        raise ValueError(f"Migration versions must be unique and ascending: {versions}")
+    current = schema_version(conn)
+    return [m for m in migrations if m.version > current]
+
+def migrate(conn, migrations, dry_run=False, batch_size=BATCH_SIZE, pause=0.0, log=None):
+    """Apply pending migrations (or with dry_run, estimate them); return one result dict per step.
+
+    Results hold version, migration, step, rows and seconds (measured, or
+    estimated when dry_run and None if the step cannot be sampled). log, if
+    given, is called with each result as it completes. pause sleeps between
+    steps and backfill batches to leave room for other writers.
+    """
+    migrations = pending_migrations(conn, migrations)
+    if dry_run:
+        conn.commit()
+        with _rolled_back(conn, "migration_dry_run"):
+            return _run_steps(conn, migrations, True, batch_size, pause, log)
+    return _run_steps(conn, migrations, False, batch_size, pause, log)
+
+def _run_steps(conn, migrations, dry_run, batch_size, pause, log):
+    results = []
+    for migration in migrations:
+        for step in migration.steps:
+            if dry_run:
+                rows = step.pending(conn)
+                seconds = step.estimate(conn, rows)
+                if step.structural:
+                    step.apply(conn)
+            else:
+                with span("migrate.step", version=migration.version, step=step.describe()):
+                    start = time.perf_counter()
+                    rows = step.apply(conn, batch_size, pause)
+                    conn.commit()
+                    seconds = time.perf_counter() - start
+                if pause:
+                    time.sleep(pause)
+            result = {"version": migration.version, "migration": migration.description,
+                      "step": step.describe(), "rows": rows, "seconds": seconds}
+            results.append(result)
+            if log:
+                log(result)
+        if not dry_run:
+            conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+            conn.commit()
+    return results
+
+def results_text(results):
+    """Fixed-width table of migrate() output; "?" marks steps with no estimate."""
+    if not results:
+        return "Schema is up to date."
+    lines = [f"{'ver':>4}  {'step':<40}{'rows':>12}{'seconds':>10}"]
+    for r in results:
+        seconds = "?" if r["seconds"] is None else f"{r['seconds']:.2f}"
+        lines.append(f"{r['version']:>4}  {r['step'][:39]:<40}{r['rows']:>12,}{seconds:>10}")
+    known = [r["seconds"] for r in results if r["seconds"] is not None]
+    unknown = " +?" if len(known) < len(results) else ""
+    lines.append(f"{'':>4}  {'total':<40}{'':>12}{sum(known):>10.2f}{unknown}")
+    return "\n".join(lines)
+
+# App name -> (module, attribute) holding its migration list; imported only when the CLI needs it
+APP_MIGRATIONS = {
+    "tracker": ("Services_Tracker", "TRACKER_MIGRATIONS"),
+    "aggregator": ("Services_Aggregator", "AGGREGATOR_MIGRATIONS"),
+}
+
+def main(argv=None):
+    import argparse
+    import importlib
+    parser = argparse.ArgumentParser(description="Upgrade a tracker or aggregator database to the latest schema")
+    parser.add_argument("db", help="Database file")
+    parser.add_argument("--app", choices=sorted(APP_MIGRATIONS), default="aggregator",
+                        help="Which app's schema the database holds (default aggregator)")
+    parser.add_argument("--dry-run", action="store_true", help="Report pending steps and estimated cost only")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per backfill transaction")
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="Seconds to sleep between steps and backfill batches (0.1+ lets other writers in)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"No such database: {args.db}")
+        return 1
+    module, attribute = APP_MIGRATIONS[args.app]
+    migrations = getattr(importlib.import_module(module), attribute)
+    conn = sqlite3.connect(args.db)
+    try:
+        current, latest = schema_version(conn), migrations[-1].version
+        print(f"{args.db}: schema version {current}, latest {latest}"
+              + (" (dry run, times are estimates)" if args.dry_run else ""))
+        results = migrate(conn, migrations, args.dry_run, args.batch_size, args.pause)
+    finally:
+        conn.close()
+    print(results_text(results))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+SPED Services Reports - sealed (compressed and encrypted) report attachments.
+
+When the tracker has a PIN, it sends the report CSV sealed: gzip-compressed,
+then cut into chunks that are each encrypted with AES-256-GCM.
+
+    header  "SPEDRPT" + format version (8) | compression (1) | key id (8) | nonce prefix (7) | chunk size (4)
+    chunks  chunk-size plaintext bytes + 16-byte tag each; the last is shorter (possibly empty)
+
+A chunk's nonce is the file's random prefix, the chunk number and a last-chunk
+flag, and every chunk authenticates the header, so a reordered, truncated or
+edited report fails to open instead of importing partially. The key is
+derived once from the PIN the tracker and aggregator already share; the key
+id lets the aggregator report "different PIN" before trying to decrypt.
+"""
+
+import gzip
+import hashlib
+import io
+import os
+import struct
+from contextlib import contextmanager
+from functools import lru_cache
+
+MAGIC = b"SPEDRPT\x01"
+SEALED_SUFFIX = ".csv.sped"
+COMPRESSION_GZIP = 1
+CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+HEADER = struct.Struct(">8sB8s7sI")
+
+class ReportError(ValueError):
+    """A sealed report that cannot be opened: wrong PIN, unknown format, damaged or truncated."""
+
+@lru_cache(maxsize=8)
+def report_key(pin):
+    """AES-256 key for sealed reports, derived from the PIN with PBKDF2 once per PIN."""
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=b"sped_report_salt_v1", iterations=100000)
+    return kdf.derive(pin.encode("utf-8"))
+
+def key_id(key):
+    """Short public fingerprint of a report key."""
+    return hashlib.sha256(b"sped report key id" + key).digest()[:8]
+
+def _nonce(prefix, counter, last):
+    return prefix + struct.pack(">IB", counter, 1 if last else 0)
+
+class _SealingWriter(io.RawIOBase):
+    """Write-only stream that encrypts its input chunk by chunk onto raw."""
+
+    def __init__(self, raw, key, chunk_size=CHUNK_SIZE):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        self.raw = raw
+        self.aead = AESGCM(key)
+        self.prefix = os.urandom(7)
+        self.header = HEADER.pack(MAGIC, COMPRESSION_GZIP, key_id(key), self.prefix, chunk_size)
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.counter = 0
+        raw.write(self.header)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        # Hold back a full chunk until more arrives: only close() knows which chunk is last
+        while len(self.buffer) > self.chunk_size:
+            self._seal(bytes(self.buffer[:self.chunk_size]), last=False)
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def _seal(self, chunk, last):
+        self.raw.write(self.aead.encrypt(_nonce(self.prefix, self.counter, last), chunk, self.header))
+        self.counter += 1
+
+    def close(self):
+        if not self.closed:
+            self._seal(bytes(self.buffer), last=True)
+            self.buffer.clear()
+        super().close()
+
+class _OpeningReader(io.RawIOBase):
+    """Read-only stream of the decrypted chunks of a sealed report on raw."""
+
+    def __init__(self, raw, key):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        self.header = raw.read(HEADER.size)
+        if len(self.header) < HEADER.size or not self.header.startswith(MAGIC[:7]):
+            raise ReportError("Not a sealed report")
+        magic, compression, report_key_id, self.prefix, self.chunk_size = HEADER.unpack(self.header)
+        if magic != MAGIC:
+            raise ReportError(f"Unsupported sealed report version {magic[7]}")
+        if compression != COMPRESSION_GZIP:
+            raise ReportError(f"Unsupported sealed report compression {compression}")
+        if report_key_id != key_id(key):
+            raise ReportError("Report was sealed with a different PIN")
+        self.raw = raw
+        self.aead = AESGCM(key)
+        self.counter = 0
+        self.plain, self.offset = b"", 0
+        # One chunk of look-ahead tells us when we are decrypting the last one
+        self.next_chunk = raw.read(self.chunk_size + TAG_SIZE)
+        self.done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.offset >= len(self.plain) and not self.done:
+            self._open_next()
+        n = min(len(b), len(self.plain) - self.offset)
+        b[:n] = self.plain[self.offset:self.offset + n]
+        self.offset += n
+        return n
+
+    def _open_next(self):
+        from cryptography.exceptions import InvalidTag
+
+        chunk, self.next_chunk = self.next_chunk, self.raw.read(self.chunk_size + TAG_SIZE)
+        last = not self.next_chunk
+        try:
+            self.plain = self.aead.decrypt(_nonce(self.prefix, self.counter, last), chunk, self.header)
+        except InvalidTag:
+            raise ReportError("Sealed report is damaged or truncated") from None
+        self.offset = 0
+        self.counter += 1
+        self.done = last
+
+def is_sealed_report(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC) - 1) == MAGIC[:-1]
+
+@contextmanager
+def sealed_report_writer(path, pin):
+    """Text stream (for csv.writer) that lands in path as a sealed report."""
+    with open(path, "wb") as raw:
+        sealer = _SealingWriter(raw, report_key(pin))
+        text = io.TextIOWrapper(gzip.GzipFile(fileobj=sealer, mode="wb", mtime=0), encoding="utf-8", newline="")
+        try:
+            yield text
+        finally:
+            text.close()
+            sealer.close()
+
+@contextmanager
+def open_sealed_report(path, pin):
+    """Text stream (for csv.reader) of a sealed report, decrypted and decompressed as it is read.
+
+    Raises ReportError for a different PIN, an unknown format or a damaged file.
+    """
+    with open(path, "rb") as raw:
+        opener = _OpeningReader(raw, report_key(pin))
+        text = io.TextIOWrapper(gzip.GzipFile(fileobj=io.BufferedReader(opener, CHUNK_SIZE), mode="rb"),
+                                encoding="utf-8", newline="")
+        try:
+            yield text
+        except (EOFError, gzip.BadGzipFile) as e:
+            raise ReportError(f"Sealed report is damaged: {e}") from None
+        finally:
+            text.close()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+SPED Services Tracing - timing spans for the tracker, aggregator and QR maker.
+
+Off by default. Set SERVICES_TRACE=1 (or to a database path) before starting
+an app to record spans into a rolling SQLite table, then summarise them with:
+
+    python Services_Tracing.py [--db trace_spans.db] [--hours 24] [--app Services_Tracker]
+
+Disabled spans cost one attribute check and return a shared no-op object.
+"""
+
+import atexit
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+TRACE_DB = "trace_spans.db"
+TRACE_ENV = "SERVICES_TRACE"
+MAX_SPANS = 50_000      # Rolling window: older spans are pruned on flush
+FLUSH_EVERY = 100       # Buffered spans written per batch
+FLUSH_SECONDS = 5.0     # ...or when the oldest buffered span is this old
+
+class _NullSpan:
+    """What span() returns when tracing is off: does nothing, allocates nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """Times the block it wraps on the monotonic clock; nested spans record their parent."""
+    __slots__ = ("tracer", "name", "attrs", "parent", "start_ns")
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self.name)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ns = time.perf_counter_ns() - self.start_ns
+        self.tracer._stack().pop()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record(self.name, duration_ns, parent=self.parent, **self.attrs)
+        return False
+
+    def set(self, **attrs):
+        """Attach attributes (row counts, outcome, ...) discovered inside the block."""
+        self.attrs.update(attrs)
+
+class Tracer:
+    """Collects spans in memory and writes them to SQLite in batches."""
+
+    def __init__(self, db_file=None, enabled=False, app=None, max_spans=MAX_SPANS):
+        self.db_file = db_file or TRACE_DB
+        self.enabled = enabled
+        self.app = app or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+        self.max_spans = max_spans
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._first_buffered = None
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, **attrs):
+        """Context manager timing a block as one span named name (e.g. "scan.decrypt")."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, attrs)
+
+    def record(self, name, duration_ns, parent=None, **attrs):
+        """Record a span measured elsewhere (e.g. summed over a loop)."""
+        if not self.enabled:
+            return
+        row = (time.time(), self.app, name, parent, duration_ns / 1e6, threading.current_thread().name,
+               json.dumps(attrs, default=str) if attrs else None)
+        with self._lock:
+            self._buffer.append(row)
+            if self._first_buffered is None:
+                self._first_buffered = time.monotonic()
+            due = (len(self._buffer) >= FLUSH_EVERY
+                   or time.monotonic() - self._first_buffered >= FLUSH_SECONDS)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write buffered spans and prune the table to the newest max_spans."""
+        with self._lock:
+            rows, self._buffer, self._first_buffered = self._buffer, [], None
+        if not rows:
+            return
+        conn = sqlite3.connect(self.db_file, timeout=5)
+        try:
+            init_trace_schema(conn)
+            with conn:
+                conn.executemany('''
+                    INSERT INTO spans (started_at, app, name, parent, duration_ms, thread, attrs)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                conn.execute("DELETE FROM spans WHERE id <= (SELECT MAX(id) FROM spans) - ?", (self.max_spans,))
+        finally:
+            conn.close()
+
+def init_trace_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS spans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at REAL,
+            app TEXT,
+            name TEXT,
+            parent TEXT,
+            duration_ms REAL,
+            thread TEXT,
+            attrs TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_spans_name ON spans(name)")
+
+def _tracer_from_env():
+    setting = os.environ.get(TRACE_ENV, "").strip()
+    if setting.lower() in ("", "0", "false", "no", "off"):
+        return Tracer()
+    return Tracer(None if setting.lower() in ("1", "true", "yes", "on") else setting, enabled=True)
+
+tracer = _tracer_from_env()
+span = tracer.span
+atexit.register(tracer.flush)
+
+def configure(enabled=True, db_file=None, app=None):
+    """Turn tracing on or off at runtime (the environment variable sets the initial state)."""
+    tracer.flush()
+    tracer.enabled = enabled
+    if db_file:
+        tracer.db_file = db_file
+    if app:
+        tracer.app = app
+
+# ------------------ Summary ---------------------
+def _percentile(ordered, q):
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def summarize(db_file=None, since_hours=None, app=None):
+    """Per-stage statistics: [{"app", "name", "count", "mean", "p50", "p95", "p99", "max"}] in ms."""
+    db_file = db_file or tracer.db_file
+    if tracer.enabled and db_file == tracer.db_file:
+        tracer.flush()
+    if not os.path.exists(db_file):
+        return []
+    conn = sqlite3.connect(db_file)
+    try:
+        init_trace_schema(conn)
+        query, params = "SELECT app, name, duration_ms FROM spans WHERE 1=1", []
+        if since_hours:
+            query += " AND started_at >= ?"
+            params.append(time.time() - since_hours * 3600)
+        if app:
+            query += " AND app = ?"
+            params.append(app)
+        durations = {}
+        for span_app, name, duration in conn.execute(query + " ORDER BY app, name", params):
+            durations.setdefault((span_app, name), []).append(duration)
+    finally:
+        conn.close()
+    stats = []
+    for (span_app, name), values in durations.items():
+        values.sort()
+        stats.append({"app": span_app, "name": name, "count": len(values), "mean": sum(values) / len(values),
+                      "p50": _percentile(values, 50), "p95": _percentile(values, 95),
+                      "p99": _percentile(values, 99), "max": values[-1]})
+    return stats
+
+def summary_text(stats):
+    """Fixed-width table of summarize() output."""
+    if not stats:
+        return "No spans recorded."
+    lines = [f"{'app':<30}{'stage':<24}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for s in stats:
+        lines.append(f"{s['app'][:29]:<30}{s['name'][:23]:<24}{s['count']:>7}"
+                     f"{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarise recorded timing spans (p50/p95/p99 per stage)")
+    parser.add_argument("--db", default=tracer.db_file, help=f"Span database (default {tracer.db_file})")
+    parser.add_argument("--hours", type=float, help="Only spans from the last N hours")
+    parser.add_argument("--app", help="Only spans from one app (e.g. Services_Tracker)")
+    parser.add_argument("--clear", action="store_true", help="Delete all recorded spans and exit")
+    args = parser.parse_args(argv)
+
+    if args.clear:
+        if os.path.exists(args.db):
+            conn = sqlite3.connect(args.db)
+            init_trace_schema(conn)
+            with conn:
+                conn.execute("DELETE FROM spans")
+            conn.close()
+        return 0
+    print(summary_text(summarize(args.db, args.hours, args.app)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,22 +7,26 @@ Created on Tue May 27 12:48:43 2025
 
 import tkinter as tk
 from tkinter import simpledialog, messagebox, filedialog, ttk
-import cv2
 from datetime import datetime
-import smtplib
-from email.message import EmailMessage
 import os
 import sqlite3
 import csv
-import keyring
 import base64
 import hashlib
-from cryptography.fernet import Fernet, InvalidToken
+import calendar
 import json
+import threading
+import time
+from functools import lru_cache
+
+from Services_Migrations import AddColumns, Backfill, CreateIndex, Migration, SQL, migrate
+from Services_Reports import SEALED_SUFFIX, sealed_report_writer
+from Services_Tracing import span, summarize, summary_text, tracer
 
 DB_FILE = "services_data.db"
 KEYRING_SERVICE = "sped_service_app"
 KEYRING_PIN_KEY = "encryption_pin"  # Key for storing PIN in keyring
+WARM_UP_DELAY_MS = 100  # After the window is up, before background imports start
 PROVIDERS = {
     "Microsoft": {
         "email_key": "microsoft_email",
@@ -45,6 +49,9 @@ PROVIDERS = {
 }
 
 # ------------------ Encryption Logic ---------------------
+# cryptography, OpenCV, smtplib and keyring are imported where first used, so
+# the window comes up without waiting for them (see TouchApp.warm_up)
+@lru_cache(maxsize=8)  # PBKDF2 is deliberately slow; every encrypted scan needs the key
 def get_fernet_key_from_pin(pin, salt=None):
     """Derive a Fernet key from PIN using PBKDF2 for better security."""
     if salt is None:
@@ -67,12 +74,14 @@ def get_fernet_key_from_pin(pin, salt=None):
 
 def encrypt_data(data, pin):
     """Encrypt data using PIN-derived key."""
+    from cryptography.fernet import Fernet
     key = get_fernet_key_from_pin(pin)
     f = Fernet(key)
     return f.encrypt(data.encode('utf-8')).decode('utf-8')
 
 def decrypt_data(encrypted_text, pin):
     """Decrypt data using PIN-derived key."""
+    from cryptography.fernet import Fernet, InvalidToken
     key = get_fernet_key_from_pin(pin)
     f = Fernet(key)
     try:
@@ -91,6 +100,62 @@ def decrypt_data(encrypted_text, pin):
             return None
 
 # ------------------ Database Handling ---------------------
+SECONDS_PER_DAY = 86400
+
+def local_epoch(dt):
+    """Seconds since 1970-01-01 on the local wall clock (the naive time read as UTC)."""
+    return calendar.timegm(dt.timetuple())
+
+# ------------------ Schema Migrations ---------------------
+# PRAGMA user_version records the last migration applied; add new ones at the end
+TRACKER_MIGRATIONS = [
+    Migration(1, "Base tables", [
+        SQL("create students, services, settings", '''
+            CREATE TABLE IF NOT EXISTS students (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE
+            )
+        ''', '''
+            CREATE TABLE IF NOT EXISTS services (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id INTEGER,
+                timestamp TEXT,
+                ts_epoch INTEGER,
+                day_key INTEGER,
+                service TEXT,
+                duration REAL,
+                event TEXT,
+                score REAL,
+                goal_id TEXT,
+                device_id TEXT,
+                schema_version INTEGER DEFAULT 1,
+                reported INTEGER DEFAULT 0,
+                FOREIGN KEY (student_id) REFERENCES students(id)
+            )
+        ''', '''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        '''),
+    ]),
+    # Integer ts_epoch/day_key columns, backfilled from the text timestamp.
+    # strftime('%s') reads the stored local time as UTC, matching local_epoch()
+    Migration(2, "Integer time columns", [
+        AddColumns("services", {"ts_epoch": "INTEGER", "day_key": "INTEGER"}),
+        Backfill("services", {"ts_epoch": "CAST(strftime('%s', timestamp) AS INTEGER)",
+                              "day_key": f"CAST(strftime('%s', timestamp) AS INTEGER) / {SECONDS_PER_DAY}"},
+                 "ts_epoch IS NULL AND timestamp IS NOT NULL"),
+        CreateIndex("idx_services_ts_epoch", "services", "ts_epoch"),
+        CreateIndex("idx_services_day_key", "services", "day_key"),
+        CreateIndex("idx_services_student_ts", "services", "student_id, ts_epoch"),
+    ]),
+    # get_services(only_new=True) reads unsent rows in time order on every send
+    Migration(3, "Unreported index", [
+        CreateIndex("idx_services_unreported", "services", "ts_epoch, id", where="reported = 0"),
+    ]),
+]
+
 class ServiceDB:
     def __init__(self, db_file=DB_FILE):
         self.db_file = db_file
@@ -98,36 +163,7 @@ class ServiceDB:
 
     def _init_db(self):
         with sqlite3.connect(self.db_file) as conn:
-            c = conn.cursor()
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS students (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE
-                )
-            ''')
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS services (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    student_id INTEGER,
-                    timestamp TEXT,
-                    service TEXT,
-                    duration REAL,
-                    event TEXT,
-                    score REAL,
-                    goal_id TEXT,
-                    device_id TEXT,
-                    schema_version INTEGER DEFAULT 1,
-                    reported INTEGER DEFAULT 0,
-                    FOREIGN KEY (student_id) REFERENCES students(id)
-                )
-            ''')
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            ''')
-            conn.commit()
+            migrate(conn, TRACKER_MIGRATIONS)
 
     def get_students(self):
         with sqlite3.connect(self.db_file) as conn:
@@ -144,7 +180,7 @@ class ServiceDB:
             return c.fetchone()[0]
 
     def log_service(self, student_id, service, duration, event, score, goal_id=None):
-        with sqlite3.connect(self.db_file) as conn:
+        with span("db.log_service"), sqlite3.connect(self.db_file) as conn:
             c = conn.cursor()
             # Convert duration and score to float if they're not empty
             duration_val = None
@@ -165,11 +201,13 @@ class ServiceDB:
             import platform
             device_id = platform.node() or "UNKNOWN"
             
+            now = datetime.now()
+            ts_epoch = local_epoch(now)
             c.execute('''INSERT INTO services
-                (student_id, timestamp, service, duration, event, score, goal_id, device_id, schema_version, reported)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, 0)''',
-                (student_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), service, 
-                 duration_val, event, score_val, goal_id, device_id))
+                (student_id, timestamp, ts_epoch, day_key, service, duration, event, score, goal_id, device_id, schema_version, reported)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, 0)''',
+                (student_id, now.strftime("%Y-%m-%d %H:%M:%S"), ts_epoch, ts_epoch // SECONDS_PER_DAY,
+                 service, duration_val, event, score_val, goal_id, device_id))
             conn.commit()
 
     def get_services(self, student_id=None, only_new=False):
@@ -184,7 +222,7 @@ class ServiceDB:
                     q += " AND s.reported=0"
             elif only_new:
                 q += " WHERE s.reported=0"
-            q += " ORDER BY s.timestamp"
+            q += " ORDER BY s.ts_epoch, s.id"
             c.execute(q, params)
             return c.fetchall()
 
@@ -213,34 +251,144 @@ class ServiceDB:
             c.execute("DELETE FROM settings WHERE key=?", (key,))
             conn.commit()
 
+# ------------------ Settings and Credential Cache ---------------------
+class SettingsCache:
+    """ServiceDB settings and OS keyring secrets, each read once and then served from memory.
+
+    Keyring backends (Windows Credential Manager, Linux Secret Service) can
+    take hundreds of milliseconds per lookup and may show a dialog. Changes
+    are saved first and cached only once saving worked, so the cache never
+    holds a value the keyring or database does not.
+    """
+
+    def __init__(self, db, service=KEYRING_SERVICE):
+        self.db = db
+        self.service = service
+        self._values = {}
+        # One lock for reads and loads: a lookup waits for a background prefetch of the same value
+        self._lock = threading.Lock()
+
+    def _get(self, key, load):
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = load()  # Failures propagate and are not cached
+            return self._values[key]
+
+    def secret(self, name):
+        """Keyring password stored under name, or None."""
+        import keyring
+        return self._get(("secret", name), lambda: keyring.get_password(self.service, name))
+
+    def set_secret(self, name, value):
+        import keyring
+        with self._lock:
+            self._values.pop(("secret", name), None)
+            keyring.set_password(self.service, name, value)
+            self._values[("secret", name)] = value
+
+    def delete_secret(self, name):
+        """Forget name here and in the keyring (nothing stored is fine)."""
+        import keyring
+        with self._lock:
+            self._values.pop(("secret", name), None)
+            try:
+                keyring.delete_password(self.service, name)
+            except keyring.errors.PasswordDeleteError:
+                pass
+            self._values[("secret", name)] = None
+
+    def setting(self, key):
+        """ServiceDB setting ("" if unset)."""
+        return self._get(("setting", key), lambda: self.db.get_setting(key))
+
+    def set_setting(self, key, value):
+        with self._lock:
+            if self._values.get(("setting", key)) == value:
+                return
+            self._values.pop(("setting", key), None)
+            self.db.set_setting(key, value)
+            self._values[("setting", key)] = value
+
+    def prefetch(self, secrets=(), settings=()):
+        """Load values ahead of use; failures are left for the real lookup to report."""
+        for name in secrets:
+            try:
+                self.secret(name)
+            except Exception:
+                pass
+        for key in settings:
+            try:
+                self.setting(key)
+            except Exception:
+                pass
+
 # ------------------ QR and Email Functions ---------------------
+REPORT_HEADER = ["ID", "Timestamp", "Student", "Service", "Duration", "Event", "Score", "Goal_ID", "Device_ID", "Reported"]
+
+def write_report_csv(path, services, pin=None):
+    """Write get_services() rows as a report CSV (the format the aggregator imports).
+
+    With a PIN the CSV is written sealed: compressed and encrypted as one payload.
+    """
+    with (sealed_report_writer(path, pin) if pin else open(path, "w", newline="")) as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADER)
+        writer.writerows(services)
+
+_detector = None
+_detector_lock = threading.Lock()
+
+def qr_detector():
+    """The shared cv2.QRCodeDetector, importing OpenCV on first use."""
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            import cv2
+            _detector = cv2.QRCodeDetector()
+        return _detector
+
 def scan_qr_code():
-    cap = cv2.VideoCapture(0)
-    detector = cv2.QRCodeDetector()
+    detector = qr_detector()
+    import cv2
+    with span("scan.camera_open"):
+        cap = cv2.VideoCapture(0)
     data = None
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        data, bbox, _ = detector.detectAndDecode(frame)
-        cv2.imshow("Scan QR Code (press q to cancel)", frame)
-        if data:
-            cap.release()
-            cv2.destroyAllWindows()
-            return data
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-    cap.release()
-    cv2.destroyAllWindows()
+    # Decoding runs once per frame; its time is summed into one span per scan
+    decode_ns = frames = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            start = time.perf_counter_ns()
+            data, bbox, _ = detector.detectAndDecode(frame)
+            decode_ns += time.perf_counter_ns() - start
+            frames += 1
+            cv2.imshow("Scan QR Code (press q to cancel)", frame)
+            if data:
+                return data
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        cap.release()
+        cv2.destroyAllWindows()
+        tracer.record("scan.decode", decode_ns, frames=frames, found=bool(data))
     return None
 
-def send_email(filename, recipient, sender, password, smtp_settings):
+def report_message(filename, recipient, sender):
+    """The report email: filename attached as application/octet-stream."""
+    from email.message import EmailMessage
     msg = EmailMessage()
     msg["Subject"] = "SPED Service Log"
     msg["From"] = sender
     msg["To"] = recipient
     with open(filename, "rb") as f:
         msg.add_attachment(f.read(), maintype="application", subtype="octet-stream", filename=os.path.basename(filename))
+    return msg
+
+def send_email(filename, recipient, sender, password, smtp_settings):
+    import smtplib
+    msg = report_message(filename, recipient, sender)
     if smtp_settings["use_ssl"]:
         with smtplib.SMTP_SSL(smtp_settings["smtp_server"], smtp_settings["smtp_port"]) as smtp:
             smtp.login(sender, password)
@@ -252,6 +400,18 @@ def send_email(filename, recipient, sender, password, smtp_settings):
             smtp.login(sender, password)
             smtp.send_message(msg)
 
+def send_report(db, services, recipient, sender, password, smtp_settings, tmpfile=None, pin=None):
+    """Email get_services() rows as a report CSV (sealed if pin is set), then mark them reported."""
+    tmpfile = tmpfile or "to_send_report" + (SEALED_SUFFIX if pin else ".csv")
+    try:
+        write_report_csv(tmpfile, services, pin)
+        with span("email.send", server=smtp_settings["smtp_server"]):
+            send_email(tmpfile, recipient, sender, password, smtp_settings)
+        db.mark_services_reported([row[0] for row in services])
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+
 # ------------------ Keypad for Numeric Input ---------------------
 class Keypad(tk.Toplevel):
     _is_open = False
@@ -334,15 +494,44 @@ class TouchApp(tk.Tk):
         self.after_idle(self.attributes, '-topmost', False)
         self.bind("<Escape>", lambda e: self.attributes("-fullscreen", False))
         self.selected_provider = tk.StringVar(value="Microsoft")
-        # Load PIN from OS keyring instead of database
-        try:
-            self.pin = keyring.get_password(KEYRING_SERVICE, KEYRING_PIN_KEY) or ""
-        except Exception:
-            self.pin = ""
+        self.settings = SettingsCache(self.db)
         self.current_goal_id = None  # Store goal_id from QR code
         self.create_menu()
         self.create_widgets()
         self.reset_fields()
+        # Once the first frame is drawn, load the slow parts in the background
+        self.after(WARM_UP_DELAY_MS, self.start_warm_up)
+
+    @property
+    def pin(self):
+        """PIN from the OS keyring ("" for none, None if the keyring could not be read)."""
+        try:
+            return self.settings.secret(KEYRING_PIN_KEY) or ""
+        except Exception as e:
+            print("PIN lookup failed:", e)
+            return None
+
+    def start_warm_up(self):
+        # The provider is read here: Tk variables belong to the main thread
+        smtp = PROVIDERS[self.selected_provider.get()]
+        threading.Thread(target=self.warm_up, args=(smtp,), daemon=True).start()
+
+    def warm_up(self, smtp):
+        """Load OpenCV, the PIN and its key ahead of the first scan, then smtp's credentials.
+
+        The camera itself is not opened: that would turn its light on while nobody is scanning.
+        """
+        with span("startup.warm_up"):
+            try:
+                pin = self.pin
+                if pin:
+                    from cryptography.fernet import Fernet  # noqa: F401
+                    get_fernet_key_from_pin(pin)
+                qr_detector()
+            except Exception:
+                pass  # Whatever failed is retried, and reported, when it is actually needed
+            self.settings.prefetch(secrets=(smtp["email_key"], smtp["password_key"]),
+                                   settings=("last_recipient_email",))
 
     # --- Menu ---
     def create_menu(self):
@@ -367,30 +556,45 @@ class TouchApp(tk.Tk):
         encryption_menu.add_command(label="Clear PIN (No Encryption)", command=self.clear_pin)
         menubar.add_cascade(label="Encryption", menu=encryption_menu)
 
+        diagnostics_menu = tk.Menu(menubar, tearoff=0)
+        diagnostics_menu.add_command(label="Timing Summary", command=self.show_timing_summary)
+        menubar.add_cascade(label="Diagnostics", menu=diagnostics_menu)
+
         self.config(menu=menubar)
 
+    def show_timing_summary(self):
+        """p50/p95/p99 per stage from recorded spans (recording needs SERVICES_TRACE=1)."""
+        text = summary_text(summarize())
+        if not tracer.enabled:
+            text += "\n\nTiming is off. Start the app with SERVICES_TRACE=1 to record it."
+        win = tk.Toplevel(self)
+        win.title("Timing Summary")
+        box = tk.Text(win, font=("Courier", 10), width=100, height=20)
+        box.insert("1.0", text)
+        box.config(state=tk.DISABLED)
+        box.pack(fill="both", expand=True, padx=8, pady=8)
+
     def set_pin(self):
         pin = simpledialog.askstring("Set PIN", "Enter new PIN for decrypting QR codes:", show="*", parent=self)
         if not pin:
             return
-        self.pin = pin
         # Store PIN in OS keyring instead of database
         try:
-            keyring.set_password(KEYRING_SERVICE, KEYRING_PIN_KEY, pin)
-            messagebox.showinfo("PIN Set", "PIN set successfully. Only QR codes created with this PIN can be read.", parent=self)
+            self.settings.set_secret(KEYRING_PIN_KEY, pin)
+            messagebox.showinfo("PIN Set", "PIN set successfully. Only QR codes created with this PIN can be read, "
+                                "and emailed reports are encrypted with it.", parent=self)
         except Exception as e:
             messagebox.showerror("Error", f"Could not save PIN to secure storage: {e}", parent=self)
 
     def clear_pin(self):
-        self.pin = ""
         # Remove PIN from OS keyring
         try:
-            keyring.delete_password(KEYRING_SERVICE, KEYRING_PIN_KEY)
-        except keyring.errors.PasswordDeleteError:
-            pass  # PIN was not stored
-        except Exception:
-            pass
-        messagebox.showinfo("PIN Cleared", "Encryption disabled. App will treat QR codes as plain text.", parent=self)
+            self.settings.delete_secret(KEYRING_PIN_KEY)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not remove PIN from secure storage: {e}", parent=self)
+            return
+        messagebox.showinfo("PIN Cleared", "Encryption disabled. App will treat QR codes as plain text "
+                            "and email reports unencrypted.", parent=self)
 
     def set_email_credentials(self, provider):
         smtp = PROVIDERS[provider]
@@ -406,20 +610,18 @@ class TouchApp(tk.Tk):
         )
         if not pw:
             return
-        keyring.set_password(KEYRING_SERVICE, smtp["email_key"], email)
-        keyring.set_password(KEYRING_SERVICE, smtp["password_key"], pw)
+        try:
+            self.settings.set_secret(smtp["email_key"], email)
+            self.settings.set_secret(smtp["password_key"], pw)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not save credentials to secure storage: {e}", parent=self)
+            return
         messagebox.showinfo("Saved", f"{smtp['friendly']} credentials saved securely.", parent=self)
 
     def clear_email_credentials(self, provider):
         smtp = PROVIDERS[provider]
-        try:
-            keyring.delete_password(KEYRING_SERVICE, smtp["email_key"])
-        except keyring.errors.PasswordDeleteError:
-            pass
-        try:
-            keyring.delete_password(KEYRING_SERVICE, smtp["password_key"])
-        except keyring.errors.PasswordDeleteError:
-            pass
+        self.settings.delete_secret(smtp["email_key"])
+        self.settings.delete_secret(smtp["password_key"])
         messagebox.showinfo("Cleared", f"{smtp['friendly']} credentials cleared.", parent=self)
 
     # --- Widgets ---
@@ -529,7 +731,8 @@ class TouchApp(tk.Tk):
 
     # --- QR Scan ---
     def handle_scan(self):
-        data = scan_qr_code()
+        with span("scan.capture"):
+            data = scan_qr_code()
         if not data:
             messagebox.showinfo("Scan Cancelled", "No QR code detected.", parent=self)
             return
@@ -538,8 +741,13 @@ class TouchApp(tk.Tk):
         parsed = {}
 
         # Handle encrypted QR if PIN is set
-        if self.pin:
-            decrypted = decrypt_data(data, self.pin)
+        pin = self.pin
+        if pin is None:
+            messagebox.showerror("PIN Unavailable", "Could not read the PIN from the keyring.", parent=self)
+            return
+        if pin:
+            with span("scan.decrypt"):
+                decrypted = decrypt_data(data, pin)
             if not decrypted:
                 messagebox.showerror("Decryption Error", "Failed to decrypt QR code. Wrong PIN or not encrypted.", parent=self)
                 return
@@ -574,8 +782,9 @@ class TouchApp(tk.Tk):
 
             # Auto-add/select student if found in QR code
             if student_name:
-                self.db.add_student(student_name)
-                students = [name for _, name in self.db.get_students()]
+                with span("scan.students"):
+                    self.db.add_student(student_name)
+                    students = [name for _, name in self.db.get_students()]
                 self.student_combo['values'] = students
                 self.student_combo.set(student_name)
             else:
@@ -616,12 +825,13 @@ class TouchApp(tk.Tk):
         if not student_name:
             messagebox.showerror("No Student", "Please select or add a student before saving.", parent=self)
             return
-        student_id = self.db.add_student(student_name)
-        service = self.fields["Service"].get().strip()
-        duration = self.fields["Duration"].get().strip()
-        event = self.fields["Event"].get().strip()
-        score = self.score_entry.get().strip()
-        self.db.log_service(student_id, service, duration, event, score, self.current_goal_id)
+        with span("save"):
+            student_id = self.db.add_student(student_name)
+            service = self.fields["Service"].get().strip()
+            duration = self.fields["Duration"].get().strip()
+            event = self.fields["Event"].get().strip()
+            score = self.score_entry.get().strip()
+            self.db.log_service(student_id, service, duration, event, score, self.current_goal_id)
         messagebox.showinfo("Saved", f"Log entry saved for {student_name}.", parent=self)
         self.reset_fields()
 
@@ -650,43 +860,39 @@ class TouchApp(tk.Tk):
                 return
             only_new = (choice.lower().strip() == "new")
 
-        services = self.db.get_services(student_id, only_new=only_new)
+        with span("email.export") as export_span:
+            services = self.db.get_services(student_id, only_new=only_new)
+            export_span.set(rows=len(services))
         if not services:
             messagebox.showinfo("No Data", "No service data to send for this selection.", parent=self)
             return
 
-        tmpfile = "to_send_report.csv"
-        with open(tmpfile, "w", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(["ID", "Timestamp", "Student", "Service", "Duration", "Event", "Score", "Goal_ID", "Device_ID", "Reported"])
-            for row in services:
-                writer.writerow(row)
-
         smtp = PROVIDERS[self.selected_provider.get()]
-        last_email = self.db.get_setting("last_recipient_email")
+        last_email = self.settings.setting("last_recipient_email")
         recipient = simpledialog.askstring(
             "Recipient Email", "Email to send to:", initialvalue=last_email, parent=self)
         if not recipient:
-            os.remove(tmpfile)
             return
 
-        username = keyring.get_password(KEYRING_SERVICE, smtp["email_key"])
-        password = keyring.get_password(KEYRING_SERVICE, smtp["password_key"])
+        username = self.settings.secret(smtp["email_key"])
+        password = self.settings.secret(smtp["password_key"])
         if not username or not password:
             messagebox.showerror("No Credentials", f"No credentials found for {smtp['friendly']}.\nPlease set credentials using the menu.", parent=self)
-            os.remove(tmpfile)
+            return
+
+        # Without the PIN the report would go out unencrypted
+        pin = self.pin
+        if pin is None:
+            messagebox.showerror("PIN Unavailable", "Could not read the PIN from the keyring, so the report was not sent.",
+                                 parent=self)
             return
 
         try:
-            send_email(tmpfile, recipient, username, password, smtp)
+            send_report(self.db, services, recipient, username, password, smtp, pin=pin)
             messagebox.showinfo("Sent", f"Report sent to {recipient} using {smtp['friendly']}.", parent=self)
-            service_ids = [row[0] for row in services]
-            self.db.mark_services_reported(service_ids)
-            self.db.set_setting("last_recipient_email", recipient)
+            self.settings.set_setting("last_recipient_email", recipient)
         except Exception as e:
             messagebox.showerror("Error", f"Could not send email: {e}", parent=self)
-        finally:
-            os.remove(tmpfile)
     
     def export_local_backup(self):
         """Export all data to a local CSV file for backup"""
@@ -711,11 +917,7 @@ class TouchApp(tk.Tk):
         
         # Write CSV
         try:
-            with open(filename, "w", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerow(["ID", "Timestamp", "Student", "Service", "Duration", "Event", "Score", "Goal_ID", "Device_ID", "Reported"])
-                for row in services:
-                    writer.writerow(row)
+            write_report_csv(filename, services)
             
             messagebox.showinfo("Export Complete", 
                               f"Backup saved successfully!\n\n"
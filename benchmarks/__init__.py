@@ -0,0 +1,5 @@
+"""Performance benchmarks for the SPED Services tools (run with python -m benchmarks.<name>)
+
+Optional tool: py-spy (pip install py-spy) samples a slow run without changing
+it, e.g. py-spy record -o profile.svg -- python -m benchmarks.bench_suite
+"""
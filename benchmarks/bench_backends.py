@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Query backend benchmark: pandas on the loaded frame vs DuckDB over SQLite and Parquet.
+
+    python -m benchmarks.bench_backends [--rows 100000 1000000 10000000]
+
+Each size gets its own bench_backends_<rows>.db (and Parquet snapshot beside it,
+when pyarrow is installed), built once and reused on later runs. DuckDB runs
+first, so a size too large for pandas still reports the DuckDB numbers.
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from Services_Aggregator import export_parquet_snapshot, init_schema
+from Services_Analytics import (
+    DuckDBBackend, PandasBackend, activity_heatmap, backend_partials, duckdb_available,
+    frame_memory, goal_summary, overview_metrics, read_services
+)
+from benchmarks.synthetic import insert_records, synthetic_records
+
+BUILD_CHUNK_ROWS = 1_000_000  # Generated and inserted in pieces so 10M rows fit in memory
+
+TASKS = {
+    "overview": lambda backend, since: overview_metrics(backend, since),
+    "goals": lambda backend, since: goal_summary(backend),
+    "heatmap": lambda backend, since: activity_heatmap(backend),
+    "pivot student x service": lambda backend, since: backend_partials(backend, ["student", "service"], "duration"),
+    "pivot month x weekday": lambda backend, since: backend_partials(backend, ["month", "weekday"], "score"),
+}
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def open_database(path, n_rows):
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        if conn.execute("SELECT COUNT(*) FROM services").fetchone()[0] >= n_rows * 0.99:
+            return conn
+        conn.close()
+        os.remove(path)
+    print(f"Building {path} with {n_rows:,} rows...")
+    conn = sqlite3.connect(path)
+    init_schema(conn)
+    for seed, start in enumerate(range(0, n_rows, BUILD_CHUNK_ROWS)):
+        insert_records(conn, synthetic_records(min(BUILD_CHUNK_ROWS, n_rows - start), seed=seed))
+    return conn
+
+def canonical(result):
+    """Comparable form of a task result, whatever engine and dtypes produced it"""
+    if isinstance(result, dict):
+        return {k: round(float(v), 6) for k, v in result.items()}
+    frame = result.reset_index() if result.index.name or result.index.nlevels > 1 else result
+    keys = [c for c in frame.columns if frame[c].dtype.kind not in "fiu" or c in ("dow", "hour")]
+    frame = frame.astype({c: str for c in keys}).sort_values(keys).reset_index(drop=True)
+    return frame.astype({c: float for c in frame.columns if c not in keys}).round(6)
+
+def same(a, b):
+    a, b = canonical(a), canonical(b)
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(np.isclose(a[k], b[k], equal_nan=True) for k in a)
+    return (list(a.columns) == list(b.columns) and len(a) == len(b)
+            and all(np.allclose(a[c], b[c], equal_nan=True) if a[c].dtype.kind == "f" else (a[c] == b[c]).all()
+                    for c in a.columns))
+
+def run_tasks(backend, since):
+    return {name: timed(lambda: task(backend, since)) for name, task in TASKS.items()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--no-pandas", action="store_true", help="Skip loading the frame (DuckDB only)")
+    args = parser.parse_args(argv)
+    if not duckdb_available():
+        raise SystemExit("duckdb is not installed (pip install duckdb)")
+
+    for n_rows in args.rows:
+        db_path = f"bench_backends_{n_rows}.db"
+        conn, build_s = timed(lambda: open_database(db_path, n_rows))
+        since = conn.execute("SELECT MAX(day_key) - 7 FROM services").fetchone()[0]
+        engines = {"duckdb/sqlite": lambda: DuckDBBackend("sqlite", db_file=db_path)}
+        try:
+            snapshot_dir = db_path[:-3] + "_snapshot"
+            export_parquet_snapshot(conn, snapshot_dir)
+            engines["duckdb/parquet"] = lambda: DuckDBBackend("snapshot", snapshot_dir=snapshot_dir)
+        except RuntimeError as e:
+            print(f"Skipping Parquet: {e}")
+        if not args.no_pandas:
+            def pandas_backend():
+                return PandasBackend(read_services(conn))
+            engines["pandas"] = pandas_backend
+
+        print(f"\n{n_rows:,} rows ({build_s:.1f}s to open/build)")
+        print(f"{'engine':<16}{'setup':>9}" + "".join(f"{name:>26}" for name in TASKS))
+        results = {}
+        for engine, make in engines.items():
+            backend, setup_s = timed(make)
+            results[engine] = run_tasks(backend, since)
+            line = f"{engine:<16}{setup_s:>8.2f}s" + "".join(f"{s:>25.3f}s" for _, s in results[engine].values())
+            if engine == "pandas":
+                line += f"   ({frame_memory(backend.frame)['bytes'] / 2**20:.0f} MB frame)"
+            print(line)
+            del backend
+
+        reference = next(iter(results.values()))
+        for engine, outcome in results.items():
+            for name, (result, _) in outcome.items():
+                if not same(result, reference[name][0]):
+                    raise SystemExit(f"Mismatch: {engine} {name}")
+        conn.close()
+    print("\nAll engines agree.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end load harness: simulated trackers -> local SMTP/IMAP stand-ins -> aggregator.
+
+    python -m benchmarks.bench_load [--devices 10 100 1000] [--sessions 5] [--threads 32]
+
+Each simulated device has its own tracker database. It logs sessions through
+ServiceDB.log_service and mails them with send_report/send_email (the
+email_csv path) to a local SMTP stand-in. The aggregator polls the matching
+IMAP stand-in with fetch_and_import until every session is visible in its
+database. Reports latency from log_service to row visible (p50/p95/max) and
+end-to-end throughput. Nothing leaves the machine.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Services_Aggregator import ATTACH_DIR, fetch_and_import, init_schema
+from Services_Tracker import ServiceDB, send_report
+from benchmarks.local_mail import Mailbox, imap_factory, smtp_settings, start_imap, start_smtp
+
+SUBJECT = "SPED Service Log"
+
+def run_device(device, sessions, workdir, smtp, logged, lock):
+    """One tablet: log sessions, then email them as a single report"""
+    db = ServiceDB(os.path.join(workdir, f"device_{device:04d}.db"))
+    for session in range(sessions):
+        # One student per session: the aggregator's unique key is (timestamp, student, service, device)
+        student = f"Device {device} Student {session}"
+        student_id = db.add_student(student)
+        db.log_service(student_id, "OT", "30", "session", "80")
+        with lock:
+            logged[student] = time.perf_counter()
+    send_report(db, db.get_services(only_new=True), "aggregator@localhost", f"device{device}@localhost",
+                "password", smtp, tmpfile=os.path.join(workdir, f"report_{device:04d}.csv"))
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * q // 100) - 1)] if ordered else float("nan")
+
+def run_load(n_devices, sessions, threads, timeout, workdir):
+    mailbox = Mailbox()
+    smtp_server, imap_server = start_smtp(mailbox), start_imap(mailbox)
+    conn = sqlite3.connect(os.path.join(workdir, "aggregated_services.db"))
+    init_schema(conn)
+    os.makedirs(ATTACH_DIR, exist_ok=True)
+
+    logged, visible, lock = {}, {}, threading.Lock()
+    expected = n_devices * sessions
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(threads, n_devices)) as pool:
+        futures = [pool.submit(run_device, d, sessions, workdir, smtp_settings(smtp_server), logged, lock)
+                   for d in range(n_devices)]
+
+        # Aggregator: poll the mailbox until every session has landed
+        polls, last_id = 0, 0
+        while len(visible) < expected and time.perf_counter() - start < timeout:
+            fetch_and_import(conn, "localhost", "aggregator@localhost", "password", SUBJECT,
+                             imap_factory=imap_factory(imap_server))
+            polls += 1
+            now = time.perf_counter()
+            rows = conn.execute("SELECT id, student FROM services WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+            for row_id, student in rows:
+                visible.setdefault(student, now)
+                last_id = row_id
+            if not rows:
+                time.sleep(0.05)
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    smtp_server.stop()
+    imap_server.stop()
+    conn.close()
+
+    latencies = [visible[s] - logged[s] for s in visible if s in logged]
+    return {"devices": n_devices, "rows": len(visible), "expected": expected, "emails": len(mailbox),
+            "polls": polls, "seconds": elapsed, "rows_per_s": len(visible) / elapsed,
+            "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "max": max(latencies, default=float("nan"))}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--sessions", type=int, default=5, help="Sessions logged per device before it sends")
+    parser.add_argument("--threads", type=int, default=32, help="Devices running at once")
+    parser.add_argument("--timeout", type=float, default=600, help="Give up waiting for rows after N seconds")
+    args = parser.parse_args(argv)
+
+    cwd = os.getcwd()
+    print(f"{'devices':>8}{'rows':>9}{'emails':>8}{'polls':>7}{'seconds':>9}{'rows/s':>9}"
+          f"{'p50 s':>8}{'p95 s':>8}{'max s':>8}")
+    failed = False
+    for n_devices in args.devices:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)  # fetch_and_import saves attachments under ./attachments
+            try:
+                r = run_load(n_devices, args.sessions, args.threads, args.timeout, workdir)
+            finally:
+                os.chdir(cwd)
+        print(f"{r['devices']:>8}{r['rows']:>9}{r['emails']:>8}{r['polls']:>7}{r['seconds']:>9.2f}"
+              f"{r['rows_per_s']:>9.1f}{r['p50']:>8.2f}{r['p95']:>8.2f}{r['max']:>8.2f}")
+        if r["rows"] != r["expected"]:
+            print(f"FAIL: {r['rows']} of {r['expected']} sessions reached the aggregator")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
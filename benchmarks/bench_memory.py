@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Memory regression check for the dashboard's services frame.
+
+    python -m benchmarks.bench_memory [--rows 200000] [--budget 96]
+
+Loads a synthetic database the way the dashboard does and fails (exit 1)
+if the frame needs more than --budget bytes per row, if incremental
+refreshes lose the compact column types, or if a row whose timestamp could
+not be parsed (NULL day_key) gets calendar features. The size and types are
+also checked for a dashboard started on an empty database, before the first
+import.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+from Services_Analytics import (
+    CATEGORY_COLUMNS, FLOAT32_COLUMNS, SERVICE_COLUMNS, ServiceFrameCache, frame_memory, read_services
+)
+from benchmarks.synthetic import build_database, insert_records, synthetic_records
+
+# Numeric columns read straight from SQLite (float once NULLs appear); an empty read leaves them object
+NUMERIC_COLUMNS = ["id", "ts_epoch", "schema_version"]
+
+def legacy_frame(conn):
+    """The frame as loaded before compaction: object strings and date objects"""
+    df = pd.read_sql_query(f"SELECT {', '.join(SERVICE_COLUMNS)} FROM services ORDER BY id", conn)
+    df['timestamp'] = pd.to_datetime(df['ts_epoch'], unit='s')
+    df['date'] = df['timestamp'].dt.date
+    df['week'] = df['timestamp'].dt.isocalendar().week
+    df['month'] = df['timestamp'].dt.strftime('%Y-%m')
+    df['weekday'] = df['timestamp'].dt.day_name()
+    return df.astype({col: object for col in CATEGORY_COLUMNS + ['month', 'weekday']})
+
+def dtype_problems(df):
+    problems = []
+    for col in CATEGORY_COLUMNS + ['week', 'month', 'weekday']:
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            problems.append(f"{col} is {df[col].dtype}, expected category")
+    for col in FLOAT32_COLUMNS:
+        if df[col].dtype != 'float32':
+            problems.append(f"{col} is {df[col].dtype}, expected float32")
+    for col in NUMERIC_COLUMNS:
+        if df[col].dtype.kind not in 'iuf':
+            problems.append(f"{col} is {df[col].dtype}, expected a numeric type")
+    if df['date'].dtype.kind != 'M':
+        problems.append(f"date is {df['date'].dtype}, expected datetime64")
+    return problems
+
+def time_feature_problems(df):
+    """Calendar features must follow day_key, and be missing where day_key is NULL"""
+    problems = []
+    missing = df['day_key'].isna()
+    if not missing.any():
+        problems.append("no row with a NULL day_key to check")
+    for col in ('date', 'week', 'month', 'weekday'):
+        if df.loc[missing, col].notna().any():
+            problems.append(f"{col} is set on a row with a NULL day_key")
+    expected = pd.to_datetime(df.loc[~missing, 'day_key'], unit='D')
+    if not (df.loc[~missing, 'date'] == expected).all():
+        problems.append("date does not match day_key")
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--budget", type=float, default=96.0, help="Maximum bytes per row")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench_memory.db")
+        conn = build_database(path, args.rows)
+        legacy = frame_memory(legacy_frame(conn))
+        compact = frame_memory(read_services(conn))
+        print(f"{'legacy':<10}{legacy['bytes'] / 2**20:>9.1f} MB {legacy['bytes_per_row']:>8.1f} bytes/row")
+        print(f"{'compact':<10}{compact['bytes'] / 2**20:>9.1f} MB {compact['bytes_per_row']:>8.1f} bytes/row")
+
+        # A refresh that appends new students/services must keep the columns categorical
+        cache = ServiceFrameCache()
+        cache.get(conn, 1)
+        extra = synthetic_records(1000, students=20, seed=99).assign(
+            student=lambda d: "New " + d['student'], service="New Service")
+        # The aggregator stores NULL ts_epoch/day_key for a timestamp it cannot parse
+        extra.loc[0, 'timestamp'] = "not a timestamp"
+        insert_records(conn, extra)
+        refreshed = cache.get(conn, 2)
+        conn.close()
+
+        # Started before the first import: the frame begins empty and rows arrive later
+        conn = build_database(os.path.join(tmp, "bench_memory_empty.db"), 0)
+        empty_start = ServiceFrameCache()
+        empty_start.get(conn, 1)
+        insert_records(conn, synthetic_records(args.rows // 10, seed=7))
+        grown = empty_start.get(conn, 2)
+        conn.close()
+        grown_memory = frame_memory(grown)
+        print(f"{'from empty':<10}{grown_memory['bytes'] / 2**20:>9.1f} MB {grown_memory['bytes_per_row']:>8.1f} bytes/row")
+
+    problems = dtype_problems(refreshed) + time_feature_problems(refreshed)
+    problems += [f"after an empty start, {problem}" for problem in dtype_problems(grown)]
+    if cache.incremental_loads != 1:
+        problems.append(f"expected one incremental load, got {cache.incremental_loads}")
+    if compact['bytes_per_row'] > args.budget:
+        problems.append(f"{compact['bytes_per_row']:.1f} bytes/row is over the {args.budget:.0f} budget")
+    if grown_memory['bytes_per_row'] > args.budget:
+        problems.append(f"after an empty start, {grown_memory['bytes_per_row']:.1f} bytes/row "
+                        f"is over the {args.budget:.0f} budget")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print(f"OK: {legacy['bytes_per_row'] / compact['bytes_per_row']:.1f}x smaller, within budget")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Schema migration benchmark: dry-run estimates vs measured step times, and writer stalls.
+
+    python -m benchmarks.bench_migrations [--rows 1000000] [--batch-size 20000] [--pause 0.1]
+
+Builds an aggregated database and winds it back to schema version 2 (no
+ts_epoch/day_key values, no time indexes). It then migrates it repeatedly
+while a writer thread inserts a row every few milliseconds: with the whole
+backfill in one transaction, in batches, and in batches with a pause between
+them. The rollup rebuild (migration 7) is timed the same way, in one
+transaction and in student ranges. Reports each step's estimate and actual
+time, and the inserts the writer managed and the longest it waited. Winding
+back, backfilling and rebuilding
+update every row, so the summary rollups are then checked against services,
+and once more after updates that move rows between students, days and goals.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from Services_Aggregator import AGGREGATOR_MIGRATIONS, EPOCH_SQL, SECONDS_PER_DAY, check_rollups, rebuild_rollups
+from Services_Migrations import migrate, results_text
+from benchmarks.synthetic import build_database
+
+PRE_VERSION = 2
+# Only migrations up to the backfill are timed; later one-off steps (rollup rebuilds) would mask its stalls
+MIGRATIONS = [m for m in AGGREGATOR_MIGRATIONS if m.version <= 3]
+WRITE_EVERY = 0.005   # Seconds between writer inserts
+EPOCH = EPOCH_SQL.format("?1")
+
+def wind_back(conn):
+    """Undo migration 3 on conn: empty the epoch columns and drop their indexes."""
+    for name in ("idx_services_ts_epoch", "idx_services_day_key", "idx_services_student_ts", "idx_services_service_ts"):
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.execute("UPDATE services SET ts_epoch = NULL, day_key = NULL")
+    conn.execute(f"PRAGMA user_version = {PRE_VERSION}")
+    conn.commit()
+
+class Writer(threading.Thread):
+    """Inserts services rows on its own connection and records how long each insert took."""
+
+    def __init__(self, path, first_stamp):
+        super().__init__(daemon=True)
+        self.path = path
+        self.first_stamp = first_stamp
+        self.latencies = []
+        self.stop = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.path, timeout=600)
+        stamp = self.first_stamp
+        while not self.stop.is_set():
+            stamp += timedelta(seconds=1)
+            start = time.perf_counter()
+            with conn:
+                conn.execute(f'''INSERT INTO services (timestamp, ts_epoch, day_key, student, service, device_id)
+                    VALUES (?1, {EPOCH}, {EPOCH} / {SECONDS_PER_DAY}, ?2, ?3, ?4)''',
+                             (stamp.strftime("%Y-%m-%d %H:%M:%S"), "Writer", "OT", "bench"))
+            self.latencies.append(time.perf_counter() - start)
+            time.sleep(WRITE_EVERY)
+        conn.close()
+
+def timed_migration(path, batch_size, pause, first_stamp):
+    """Migrate from PRE_VERSION with a concurrent writer; return (results, writer latencies)."""
+    conn = sqlite3.connect(path, timeout=600)
+    wind_back(conn)
+    writer = Writer(path, first_stamp)
+    writer.start()
+    try:
+        results = migrate(conn, MIGRATIONS, batch_size=batch_size, pause=pause)
+    finally:
+        writer.stop.set()
+        writer.join()
+        conn.close()
+    return results, writer.latencies
+
+def timed_rebuild(path, batch_size, pause, first_stamp):
+    """Rebuild the rollups with a concurrent writer; return (seconds, writer latencies)."""
+    conn = sqlite3.connect(path, timeout=600)
+    writer = Writer(path, first_stamp)
+    writer.start()
+    try:
+        start = time.perf_counter()
+        rebuild_rollups(conn, batch_size, pause, verify=False)
+        seconds = time.perf_counter() - start
+    finally:
+        writer.stop.set()
+        writer.join()
+        conn.close()
+    return seconds, writer.latencies
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=20_000, help="Rows per backfill transaction")
+    # A blocked writer's busy handler backs off to 100 ms sleeps, so shorter pauses rarely let it in
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds between batches in the paused run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "aggregated_services.db")
+        start = time.perf_counter()
+        build_database(path, args.rows, seed=args.seed).close()
+        print(f"Built {args.rows:,} rows in {time.perf_counter() - start:.1f}s")
+
+        conn = sqlite3.connect(path)
+        wind_back(conn)
+        estimates = migrate(conn, MIGRATIONS, dry_run=True)
+        conn.close()
+        print("\nDry run")
+        print(results_text(estimates))
+
+        runs = {}
+        modes = (("one transaction", args.rows + 1, 0.0), ("batched", args.batch_size, 0.0),
+                 ("batched + pause", args.batch_size, args.pause))
+        for run, (label, batch_size, pause) in enumerate(modes):
+            results, latencies = timed_migration(path, batch_size, pause, datetime(2099, 1, 1) + timedelta(days=run))
+            backfill = next(r for r in results if r["step"].startswith("backfill"))
+            runs[label] = (latencies, backfill["seconds"])
+            print(f"\nMigrated ({label}, batch size {batch_size:,}, pause {pause}s)")
+            print(results_text(results))
+        rebuilds = (("rebuild, one txn", args.rows + 1, 0.0), ("rebuild, batched", args.batch_size, args.pause))
+        for run, (label, batch_size, pause) in enumerate(rebuilds, len(modes)):
+            seconds, latencies = timed_rebuild(path, batch_size, pause, datetime(2099, 1, 1) + timedelta(days=run))
+            runs[label] = (latencies, seconds)
+
+        conn = sqlite3.connect(path)
+        missing = conn.execute("SELECT COUNT(*) FROM services WHERE ts_epoch IS NULL AND timestamp IS NOT NULL").fetchone()[0]
+        drift = check_rollups(conn)
+        with conn:
+            conn.execute("UPDATE services SET student = student || ' (moved)', goal_id = 'G-moved' WHERE id % 97 = 0")
+            conn.execute("UPDATE services SET day_key = day_key + 1, duration = NULL, score = score + 1 WHERE id % 89 = 0")
+        updated_drift = check_rollups(conn)
+        conn.close()
+
+    estimate = next(r for r in estimates if r["step"].startswith("backfill"))
+    print(f"\nBackfill estimate {estimate['seconds']:.2f}s for {estimate['rows']:,} rows")
+    print(f"{'mode':<18}{'step s':>11}{'inserts':>9}{'p50 ms':>9}{'max ms':>10}")
+    for label, (latencies, seconds) in runs.items():
+        ordered = sorted(latencies) or [float("nan")]
+        print(f"{label:<18}{seconds:>11.2f}{len(latencies):>9}{ordered[len(ordered) // 2] * 1000:>9.1f}"
+              f"{ordered[-1] * 1000:>10.1f}")
+    failed = False
+    if missing:
+        print(f"FAIL: {missing} rows left without ts_epoch")
+        failed = True
+    for label, groups in (("after migrating", drift), ("after updates", updated_drift)):
+        if any(groups.values()):
+            print(f"FAIL: rollups drifted {label}: {groups}")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
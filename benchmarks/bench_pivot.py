@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Pivot table benchmark: pd.pivot_table with margins vs PivotEngine.
+
+    python -m benchmarks.bench_pivot [--rows 1000000] [--db bench_pivot.db]
+
+The database is built once and reused on later runs with the same size.
+Afterwards a small database with NULL and blank students, services and goals
+(and unparseable timestamps) checks that pivots from SQLite (rollup or GROUP
+BY) and the overview numbers from the summary tables and DuckDB match the
+frame's.
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from Services_Analytics import (
+    DuckDBBackend, PandasBackend, PivotEngine, duckdb_available, overview_metrics, read_rollups, read_services,
+    rollup_overview_metrics
+)
+from benchmarks.synthetic import build_database, insert_records, synthetic_records
+
+CASES = [
+    (["student"], ["service"], "duration", "mean"),
+    (["student"], ["service"], "count", "count"),
+    (["service"], ["month"], "score", "sum"),
+    (["student", "month"], ["event"], "score", "mean"),
+    (["device_id"], ["weekday"], "duration", "max"),
+    (["service"], ["week"], "score", "max"),
+]
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def baseline(df, rows, cols, values, agg):
+    """What create_pivot_table used to do on every rerun"""
+    pivot_values, pivot_agg = ("id", "count") if values == "count" else (values, agg)
+    return pd.pivot_table(df, values=pivot_values, index=rows, columns=cols or None, aggfunc=pivot_agg,
+                          fill_value=0, margins=True, margins_name="Total")
+
+def open_database(path, n_rows):
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        if conn.execute("SELECT COUNT(*) FROM services").fetchone()[0] >= n_rows * 0.99:
+            return conn
+        conn.close()
+        os.remove(path)
+    print(f"Building {path} with {n_rows:,} rows...")
+    return build_database(path, n_rows)
+
+def same_stats(a, b):
+    return a.keys() == b.keys() and all(np.isclose(a[k], b[k], equal_nan=True) for k in a)
+
+def blank_key_problems(directory):
+    """Every path must agree once NULL and blank keys are in the data.
+
+    Pivots with only a connection (rollup or GROUP BY) are compared with the
+    frame's, and the overview numbers from the summary tables (and DuckDB,
+    when it can start) with those from the frame.
+    """
+    path = os.path.join(directory, "blank_keys.db")
+    conn = build_database(path, 2_000)
+    extra = synthetic_records(60, seed=1)
+    extra.loc[:9, "student"] = None
+    extra.loc[10:19, "student"] = ""
+    extra.loc[20:29, "service"] = None
+    extra.loc[30:39, "service"] = ""
+    extra.loc[40:49, "goal_id"] = ""
+    extra.loc[50:, "timestamp"] = "not a timestamp"
+    problems = []
+    for label in ("without blanks", "with blanks"):
+        if label == "with blanks":
+            insert_records(conn, extra)
+        df = read_services(conn)
+        for rows, cols, values, agg in CASES:
+            plan = PivotEngine.plan(rows, cols, values, agg, conn)
+            expected = PivotEngine().pivot(rows, cols, values, agg, 1, frame=df)
+            got = PivotEngine().pivot(rows, cols, values, agg, 1, conn=conn)
+            aligned = got.reindex(index=expected.index, columns=expected.columns)
+            if aligned.shape != got.shape or not np.allclose(aligned.astype(float), expected.astype(float)):
+                problems.append(f"{label}: {plan} pivot of {rows} x {cols} {values}/{agg} differs from pandas")
+
+        since_day = int(df['day_key'].median())
+        expected = overview_metrics(PandasBackend(df), since_day)
+        others = {"summary tables": rollup_overview_metrics(read_rollups(conn), since_day)}
+        if duckdb_available():
+            try:
+                others["duckdb"] = overview_metrics(DuckDBBackend(db_file=path), since_day)
+            except RuntimeError:
+                pass  # No sqlite extension offline; the other paths are still compared
+        for name, stats in others.items():
+            if not same_stats(stats, expected):
+                problems.append(f"{label}: overview from {name} {stats} differs from pandas {expected}")
+    conn.close()
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--db", default="bench_pivot.db")
+    args = parser.parse_args(argv)
+
+    conn = open_database(args.db, args.rows)
+    df, load_s = timed(lambda: read_services(conn))
+    print(f"{len(df):,} rows loaded in {load_s:.2f}s\n")
+
+    print("pivot_table = old create_pivot_table; frame = engine on the loaded frame;")
+    print("sqlite = engine with only a connection (no frame load); warm = memoised rerun\n")
+    print(f"{'rows x cols':<28}{'values/agg':<16}{'pivot_table':>12}{'frame':>9}{'sqlite':>16}{'warm':>10}")
+    for rows, cols, values, agg in CASES:
+        expected, base_s = timed(lambda: baseline(df, rows, cols, values, agg))
+        engine = PivotEngine()
+        from_frame, frame_s = timed(lambda: engine.pivot(rows, cols, values, agg, 1, frame=df))
+        _, warm_s = timed(lambda: engine.pivot(rows, cols, values, agg, 1, frame=df))
+        from_sql, sql_s = timed(lambda: PivotEngine().pivot(rows, cols, values, agg, 1, conn=conn))
+
+        # pivot_table leaves NaN margins for groups whose values are all missing; the engine reports 0
+        expected = expected.fillna(0)
+        for got in (from_frame, from_sql):
+            aligned = got.reindex(index=expected.index, columns=expected.columns)
+            if aligned.shape != got.shape or not np.allclose(aligned.astype(float), expected.astype(float)):
+                raise SystemExit(f"Mismatch for {rows} x {cols} {values}/{agg}")
+
+        label = f"{'+'.join(rows)} x {'+'.join(cols) or '-'}"
+        plan = PivotEngine.plan(rows, cols, values, agg, conn)
+        print(f"{label:<28}{values + '/' + agg:<16}{base_s:>11.3f}s{frame_s:>8.3f}s"
+              f"{sql_s:>8.3f}s ({plan:<6}){warm_s * 1000:>8.3f}ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        problems = blank_key_problems(tmp)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
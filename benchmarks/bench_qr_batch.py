@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+QR batch benchmark: one card at a time (as generate_qr does) vs generate_batch.
+
+    python -m benchmarks.bench_qr_batch [--cards 300] [--workers N] [--no-pin]
+
+The per-card baseline derives the PIN key for every card and renders serially;
+the batch derives it once and renders across a process pool.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+from QR_Code_Maker_for_Services_Tracker import (
+    build_payload, encode_payload, generate_batch, get_fernet_key_from_pin, read_roster, render_qr
+)
+from benchmarks.synthetic import SERVICES
+
+PIN = "2468"
+
+def write_roster(path, n_cards):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["student", "service", "default_duration", "goal_id", "label"])
+        for i in range(n_cards):
+            service = SERVICES[i % len(SERVICES)]
+            writer.writerow([f"Student {i // 3 + 1}", service, 30, f"G{i % 3 + 1}", f"Student {i // 3 + 1} - {service}"])
+
+def one_at_a_time(roster, out_dir, pin):
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    for index, row in enumerate(read_roster(roster), 1):
+        payload = build_payload(row["student"], row["service"], row["default_duration"], row["goal_id"])
+        data = encode_payload(payload, get_fernet_key_from_pin(pin) if pin else None)
+        render_qr(data, row["label"]).save(os.path.join(out_dir, f"{index:05d}.png"))
+    return index, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cards", type=int, default=300)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--no-pin", action="store_true", help="Benchmark unencrypted payloads")
+    args = parser.parse_args(argv)
+    pin = None if args.no_pin else PIN
+
+    with tempfile.TemporaryDirectory() as tmp:
+        roster = os.path.join(tmp, "roster.csv")
+        write_roster(roster, args.cards)
+        cards, serial_s = one_at_a_time(roster, os.path.join(tmp, "serial"), pin)
+        batch = generate_batch(roster, os.path.join(tmp, "batch"), pin, workers=args.workers)
+        written = len(os.listdir(os.path.join(tmp, "batch")))
+
+    print(f"{'one at a time':<16}{serial_s:>8.2f}s{cards / serial_s:>10.1f} cards/s")
+    print(f"{'generate_batch':<16}{batch['seconds']:>8.2f}s{batch['cards_per_s']:>10.1f} cards/s"
+          f"  ({os.cpu_count()} CPUs)")
+    if written != cards or batch["cards"] != cards:
+        print(f"FAIL: expected {cards} cards, batch wrote {written}")
+        return 1
+    print(f"OK: {serial_s / batch['seconds']:.1f}x faster")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Report attachment benchmark: plain CSV vs sealed (gzip + AES-GCM) reports.
+
+    python -m benchmarks.bench_reports [--rows 1000 5000 20000]
+
+For each report size: attachment and email size, tracker write time, and
+aggregator import time for a plain CSV, a plain CSV with a PIN (fields tried
+one by one, key derived once), and a sealed report. Before this change every
+field also re-derived the PBKDF2 key; that cost is measured on a sample of
+fields and extrapolated, since running it in full takes minutes per report.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from Services_Aggregator import get_fernet_key_from_pin, import_csv_file, init_schema, try_decrypt
+from Services_Reports import SEALED_SUFFIX
+from Services_Tracker import report_message, write_report_csv
+from benchmarks.synthetic import synthetic_records
+
+PIN = "2468"
+SAMPLE_FIELDS = 20
+
+def report_rows(n_rows, seed=0):
+    """get_services()-shaped rows: (id, timestamp, student, service, duration, event, score, goal, device, reported)"""
+    records = synthetic_records(n_rows, seed=seed)
+    records = records.astype(object).where(records.notna(), None)
+    return [(i, r.timestamp, r.student, r.service, r.duration, r.event, r.score, r.goal_id, r.device_id, 0)
+            for i, r in enumerate(records.itertuples(index=False), 1)]
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def import_seconds(tmp, path, pin):
+    """Import path into a fresh aggregator database; return (rows imported, seconds)."""
+    db = os.path.join(tmp, "aggregated.db")
+    if os.path.exists(db):
+        os.remove(db)
+    conn = sqlite3.connect(db)
+    init_schema(conn)
+    (imported, _), seconds = timed(import_csv_file, conn, path, pin, "bench", os.path.basename(path))
+    conn.close()
+    return imported, seconds
+
+def per_field_pbkdf2_seconds(path):
+    """Seconds per field when every field derives its own key (the old behaviour)."""
+    with open(path) as f:
+        fields = [cell for line in f.readlines()[1:SAMPLE_FIELDS] for cell in line.rstrip("\n").split(",") if cell]
+    fields = fields[:SAMPLE_FIELDS]
+    start = time.perf_counter()
+    for cell in fields:
+        get_fernet_key_from_pin.cache_clear()
+        try_decrypt(cell, PIN)
+    return (time.perf_counter() - start) / len(fields)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 5_000, 20_000])
+    args = parser.parse_args(argv)
+
+    print(f"{'rows':>7}  {'format':<22}{'file KB':>9}{'email KB':>10}{'write s':>9}{'import s':>10}{'imported':>10}")
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in args.rows:
+            rows = report_rows(n_rows)
+            plain = os.path.join(tmp, "report.csv")
+            sealed = os.path.join(tmp, "report" + SEALED_SUFFIX)
+            _, plain_write = timed(write_report_csv, plain, rows)
+            _, sealed_write = timed(write_report_csv, sealed, rows, PIN)
+            sizes = {path: (os.path.getsize(path), len(report_message(path, "to@localhost", "from@localhost").as_bytes()))
+                     for path in (plain, sealed)}
+            fields = sum(1 for row in rows for cell in row[:9] if cell not in (None, ""))
+
+            cases = [("plain CSV", plain, None, plain_write),
+                     ("plain CSV + PIN", plain, PIN, plain_write),
+                     ("sealed", sealed, PIN, sealed_write)]
+            results = {}
+            for label, path, pin, write_s in cases:
+                imported, import_s = import_seconds(tmp, path, pin)
+                results[label] = imported
+                file_bytes, mail_bytes = sizes[path]
+                print(f"{n_rows:>7}  {label:<22}{file_bytes / 1024:>9.0f}{mail_bytes / 1024:>10.0f}"
+                      f"{write_s:>9.3f}{import_s:>10.3f}{imported:>10}")
+            old_s = per_field_pbkdf2_seconds(plain) * fields
+            print(f"{n_rows:>7}  {'before: key per field':<22}{'':>9}{'':>10}{'':>9}{old_s:>10.0f}{'(est.)':>10}")
+            if len(set(results.values())) != 1:
+                print(f"FAIL: formats imported different row counts {results}")
+                failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
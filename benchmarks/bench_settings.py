@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Settings benchmark: keyring and SQLite lookups per report send, with and without SettingsCache.
+
+    python -m benchmarks.bench_settings [--sends 20] [--latency 0.2]
+
+Each send does what email_csv does: read the last recipient, read the
+sender's address and password, and save the recipient. The keyring is a
+local in-memory backend that sleeps --latency seconds per call, standing in
+for Windows Credential Manager or Secret Service. Reports keyring and SQLite
+calls and seconds for the direct lookups and for the cache, then checks that
+changed credentials are picked up without another keyring read, and that a
+failed keyring write or read never leaves the cache (or a report) without them.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import keyring
+from keyring.backend import KeyringBackend
+from keyring.errors import KeyringLocked, PasswordDeleteError, PasswordSetError
+
+from Services_Tracker import KEYRING_PIN_KEY, KEYRING_SERVICE, PROVIDERS, ServiceDB, SettingsCache, TouchApp
+
+RECIPIENT = "office@localhost"
+
+class SlowKeyring(KeyringBackend):
+    """In-memory keyring that counts calls and sleeps latency seconds in each."""
+    priority = 1
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+        self.passwords = {}
+        self.calls = 0
+        self.locked = False  # Reads and writes fail, as with a locked Secret Service collection
+
+    def _call(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def get_password(self, service, username):
+        self._call()
+        if self.locked:
+            raise KeyringLocked("keyring is locked")
+        return self.passwords.get((service, username))
+
+    def set_password(self, service, username, password):
+        self._call()
+        if self.locked:
+            raise PasswordSetError("keyring is locked")
+        self.passwords[(service, username)] = password
+
+    def delete_password(self, service, username):
+        self._call()
+        if self.passwords.pop((service, username), None) is None:
+            raise PasswordDeleteError(username)
+
+class CountingDB(ServiceDB):
+    """ServiceDB that counts settings reads and writes."""
+
+    def __init__(self, db_file):
+        self.setting_calls = 0
+        super().__init__(db_file)
+
+    def get_setting(self, key):
+        self.setting_calls += 1
+        return super().get_setting(key)
+
+    def set_setting(self, key, value):
+        self.setting_calls += 1
+        super().set_setting(key, value)
+
+def direct_send(db, smtp):
+    db.get_setting("last_recipient_email")
+    keyring.get_password(KEYRING_SERVICE, smtp["email_key"])
+    keyring.get_password(KEYRING_SERVICE, smtp["password_key"])
+    db.set_setting("last_recipient_email", RECIPIENT)
+
+def cached_send(settings, smtp):
+    settings.setting("last_recipient_email")
+    settings.secret(smtp["email_key"])
+    settings.secret(smtp["password_key"])
+    settings.set_setting("last_recipient_email", RECIPIENT)
+
+def failure_problems(backend, smtp):
+    """A failed keyring write must not be cached, and an unreadable PIN must not read as no PIN"""
+    problems = []
+    settings = SettingsCache(None)
+    settings.secret(smtp["password_key"])
+    backend.locked = True
+    try:
+        settings.set_secret(smtp["password_key"], "unsaved")
+    except PasswordSetError:
+        pass
+    backend.locked = False
+    if settings.secret(smtp["password_key"]) != backend.passwords.get((KEYRING_SERVICE, smtp["password_key"])):
+        problems.append("a password the keyring refused is still served from the cache")
+
+    # TouchApp.pin without building the window: only its settings are needed
+    app = TouchApp.__new__(TouchApp)
+    app.settings = SettingsCache(None)
+    backend.passwords[(KEYRING_SERVICE, KEYRING_PIN_KEY)] = "1234"
+    backend.locked = True
+    try:
+        if app.pin is not None:
+            problems.append("an unreadable PIN looks like no PIN, so reports would go out unencrypted")
+    finally:
+        backend.locked = False
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sends", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per keyring call")
+    args = parser.parse_args(argv)
+
+    smtp = PROVIDERS["Microsoft"]
+    backend = SlowKeyring(args.latency)
+    previous = keyring.get_keyring()
+    keyring.set_keyring(backend)
+    failed = False
+    try:
+        backend.passwords = {(KEYRING_SERVICE, smtp["email_key"]): "teacher@localhost",
+                             (KEYRING_SERVICE, smtp["password_key"]): "secret"}
+        print(f"{'lookups':<8}{'sends':>7}{'keyring':>9}{'sqlite':>8}{'seconds':>9}{'ms/send':>9}")
+        with tempfile.TemporaryDirectory() as tmp:
+            for label in ("direct", "cached"):
+                db = CountingDB(os.path.join(tmp, f"{label}.db"))
+                settings = SettingsCache(db)
+                send, target = (direct_send, db) if label == "direct" else (cached_send, settings)
+                backend.calls = 0
+                start = time.perf_counter()
+                for _ in range(args.sends):
+                    send(target, smtp)
+                seconds = time.perf_counter() - start
+                print(f"{label:<8}{args.sends:>7}{backend.calls:>9}{db.setting_calls:>8}{seconds:>9.2f}"
+                      f"{seconds / args.sends * 1000:>9.1f}")
+
+            # The cached run's first send loads 2 secrets and 1 setting and saves the recipient once
+            if backend.calls > 2 or db.setting_calls > 2:
+                print(f"FAIL: repeated sends still reached the keyring ({backend.calls}) or SQLite ({db.setting_calls})")
+                failed = True
+            settings.set_secret(smtp["password_key"], "changed")
+            settings.delete_secret(smtp["email_key"])
+            calls = backend.calls
+            if settings.secret(smtp["password_key"]) != "changed" or settings.secret(smtp["email_key"]) is not None:
+                print("FAIL: changed credentials not seen through the cache")
+                failed = True
+            elif backend.calls != calls:
+                print("FAIL: reading changed credentials went back to the keyring")
+                failed = True
+        backend.latency = 0
+        for problem in failure_problems(backend, smtp):
+            print(f"FAIL: {problem}")
+            failed = True
+    finally:
+        keyring.set_keyring(previous)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark: import time and time to first frame for each app.
+
+    python -m benchmarks.bench_startup [--apps tracker qr_maker aggregator] [--repeat 5]
+
+Import time is the median of --repeat fresh interpreters running
+"python -X importtime -c 'import <module>'", with the slowest imports listed
+under it. Any heavy dependency that should only load on first use (OpenCV,
+Pillow, cryptography, SMTP/IMAP, keyring) showing up at import is a failure.
+
+Time to first frame starts a fresh interpreter in an empty folder that builds
+the app's window and draws it once; it is measured from process start. For the
+tracker it then keeps drawing until the background warm-up has loaded the QR
+detector, and reports that too. Needs a display: without one it is reported
+as skipped, not failed.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# App name -> (module, window class, modules that must not load before first use)
+APPS = {
+    "tracker": ("Services_Tracker", "TouchApp", ("cv2", "keyring", "smtplib", "cryptography.fernet")),
+    "qr_maker": ("QR_Code_Maker_for_Services_Tracker", "QRCodeGeneratorApp", ("PIL", "qrcode", "cryptography.fernet")),
+    "aggregator": ("Services_Aggregator", "ServiceAggregatorApp", ("imaplib", "cryptography.fernet")),
+}
+TOP_IMPORTS = 5
+WARM_UP_TIMEOUT = 30.0
+
+FIRST_FRAME_SCRIPT = r'''
+import importlib, sys, time
+sys.path.insert(0, {root!r})
+module = importlib.import_module({module!r})
+app = getattr(module, {cls!r})()
+app.update()
+print("first_frame", flush=True)
+if {module!r} == "Services_Tracker":
+    deadline = time.monotonic() + {timeout!r}
+    while module._detector is None and time.monotonic() < deadline:
+        app.update()
+        time.sleep(0.01)
+    print("warm" if module._detector is not None else "warm_timeout", flush=True)
+app.destroy()
+'''
+
+def import_times(module):
+    """One -X importtime run: (imported module, cumulative us, depth) in the order Python reports them."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), int(cumulative), depth))
+    return times
+
+def module_imports(times, module):
+    """module's cumulative us and its direct imports as [(us, name)], slowest first.
+
+    Each module is reported after everything it imported, so its direct imports
+    are the depth-1 lines since the previous top-level one.
+    """
+    end = next(i for i, (name, _, depth) in enumerate(times) if name == module and depth == 0)
+    start = max((i for i in range(end) if times[i][2] == 0), default=-1) + 1
+    children = sorted(((us, name) for name, us, depth in times[start:end] if depth == 1), reverse=True)
+    return times[end][1], children
+
+def first_frame(module, cls):
+    """Seconds from process start to the first drawn frame (and warm-up), or the reason it could not run."""
+    script = FIRST_FRAME_SCRIPT.format(root=ROOT, module=module, cls=cls, timeout=WARM_UP_TIMEOUT)
+    marks = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-c", script], cwd=tmp,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for line in proc.stdout:
+            marks[line.strip()] = time.perf_counter() - start
+        error = proc.stderr.read().strip()
+        proc.wait()
+    if "first_frame" not in marks:
+        last = error.splitlines()[-1] if error else f"exit status {proc.returncode}"
+        return None, "skipped (no display)" if "display" in last.lower() else f"failed: {last}"
+    return marks, ""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--apps", nargs="+", choices=sorted(APPS), default=list(APPS))
+    parser.add_argument("--repeat", type=int, default=5, help="Interpreters per import-time median")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for name in args.apps:
+        module, cls, deferred = APPS[name]
+        runs = [import_times(module) for _ in range(args.repeat)]
+        total = statistics.median(module_imports(run, module)[0] for run in runs) / 1000
+        print(f"\n{name}: import {module} {total:.1f} ms (median of {args.repeat})")
+        for us, imported in module_imports(runs[-1], module)[1][:TOP_IMPORTS]:
+            print(f"    {imported:<40}{us / 1000:>8.1f} ms")
+        seen = {imported for imported, _, _ in runs[-1]}
+        loaded = [m for m in deferred if m in seen]
+        if loaded:
+            print(f"    FAIL: loaded at import, should wait for first use: {', '.join(loaded)}")
+            failed = True
+
+        marks, note = first_frame(module, cls)
+        if marks is None:
+            print(f"    first frame: {note}")
+            if note.startswith("failed"):
+                failed = True
+            continue
+        print(f"    first frame {marks['first_frame'] * 1000:.0f} ms after process start")
+        if "warm" in marks:
+            print(f"    warm-up done {marks['warm'] * 1000:.0f} ms after process start")
+        elif "warm_timeout" in marks:
+            print(f"    FAIL: warm-up did not finish within {WARM_UP_TIMEOUT:.0f}s")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
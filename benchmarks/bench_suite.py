@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Pipeline benchmark suite: tracker logging/export, aggregator import and dashboard queries.
+
+    python -m benchmarks.bench_suite [--rows 100000] [--students 400] [--devices 20]
+                                     [--services 8] [--goals 3] [--years 1] [--repeat 3]
+                                     [--baseline FILE] [--threshold 0.2]
+
+All data is synthetic and deterministic for a given configuration. Results are
+saved as JSON under bench_results/ and compared with the newest earlier run of
+the same configuration (or --baseline): any benchmark whose median time grew
+by more than --threshold is flagged, and the exit status is then 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from Services_Aggregator import import_csv_file, init_schema
+from Services_Analytics import (
+    PivotEngine, count_matching, filter_frame, read_matching, read_services, service_filter_sql
+)
+from Services_Tracker import write_report_csv
+from benchmarks.synthetic import (
+    build_tracker_database, insert_records, service_names, synthetic_records, write_report_csvs
+)
+
+RESULTS_DIR = "bench_results"
+LOG_SERVICE_CALLS = 200  # Each call opens its own connection and commits, like the tablet app
+DETAIL_PAGE_ROWS = 100
+
+def benchmark(name):
+    """Register a benchmark: a function of the context returning (run, items).
+
+    Everything before the return is setup; only run() is timed, once per repeat.
+    """
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+BENCHMARKS = {}
+
+@benchmark("tracker.log_service")
+def bench_log_service(ctx):
+    db = ctx["tracker_db"]
+    student_id = db.get_students()[0][0]
+
+    def run():
+        for i in range(LOG_SERVICE_CALLS):
+            db.log_service(student_id, "OT", "30", "session", str(i % 100), "G1")
+    return run, LOG_SERVICE_CALLS
+
+@benchmark("tracker.export")
+def bench_export(ctx):
+    db, path = ctx["tracker_db"], os.path.join(ctx["tmp"], "export.csv")
+
+    def run():
+        write_report_csv(path, db.get_services(only_new=True))
+    return run, ctx["rows"]
+
+@benchmark("aggregator.import")
+def bench_import(ctx):
+    paths = ctx["attachments"]
+    counter = iter(range(1_000_000))
+
+    def run():
+        # A fresh database each repeat, so every row is new
+        conn = sqlite3.connect(os.path.join(ctx["tmp"], f"import_{next(counter)}.db"))
+        init_schema(conn)
+        for path in paths:
+            import_csv_file(conn, path, source_email="bench@example.org", source_file=os.path.basename(path))
+        conn.close()
+    return run, ctx["rows"]
+
+@benchmark("dashboard.load")
+def bench_load(ctx):
+    conn = ctx["aggregated"]
+    return (lambda: read_services(conn)), ctx["rows"]
+
+@benchmark("dashboard.pivot")
+def bench_pivot(ctx):
+    df = ctx["frame"]
+
+    def run():
+        engine = PivotEngine()
+        engine.pivot(["student"], ["service"], "duration", "mean", 1, frame=df)
+        engine.pivot(["service", "month"], ["event"], "score", "max", 1, frame=df)
+    return run, ctx["rows"]
+
+@benchmark("dashboard.filter_frame")
+def bench_filter_frame(ctx):
+    df, filters = ctx["frame"], ctx["filters"]
+    return (lambda: filter_frame(df, **filters)), ctx["rows"]
+
+@benchmark("dashboard.filter_sql")
+def bench_filter_sql(ctx):
+    conn = ctx["aggregated"]
+    where, params = service_filter_sql(**ctx["filters"])
+
+    def run():
+        count_matching(conn, where, params)
+        read_matching(conn, where, params, limit=DETAIL_PAGE_ROWS)
+    return run, ctx["rows"]
+
+def prepare(config, tmp):
+    """Build every data set the benchmarks need from one deterministic configuration"""
+    kwargs = dict(students=config["students"], devices=config["devices"], services=config["services"],
+                  goals=config["goals"], days=int(config["years"] * 365), seed=config["seed"])
+    rows = config["rows"]
+    records = synthetic_records(rows, **kwargs)
+    aggregated = sqlite3.connect(os.path.join(tmp, "aggregated.db"))
+    init_schema(aggregated)
+    insert_records(aggregated, records.assign(source_email="bench@example.org"))
+    frame = read_services(aggregated)
+    last_day = frame["date"].max().date()
+    return {
+        "tmp": tmp,
+        "rows": rows,
+        "tracker_db": build_tracker_database(os.path.join(tmp, "tracker.db"), rows, **kwargs),
+        "attachments": write_report_csvs(os.path.join(tmp, "attachments"), records),
+        "aggregated": aggregated,
+        "frame": frame,
+        "filters": {
+            "students": sorted(frame["student"].unique())[:10],
+            "services": service_names(config["services"])[:2],
+            "day_range": (last_day - timedelta(days=90), last_day),
+            "min_score": 60,
+        },
+    }
+
+def run_benchmarks(ctx, names, repeat):
+    results = {}
+    for name in names:
+        run, items = BENCHMARKS[name](ctx)
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            runs.append(time.perf_counter() - start)
+        median = sorted(runs)[len(runs) // 2]
+        results[name] = {"median_s": median, "min_s": min(runs), "runs_s": runs,
+                         "items": items, "items_per_s": items / median if median else None}
+        print(f"{name:<26}{median:>10.3f}s{items / median if median else 0:>14,.0f}/s")
+    return results
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "sqlite": sqlite3.sqlite_version, "pandas": pd.__version__, "commit": commit}
+
+def find_baseline(out_dir, config):
+    """Newest saved result with the same configuration, or None"""
+    if not os.path.isdir(out_dir):
+        return None
+    for name in sorted(os.listdir(out_dir), reverse=True):
+        if name.endswith(".json"):
+            with open(os.path.join(out_dir, name)) as f:
+                saved = json.load(f)
+            if saved.get("config") == config:
+                return os.path.join(out_dir, name)
+    return None
+
+def regressions(results, baseline, threshold):
+    """(name, old median, new median) for benchmarks slower than baseline by more than threshold"""
+    slower = []
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if old and result["median_s"] > old["median_s"] * (1 + threshold):
+            slower.append((name, old["median_s"], result["median_s"]))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--students", type=int, default=400)
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--services", type=int, default=8)
+    parser.add_argument("--goals", type=int, default=3)
+    parser.add_argument("--years", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Run just these benchmarks")
+    parser.add_argument("--out", default=RESULTS_DIR, help="Directory for JSON results")
+    parser.add_argument("--baseline", help="Result file to compare with (default: newest matching run)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown before flagging")
+    args = parser.parse_args(argv)
+    config = {key: getattr(args, key) for key in ("rows", "students", "devices", "services", "goals", "years", "seed")}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Generating {args.rows:,} rows ({args.students} students, {args.devices} devices, "
+              f"{args.services} services, {args.goals} goals, {args.years:g} years)...")
+        ctx = prepare(config, tmp)
+        print(f"\n{'benchmark':<26}{'median':>11}{'rows or calls':>15}")
+        results = run_benchmarks(ctx, args.only or list(BENCHMARKS), args.repeat)
+        ctx["aggregated"].close()
+
+    baseline_path = args.baseline or find_baseline(args.out, config)
+    os.makedirs(args.out, exist_ok=True)
+    out_path = os.path.join(args.out, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(out_path, "w") as f:
+        json.dump({"created": datetime.now().isoformat(timespec="seconds"), "config": config,
+                   "environment": environment(), "results": results}, f, indent=2)
+    print(f"\nSaved {out_path}")
+
+    if not baseline_path:
+        print("No earlier run with this configuration to compare against.")
+        return 0
+    with open(baseline_path) as f:
+        slower = regressions(results, json.load(f), args.threshold)
+    print(f"Compared with {baseline_path}: "
+          + (f"{len(slower)} regression(s)" if slower else f"no regressions over {args.threshold:.0%}"))
+    for name, old, new in slower:
+        print(f"REGRESSION: {name} {old:.3f}s -> {new:.3f}s ({new / old - 1:+.0%})")
+    return 1 if slower else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
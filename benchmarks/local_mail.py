@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Local SMTP and IMAP stand-ins for load tests.
+
+Just enough of each protocol for smtplib (EHLO, AUTH PLAIN, MAIL, RCPT, DATA)
+and for the imaplib calls fetch_and_import makes (LOGIN, SELECT, SEARCH
+SUBJECT, FETCH RFC822, LOGOUT). Messages sent to the SMTP server land in a
+shared Mailbox that the IMAP server serves. Any credentials are accepted.
+"""
+
+import email
+import imaplib
+import re
+import socketserver
+import threading
+
+class Mailbox:
+    """Thread-safe list of raw RFC 822 messages, numbered from 1 like an IMAP inbox."""
+
+    def __init__(self):
+        self._messages = []
+        self._lock = threading.Lock()
+
+    def append(self, raw):
+        with self._lock:
+            self._messages.append(raw)
+            return len(self._messages)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._messages)
+
+    def get(self, number):
+        with self._lock:
+            return self._messages[number - 1]
+
+    def search_subject(self, text):
+        with self._lock:
+            messages = list(self._messages)
+        text = text.lower()
+        return [n for n, raw in enumerate(messages, 1)
+                if text in str(email.message_from_bytes(raw, _class=email.message.Message).get("Subject", "")).lower()]
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # The default backlog of 5 overflows under dozens of simultaneous senders; Linux then
+    # drops completed handshakes and smtplib waits forever for a greeting
+    request_queue_size = 1024
+
+    def __init__(self, handler, mailbox, host="127.0.0.1", port=0):
+        super().__init__((host, port), handler)
+        self.mailbox = mailbox
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.reply("220 localhost stand-in SMTP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250-AUTH PLAIN")
+                self.reply("250 8BITMIME")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                self.server.mailbox.append(b"".join(lines))
+                self.reply("250 OK queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    # Responses go out as several writes; with Nagle on, each command stalls on the
+    # client's delayed ACK (~40 ms), which dominates a poll over hundreds of messages
+    disable_nagle_algorithm = True
+
+    def send(self, data):
+        self.wfile.write(data if isinstance(data, bytes) else data.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.send("* OK stand-in IMAP4rev1 ready")
+        mailbox = self.server.mailbox
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.decode("ascii", "replace").strip().split(" ", 2)
+            if len(parts) < 2:
+                continue
+            tag, command, args = parts[0], parts[1].upper(), parts[2] if len(parts) > 2 else ""
+            if command == "CAPABILITY":
+                self.send("* CAPABILITY IMAP4rev1 AUTH=PLAIN")
+            elif command == "SELECT":
+                self.send(f"* {len(mailbox)} EXISTS")
+                self.send("* 0 RECENT")
+                self.send(f"{tag} OK [READ-WRITE] SELECT completed")
+                continue
+            elif command == "SEARCH":
+                match = re.search(r'SUBJECT "([^"]*)"', args, re.IGNORECASE)
+                numbers = mailbox.search_subject(match.group(1)) if match else range(1, len(mailbox) + 1)
+                self.send("* SEARCH" + "".join(f" {n}" for n in numbers))
+            elif command == "FETCH":
+                number = int(args.split(" ", 1)[0])
+                raw = mailbox.get(number)
+                self.send(f"* {number} FETCH (RFC822 {{{len(raw)}}}".encode("ascii") + b"\r\n" + raw + b")\r\n")
+            elif command == "LOGOUT":
+                self.send("* BYE logging out")
+                self.send(f"{tag} OK LOGOUT completed")
+                return
+            elif command not in ("LOGIN", "NOOP", "CLOSE", "EXPUNGE"):
+                self.send(f"{tag} BAD unknown command")
+                continue
+            self.send(f"{tag} OK {command} completed")
+
+def start_smtp(mailbox, host="127.0.0.1", port=0):
+    """SMTP stand-in storing into mailbox; .port is the bound port, .stop() shuts it down."""
+    return _Server(_SMTPHandler, mailbox, host, port).start()
+
+def start_imap(mailbox, host="127.0.0.1", port=0):
+    """IMAP stand-in serving mailbox as INBOX."""
+    return _Server(_IMAPHandler, mailbox, host, port).start()
+
+def smtp_settings(server):
+    """PROVIDERS-style settings for Services_Tracker.send_email against a stand-in."""
+    return {"smtp_server": server.server_address[0], "smtp_port": server.port,
+            "use_ssl": False, "needs_starttls": False, "friendly": "Local stand-in"}
+
+def imap_factory(server):
+    """imap_factory for fetch_and_import connecting to a stand-in over plain IMAP."""
+    return lambda host: imaplib.IMAP4(server.server_address[0], server.port)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic service records for benchmarks.
+Deterministic for a given seed so runs can be compared.
+
+Builds the three artefacts of the pipeline: a tracker database (what one
+tablet holds), report CSV attachments (what the tracker emails) and an
+aggregated database (what the aggregator and dashboard read).
+"""
+
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from Services_Aggregator import EPOCH_SQL, SECONDS_PER_DAY, init_schema
+from Services_Analytics import add_time_features, compact_frame
+
+SERVICES = ["OT", "PT", "Speech", "Reading", "Math", "Counseling", "Behavior", "Social Skills"]
+EVENTS = ["session", "session", "session", "goal_progress", "absent"]
+
+def service_names(services=len(SERVICES)):
+    """The first `services` service names, numbered beyond the built-in list"""
+    extra = [f"Service {i}" for i in range(len(SERVICES) + 1, services + 1)]
+    return (SERVICES + extra)[:services]
+
+def synthetic_records(n_rows, students=400, devices=20, goals=3, days=365, seed=0, services=len(SERVICES)):
+    """DataFrame shaped like the aggregated services table (timestamp as text)"""
+    rng = np.random.default_rng(seed)
+    # Fixed in UTC: the wall-clock strings (and so day_key and months) must not depend on the host's time zone
+    end = int(datetime(2025, 6, 30, tzinfo=timezone.utc).timestamp())
+    ts = np.sort(end - rng.integers(0, days * SECONDS_PER_DAY, n_rows))
+    duration = rng.choice([15.0, 20.0, 30.0, 45.0, 60.0], n_rows)
+    score = rng.normal(75, 12, n_rows).clip(0, 100).round(1)
+    score[rng.random(n_rows) < 0.3] = np.nan
+    goal = rng.integers(0, goals + 1, n_rows)
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime(ts, unit="s").strftime("%Y-%m-%d %H:%M:%S"),
+        "student": np.char.add("Student ", rng.integers(1, students + 1, n_rows).astype(str)),
+        "service": rng.choice(service_names(services), n_rows),
+        "duration": duration,
+        "event": rng.choice(EVENTS, n_rows),
+        "score": score,
+        "goal_id": np.where(goal == 0, "", np.char.add("G", goal.astype(str))),
+        "device_id": np.char.add("tablet-", rng.integers(1, devices + 1, n_rows).astype(str)),
+        "source_email": "bench@example.org",
+        "source_file": np.char.add("services_", (np.arange(n_rows) // 500).astype(str)),
+    })
+
+def synthetic_frame(n_rows, seed=0, **kwargs):
+    """Dashboard-ready frame (as loaded from SQLite) without touching disk"""
+    records = synthetic_records(n_rows, seed=seed, **kwargs)
+    ts_epoch = pd.to_datetime(records["timestamp"]).astype("int64") // 10**9
+    df = records.drop(columns=["timestamp", "source_file"]).assign(
+        id=np.arange(1, n_rows + 1), ts_epoch=ts_epoch, day_key=ts_epoch // SECONDS_PER_DAY)
+    return compact_frame(add_time_features(df))
+
+def insert_records(conn, records, batch=100_000):
+    """Insert synthetic_records() rows the way the aggregator does, filling the epoch columns"""
+    epoch = EPOCH_SQL.format("?1")
+    query = f"""
+    INSERT OR IGNORE INTO services
+    (timestamp, ts_epoch, day_key, student, service, duration, event, score, goal_id, device_id,
+     source_email, source_file)
+    VALUES (?1, {epoch}, {epoch} / {SECONDS_PER_DAY}, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10)
+    """
+    records = records.astype(object).where(records.notna(), None)
+    with conn:
+        for start in range(0, len(records), batch):
+            conn.executemany(query, records.iloc[start:start + batch].itertuples(index=False, name=None))
+
+def build_database(path, n_rows, seed=0, **kwargs):
+    """Aggregated services database at path, filled through the normal schema and triggers"""
+    conn = sqlite3.connect(path)
+    init_schema(conn)
+    insert_records(conn, synthetic_records(n_rows, seed=seed, **kwargs))
+    return conn
+
+def build_tracker_database(path, n_rows, seed=0, **kwargs):
+    """Tracker (tablet) database at path with the same records, all still unreported"""
+    from Services_Tracker import ServiceDB
+
+    db = ServiceDB(path)
+    records = synthetic_records(n_rows, seed=seed, **kwargs)
+    ts_epoch = pd.to_datetime(records["timestamp"]).astype("int64") // 10**9
+    names = records["student"].unique()
+    with sqlite3.connect(path) as conn:
+        conn.executemany("INSERT OR IGNORE INTO students (name) VALUES (?)", ((name,) for name in names))
+        student_ids = dict(conn.execute("SELECT name, id FROM students"))
+        rows = records.assign(student_id=records["student"].map(student_ids), ts_epoch=ts_epoch,
+                              day_key=ts_epoch // SECONDS_PER_DAY)[[
+            "student_id", "timestamp", "ts_epoch", "day_key", "service", "duration", "event", "score",
+            "goal_id", "device_id"]]
+        rows = rows.astype(object).where(rows.notna(), None)
+        conn.executemany('''INSERT INTO services
+            (student_id, timestamp, ts_epoch, day_key, service, duration, event, score, goal_id, device_id,
+             schema_version, reported)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, 0)''', rows.itertuples(index=False, name=None))
+    return db
+
+def write_report_csvs(directory, records, rows_per_file=5_000):
+    """Report CSV attachments for records, split by device and size like emailed reports.
+
+    Returns the written paths. Rows use the tracker's report format
+    (Services_Tracker.REPORT_HEADER), numbered per device.
+    """
+    from Services_Tracker import write_report_csv
+
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for device, group in records.groupby("device_id", sort=True):
+        rows = group[["timestamp", "student", "service", "duration", "event", "score", "goal_id", "device_id"]]
+        rows = rows.astype(object).where(rows.notna(), "")
+        for part, start in enumerate(range(0, len(rows), rows_per_file)):
+            chunk = rows.iloc[start:start + rows_per_file]
+            numbered = [(start + i + 1, *row, 0) for i, row in enumerate(chunk.itertuples(index=False, name=None))]
+            path = os.path.join(directory, f"{device}_report_{part:04d}.csv")
+            write_report_csv(path, numbered)
+            paths.append(path)
+    return paths